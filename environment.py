@@ -16,10 +16,48 @@ Attributes:
     SUBMISSION_HOST (str): This is the server where this application will open an SSH session
         to execute tasks like submitting jobs through HTCondor or running McM submission scripts.
         For example: "lxplus.cern.ch".
+        Several servers can be provided as a comma separated list, for example:
+        "lxplus901.cern.ch,lxplus902.cern.ch". The healthiest and fastest one is chosen
+        for each operation. Jobs are only checked, removed and collected through the
+        host that submitted them, jobs submitted before the host was stored use the
+        first one, so keep the previously configured host first.
+    SUBMISSION_HOSTS (list[str]): Servers parsed from `SUBMISSION_HOST`.
     SERVICE_ACCOUNT_USERNAME (str): Username to authenticate to `SUBMISSION_HOST`
     SERVICE_ACCOUNT_PASSWORD (str): Password to authenticate to `SUBMISSION_HOST`
+    SSH_CONNECT_TIMEOUT (int): Timeout (in seconds) to open an SSH session
+        to `SUBMISSION_HOST`.
+    SSH_COMMAND_TIMEOUT (int): Default timeout (in seconds) for a remote command
+        or a file transfer. Long operations set their own timeout.
     REMOTE_DIRECTORY (str): This is the absolute folder path (into AFS or EOS) that stores
         all the required bundle files to submit a HTCondor job.
+    REMOTE_CACHE_DIRECTORY (str): This is the absolute folder path (into AFS or EOS) used as
+        a content-addressed cache for uploaded files. Files are stored by their SHA-256
+        checksum so identical files are only transferred once.
+        By default, it is the `.cache` folder inside `REMOTE_DIRECTORY`.
+    ARTIFACT_CACHE_DIRECTORY (str): Local folder that keeps built job input archives
+        by the checksum of their inputs, so identical archives are not built again.
+    ARTIFACT_CACHE_SIZE_MB (int): Maximum size (in MB) of `ARTIFACT_CACHE_DIRECTORY`.
+        The least recently used archives are removed once it is exceeded.
+    JOB_ARCHIVE_COMPRESSION (str): Compression of the job input archives, as
+        `<codec>:<level>` with codec `gzip` or `zstd`. The level can be left out,
+        6 is used for gzip and 3 for zstd. Generators can use their own
+        compression by adding `<generator>=<codec>:<level>` items separated by commas,
+        for example: "gzip:6,MadGraph5_aMCatNLO=zstd:3".
+        zstd requires the zstandard package, gzip is used if it is not installed.
+    JOB_ARCHIVE_CODECS (dict[str, str]): Compression by generator parsed from
+        `JOB_ARCHIVE_COMPRESSION`, the default one is stored as "*".
+    DUPLICATE_REUSE_MAX_AGE_DAYS (int): Maximum age (in days) of a finished gridpack
+        whose output is reused by a new gridpack with the same inputs. Older ones
+        are not reused and a new job is submitted.
+    JOB_PREPARER_WORKERS (int): Number of background threads that prepare the job
+        files of approved gridpacks before they are submitted.
+    JOB_RUNTIME_MARGIN (float): Safety margin applied to the longest runtime of previous
+        similar jobs when choosing the HTCondor job flavour, e.g. 1.5 requires a
+        flavour that allows 50% more time than that runtime.
+    RENDER_WORKERS (int): Number of threads that render the fragments and cards
+        requested at once through the bulk rendering API.
+    RENDER_CACHE_SIZE_MB (int): Maximum size (in MB) of the in-memory cache of rendered
+        fragments and cards. The least recently used ones are removed once it is exceeded.
     TICKETS_DIRECTORY (str): This is the absolute folder path (into AFS or EOS) that stores
         all the required bundle files to submit a MC request into McM based
         on a created Gridpack.
@@ -29,6 +67,15 @@ Attributes:
         CMS GEN repository is available at: https://github.com/cms-sw/genproductions.
     REPOSITORY_TICK_PAUSE (int): Minimum interval window (in seconds) to wait before
         performing an internal tick.
+    GRIDPACK_FILES_WATCH (bool): Watch `GRIDPACK_FILES_PATH` with inotify (Linux only) and
+        update the campaigns, cards, tunes and parsed files caches when files change,
+        instead of waiting for the next repository update. Set it to enable it.
+    GRIDPACK_FILES_WATCH_DEBOUNCE (float): Seconds without changes to wait before updating
+        the caches, so a burst of changes, like a pull, is applied at once.
+    REPOSITORY_SNAPSHOT_FILE (str): Local file that keeps the campaigns, cards, tunes and
+        GEN productions branches found in the last repository update, with the
+        GridpackFiles commit they come from. It is loaded at startup so the service
+        can validate requests before the first repository update finishes.
     AUTHORIZED (str): Authorized roles enabled to submit Gridpack jobs.
         The format for this field is the following: <ROLE_1>,<ROLE_2>,...,<ROLE_N>
     GRIDPACK_DIRECTORY (str): This is the absolute folder path (into AFS or EOS) that stores
@@ -65,12 +112,43 @@ TICK_INTERVAL: int = int(os.getenv("TICK_INTERVAL", "600"))
 REPOSITORY_UPDATE_INTERVAL: int = int(os.getenv("REPOSITORY_UPDATE_INTERVAL", "1800"))
 SERVICE_URL: str = os.getenv("SERVICE_URL", "")
 SUBMISSION_HOST: str = os.getenv("SUBMISSION_HOST", "")
+SUBMISSION_HOSTS: list[str] = [
+    h.strip() for h in SUBMISSION_HOST.split(",") if h.strip()
+]
 SERVICE_ACCOUNT_USERNAME: str = os.getenv("SERVICE_ACCOUNT_USERNAME", "")
 SERVICE_ACCOUNT_PASSWORD: str = os.getenv("SERVICE_ACCOUNT_PASSWORD", "")
+SSH_CONNECT_TIMEOUT: int = int(os.getenv("SSH_CONNECT_TIMEOUT", "30"))
+SSH_COMMAND_TIMEOUT: int = int(os.getenv("SSH_COMMAND_TIMEOUT", "900"))
 REMOTE_DIRECTORY: str = os.getenv("REMOTE_DIRECTORY", "")
+REMOTE_CACHE_DIRECTORY: str = os.getenv(
+    "REMOTE_CACHE_DIRECTORY", f"{REMOTE_DIRECTORY}/.cache"
+)
+ARTIFACT_CACHE_DIRECTORY: str = os.getenv("ARTIFACT_CACHE_DIRECTORY", "artifacts")
+ARTIFACT_CACHE_SIZE_MB: int = int(os.getenv("ARTIFACT_CACHE_SIZE_MB", "1024"))
+JOB_ARCHIVE_COMPRESSION: str = os.getenv("JOB_ARCHIVE_COMPRESSION", "gzip:6")
+JOB_ARCHIVE_CODECS: dict[str, str] = {
+    "*": "gzip:6",
+    **{
+        (c.split("=", 1)[0].strip() if "=" in c else "*"): c.split("=", 1)[-1].strip()
+        for c in JOB_ARCHIVE_COMPRESSION.split(",")
+        if c.strip()
+    },
+}
+DUPLICATE_REUSE_MAX_AGE_DAYS: int = int(os.getenv("DUPLICATE_REUSE_MAX_AGE_DAYS", "30"))
+JOB_PREPARER_WORKERS: int = int(os.getenv("JOB_PREPARER_WORKERS", "4"))
+JOB_RUNTIME_MARGIN: float = float(os.getenv("JOB_RUNTIME_MARGIN", "1.5"))
+RENDER_WORKERS: int = int(os.getenv("RENDER_WORKERS", "4"))
+RENDER_CACHE_SIZE_MB: int = int(os.getenv("RENDER_CACHE_SIZE_MB", "64"))
 TICKETS_DIRECTORY: str = os.getenv("TICKETS_DIRECTORY", "")
 GEN_REPOSITORY: str = os.getenv("GEN_REPOSITORY", "cms-sw/genproductions")
 REPOSITORY_TICK_PAUSE: int = int(os.getenv("REPOSITORY_TICK_PAUSE", "60"))
+GRIDPACK_FILES_WATCH: bool = bool(os.getenv("GRIDPACK_FILES_WATCH"))
+GRIDPACK_FILES_WATCH_DEBOUNCE: float = float(
+    os.getenv("GRIDPACK_FILES_WATCH_DEBOUNCE", "2")
+)
+REPOSITORY_SNAPSHOT_FILE: str = os.getenv(
+    "REPOSITORY_SNAPSHOT_FILE", "repository_snapshot.json"
+)
 AUTHORIZED: str = os.getenv("AUTHORIZED", "")
 GRIDPACK_DIRECTORY: str = os.getenv("GRIDPACK_DIRECTORY", "")
 GRIDPACK_FILES_PATH: str = os.getenv("GRIDPACK_FILES_PATH", "")
@@ -4,7 +4,8 @@ Module that contains start of the program, tick scheduler and web APIs
 
 import logging
 import json
-from flask import Flask, send_file, request, make_response
+from flask import Flask, Response, send_file, request, make_response
+from flask import stream_with_context
 from flask_restful import Api
 from environment import (
     GEN_REPOSITORY,
@@ -17,12 +18,21 @@ from environment import (
     DEBUG,
     HOST,
     PORT,
+    GRIDPACK_FILES_PATH,
+    GRIDPACK_FILES_WATCH,
+    GRIDPACK_FILES_WATCH_DEBOUNCE,
 )
 from src.tools.scheduler import Scheduler
 from src.controller import Controller, Gridpack, Database
 from src.tools.user import User
-from src.tools.utils import include_gridpack_ids
-
+from src.tools.ssh_executor import SSHExecutor
+from src.tools.artifact_cache import ARCHIVE_CACHE
+from src.tools.render_cache import RENDER_CACHE
+from src.tools.utils import clean_split
+from src.tools.bulk_render import ARTIFACT_FILES, ndjson_chunks, zip_chunks
+from src.tools.repository_tree import get_repository_tree
+from src.tools.validation_index import get_validation_index
+from src.tools.files_watcher import FilesWatcher
 
 app = Flask(__name__, static_folder="./frontend/static", template_folder="./frontend")
 api = Api(app)
@@ -97,6 +107,11 @@ def system_info():
             "gen_repository": GEN_REPOSITORY,
             "job_cores": controller.job_cores,
             "job_memory": controller.job_memory,
+            "uploads": SSHExecutor.get_upload_stats(),
+            "archive_cache": ARCHIVE_CACHE.get_stats(),
+            "render_cache": RENDER_CACHE.get_stats(),
+            "job_preparer": controller.job_preparer.get_stats(),
+            "ssh_hosts": controller.submission_hosts.get_states(),
         }
     )
 
@@ -124,6 +139,57 @@ def force_mcm_request():
     return output_text({"message": f"Request forced for {gridpack_id}"})
 
 
+def recommended_resources(gridpack_dict):
+    """
+    Cores and memory for a new gridpack that did not set them
+    """
+    return controller.recommend_resources(
+        gridpack_dict.get("generator"),
+        gridpack_dict.get("process"),
+        gridpack_dict.get("dataset"),
+    )
+
+
+def make_gridpacks(gridpack_dicts):
+    """
+    Make and validate the gridpacks of a request against one index of
+    the repository tree. Return the gridpacks and, if any of them is not
+    valid, a response body with every error of each of them.
+    """
+    index = get_validation_index()
+    gridpacks = []
+    errors = []
+    # Rows of the same dataset share the recommended resources
+    resources = {}
+    for row, gridpack_dict in enumerate(gridpack_dicts, 1):
+        try:
+            gridpack = Gridpack.make(gridpack_dict)
+        except Exception as ex:
+            errors.append({"row": row, "errors": [str(ex)]})
+            continue
+
+        key = tuple(gridpack_dict.get(k) for k in ("generator", "process", "dataset"))
+        if key not in resources:
+            resources[key] = recommended_resources(gridpack_dict)
+
+        defaults = resources[key]
+        gridpack_errors = gridpack.get_validation_errors(index, defaults=defaults)
+        if gridpack_errors:
+            errors.append({"row": row, "errors": gridpack_errors})
+
+        gridpacks.append(gridpack)
+
+    if not errors:
+        return gridpacks, None
+
+    if len(gridpack_dicts) == 1:
+        message = "\n".join(errors[0]["errors"])
+    else:
+        message = "\n".join(f'Row {e["row"]}: {"; ".join(e["errors"])}' for e in errors)
+
+    return gridpacks, {"message": message, "errors": errors}
+
+
 @app.route("/api/create", methods=["PUT"])
 def create_gridpack():
     """
@@ -137,17 +203,12 @@ def create_gridpack():
     if not isinstance(gridpacks, list):
         gridpacks = [gridpacks]
 
-    gridpack_ids = []
-    for gridpack_dict in gridpacks:
-        try:
-            gridpack = Gridpack.make(gridpack_dict)
-        except Exception as ex:
-            return output_text({"message": str(ex)}, code=400)
-
-        error = gridpack.validate()
-        if error:
-            return output_text({"message": error}, code=400)
+    gridpacks, errors = make_gridpacks(gridpacks)
+    if errors:
+        return output_text(errors, code=400)
 
+    gridpack_ids = []
+    for gridpack in gridpacks:
         gridpack_id = controller.create(gridpack)
         gridpack_ids.append(gridpack_id)
 
@@ -168,17 +229,12 @@ def create_approve_gridpack():
     if not isinstance(gridpacks, list):
         gridpacks = [gridpacks]
 
-    gridpack_ids = []
-    for gridpack_dict in gridpacks:
-        try:
-            gridpack = Gridpack.make(gridpack_dict)
-        except Exception as ex:
-            return output_text({"message": str(ex)}, code=400)
-
-        error = gridpack.validate()
-        if error:
-            return output_text({"message": error}, code=400)
+    gridpacks, errors = make_gridpacks(gridpacks)
+    if errors:
+        return output_text(errors, code=400)
 
+    gridpack_ids = []
+    for gridpack in gridpacks:
         gridpack_id = controller.create(gridpack)
         controller.approve(gridpack_id)
         gridpack_ids.append(gridpack_id)
@@ -259,6 +315,22 @@ def delete_gridpack():
     return output_text({"message": "OK"})
 
 
+@app.route("/api/resources")
+def get_resources():
+    """
+    API to get the recommended job cores and memory for a generator,
+    process and dataset based on the usage of previous jobs
+    """
+    generator = request.args.get("generator")
+    if not generator:
+        return output_text({"message": "Missing generator"}, code=400)
+
+    recommendation = controller.recommend_resources(
+        generator, request.args.get("process"), request.args.get("dataset")
+    )
+    return output_text(recommendation)
+
+
 @app.route("/api/get")
 def get_gridpacks():
     """
@@ -269,70 +341,135 @@ def get_gridpacks():
     return output_text([gridpacks, count])
 
 
-@app.route("/api/get_fragment/<string:gridpack_id>")
-def get_fragment(gridpack_id):
+def output_artifact(gridpack_id, artifact):
     """
-    API to get gridpack's fragment
+    Makes a Flask response with a rendered fragment or card of a gridpack.
+    It has an ETag, a hash of the content, requests that send it back
+    get an empty 304 response if it did not change. There is no
+    Last-Modified date, content changes with the GridpackFiles
+    repository without the gridpack being updated.
     """
-    database = Database()
+    database = controller.database
     gridpack_json = database.get_gridpack(gridpack_id)
     if not gridpack_json:
         return output_text({"message": "Gridpack not found"}, code=404)
 
-    gridpack = Gridpack.make(gridpack_json)
-    fragment, _ = controller.get_fragment(gridpack)
-
-    return output_text(fragment, headers={"Content-Type": "text/plain"})
-
+    original = None
+    original_id = gridpack_json.get("gridpack_reused")
+    if original_id and artifact != "fragment":
+        original = database.get_gridpack(original_id)
 
-@app.route("/api/get_run_card/<string:gridpack_id>")
-def get_run_card(gridpack_id):
-    """
-    API to get gridpack's run card
-    """
     try:
-        gridpack: Gridpack = controller.get_original_gridpack(gridpack_id=gridpack_id)
-        content = include_gridpack_ids(
-            gridpack_id=gridpack_id,
-            effective_gridpack_id=gridpack.get_id(),
-            content=gridpack.get_run_card(),
-        )
-        return output_text(content, headers={"Content-Type": "text/plain"})
-    except ValueError:
-        return output_text({"message": "Gridpack not found"}, code=404)
+        rendered = controller.get_rendered_artifact(gridpack_json, original, artifact)
     except AssertionError as a:
         return output_text({"message": str(a)}, code=400)
     except Exception:
         logging.error(
-            "Unable to retrieve `run_card` for Gridpack: %s", gridpack, exc_info=True
+            "Unable to retrieve `%s` for Gridpack: %s",
+            artifact,
+            gridpack_id,
+            exc_info=True,
         )
         return output_text({"message": "Unable to retrieve the element"}, code=400)
 
+    resp = output_text(rendered.content, headers={"Content-Type": "text/plain"})
+    resp.set_etag(rendered.etag)
+    # Clients may keep it but have to check if it changed
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+@app.route("/api/get_fragment/<string:gridpack_id>")
+def get_fragment(gridpack_id):
+    """
+    API to get gridpack's fragment
+    """
+    return output_artifact(gridpack_id, "fragment")
+
+
+@app.route("/api/get_run_card/<string:gridpack_id>")
+def get_run_card(gridpack_id):
+    """
+    API to get gridpack's run card
+    """
+    return output_artifact(gridpack_id, "run_card")
+
 
 @app.route("/api/get_customize_card/<string:gridpack_id>")
 def get_customize_card(gridpack_id):
     """
-    API to get gridpack's fragment
+    API to get gridpack's customize card
     """
-    try:
-        gridpack: Gridpack = controller.get_original_gridpack(gridpack_id=gridpack_id)
-        content = include_gridpack_ids(
-            gridpack_id=gridpack_id,
-            effective_gridpack_id=gridpack.get_id(),
-            content=gridpack.get_customize_card(),
-        )
-        return output_text(content, headers={"Content-Type": "text/plain"})
-    except ValueError:
-        return output_text({"message": "Gridpack not found"}, code=404)
-    except AssertionError as a:
-        return output_text({"message": str(a)}, code=400)
-    except Exception:
-        logging.error(
-            "Unable to retrieve `customize_card` for Gridpack: %s",
-            gridpack,
-            exc_info=True,
+    return output_artifact(gridpack_id, "customize_card")
+
+
+# Gridpack attributes the bulk rendering API can filter by
+RENDER_FILTERS = ("campaign", "generator", "process", "dataset", "status")
+
+
+def get_list_param(params, key):
+    """
+    Return a parameter given as a list or as a comma separated string
+    """
+    value = params.get(key) or []
+    if isinstance(value, str):
+        return clean_split(value)
+
+    if not isinstance(value, list):
+        value = [value]
+
+    return [str(v) for v in value]
+
+
+@app.route("/api/render", methods=["GET", "POST"])
+def render_artifacts():
+    """
+    API to get the fragments and cards of many gridpacks at once.
+    Gridpacks are chosen by "ids" and/or by campaign, generator, process,
+    dataset and status, each a list or a comma separated string, given as
+    request parameters or in a JSON body. "artifacts" chooses what to render,
+    all by default, and "format" is "ndjson" (default) or "zip".
+    """
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict):
+        params = request.args
+
+    gridpack_ids = get_list_param(params, "ids") or None
+    query = {}
+    for key in RENDER_FILTERS:
+        values = get_list_param(params, key)
+        if values:
+            query[key] = {"$in": values}
+
+    if not gridpack_ids and not query:
+        return output_text(
+            {"message": "Please choose gridpacks by ID or filter"}, code=400
         )
-        return output_text({"message": "Unable to retrieve the element"}, code=400)
+
+    artifacts = get_list_param(params, "artifacts") or list(ARTIFACT_FILES)
+    unknown = [a for a in artifacts if a not in ARTIFACT_FILES]
+    if unknown:
+        message = f"Unknown artifacts: {', '.join(unknown)}"
+        return output_text({"message": message}, code=400)
+
+    output_format = params.get("format", "ndjson")
+    if output_format not in ("ndjson", "zip"):
+        return output_text({"message": f'Unknown format "{output_format}"'}, code=400)
+
+    gridpack_jsons = controller.database.get_gridpacks_by_ids(gridpack_ids, query)
+    results = controller.render_artifacts(gridpack_jsons, artifacts)
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "X-Gridpack-Count": str(len(gridpack_jsons)),
+        "X-GridpackFiles-Commit": get_repository_tree().commit,
+    }
+    if output_format == "zip":
+        headers["Content-Disposition"] = "attachment; filename=gridpacks.zip"
+        chunks, mimetype = zip_chunks(results), "application/zip"
+    else:
+        chunks, mimetype = ndjson_chunks(results), "application/x-ndjson"
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
 
 
 def user_info_dict():
@@ -388,6 +525,29 @@ def set_scheduler():
     scheduler.add_job(tick_repository, REPOSITORY_UPDATE_INTERVAL)
 
 
+def set_files_watcher():
+    """
+    Watch the GridpackFiles checkout for changes, if it is enabled
+    """
+    logger = logging.getLogger()
+    if not GRIDPACK_FILES_WATCH:
+        return None
+
+    if not FilesWatcher.is_available():
+        logger.warning(
+            "Can not watch %s, inotify is not available", GRIDPACK_FILES_PATH
+        )
+        return None
+
+    watcher = FilesWatcher(
+        GRIDPACK_FILES_PATH,
+        controller.apply_file_changes,
+        GRIDPACK_FILES_WATCH_DEBOUNCE,
+    )
+    watcher.start()
+    return watcher
+
+
 def set_app():
     """
     Set the required configuration to start.
@@ -406,6 +566,7 @@ def main():
     set_app()
     set_scheduler()
     scheduler.start()
+    watcher = set_files_watcher()
     logger = logging.getLogger()
 
     logger.info("Will run on %s:%s", HOST, PORT)
@@ -413,6 +574,8 @@ def main():
         app.run(host=HOST, port=PORT, debug=DEBUG, use_reloader=False, threaded=True)
     finally:
         scheduler.stop()
+        if watcher:
+            watcher.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+"""
+Benchmark for the compression of job input archives.
+It builds the archive of a MadGraph gridpack with large card sets using
+each codec and level, and measures the build time, the archive size and
+the upload time to the in-process stand-in server. The transfer time at
+a given bandwidth is estimated too, as the stand-in runs on loopback.
+zstd levels are skipped if the zstandard package is not installed.
+
+Usage:
+    python3 scripts/benchmark_archive_codecs.py --cards 10 --card-kb 256 --bandwidth-mbps 100
+"""
+
+import os
+import sys
+import time
+import shutil
+import pathlib
+import argparse
+import tempfile
+import statistics
+from io import BytesIO
+
+# The stand-in maps every remote folder under /afs
+for key, value in {
+    "REMOTE_DIRECTORY": "/afs/gridpacks/jobs",
+    "TICKETS_DIRECTORY": "/afs/gridpacks/tickets",
+    "GRIDPACK_DIRECTORY": "/afs/gridpacks/storage",
+    "PUBLIC_STREAM_FOLDER": "/afs/gridpacks/logs",
+}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+# pylint: disable=wrong-import-position
+from ssh_stand_in import StandInServer
+from benchmark_job_archive import FILES_PATH, create_files, make_gridpack
+from src.tools.job_archive import JobArchive
+from src.tools.ssh_executor import SSHExecutor
+
+CODECS = [
+    ("gzip", 1),
+    ("gzip", 6),
+    ("gzip", 9),
+    ("zstd", 1),
+    ("zstd", 3),
+    ("zstd", 10),
+    ("zstd", 19),
+]
+
+
+def build(members, codec, level):
+    """
+    Compressed archive with the given members
+    """
+    archive = JobArchive(codec=codec, compresslevel=level)
+    archive.members = members
+    return archive.build()
+
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description="Job archive codecs benchmark")
+    parser.add_argument("--cards", type=int, default=10)
+    parser.add_argument("--card-kb", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--bandwidth-mbps", type=float, default=100)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+    create_files(FILES_PATH, ["DYJets_13p6TeV"], args.cards, args.card_kb)
+    initial_directory = os.getcwd()
+    username = os.environ["SERVICE_ACCOUNT_USERNAME"]
+    with tempfile.TemporaryDirectory() as work_directory, StandInServer(
+        prefixes=["/afs"], username=username, latency=args.latency_ms / 1000
+    ) as server:
+        os.chdir(work_directory)
+        members = make_gridpack(0, "DYJets_13p6TeV").get_job_archive().members
+        raw_size = sum(
+            len(c) if isinstance(c, bytes) else os.path.getsize(c)
+            for c in members.values()
+        )
+        print(f"Card set: {len(members)} files, {raw_size / 1024:.0f} KB")
+        print(
+            f"{'Codec':<8} {'Build':>10} {'Size':>10} {'Ratio':>7} "
+            f"{'Upload':>10} {f'@{args.bandwidth_mbps:g} Mbps':>12} {'Total':>10}"
+        )
+        with SSHExecutor(server.address, username, "") as ssh:
+            ssh.setup_ftp()
+            ssh.execute_command("mkdir -p /afs/benchmark")
+            for codec, level in CODECS:
+                if not JobArchive.is_available(codec):
+                    continue
+
+                build_times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    content = build(members, codec, level)
+                    build_times.append(time.perf_counter() - start)
+
+                upload_times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    ssh.ftp_client.putfo(BytesIO(content), "/afs/benchmark/archive")
+                    upload_times.append(time.perf_counter() - start)
+
+                build_time = statistics.median(build_times)
+                upload_time = statistics.median(upload_times)
+                transfer_time = len(content) * 8 / (args.bandwidth_mbps * 1e6)
+                print(
+                    f"{codec}:{level:<3} {build_time * 1000:>8.1f}ms "
+                    f"{len(content) / 1024:>8.0f}KB {raw_size / len(content):>6.1f}x "
+                    f"{upload_time * 1000:>8.1f}ms {transfer_time * 1000:>10.1f}ms "
+                    f"{(build_time + transfer_time) * 1000:>8.1f}ms"
+                )
+
+        os.chdir(initial_directory)
+
+    shutil.rmtree(FILES_PATH, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Benchmark for building the job input archive of MadGraph gridpacks.
+It creates a campaign with large card sets in a temporary folder and
+compares the previous approach (copy the cards, write the rendered cards
+to disk and call tar) with the in-memory `JobArchive` builder, and with
+archives reused from the artifact cache, e.g. after a reset.
+
+Usage:
+    python3 scripts/benchmark_job_archive.py --gridpacks 20 --cards 40 --card-kb 16
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import string
+import pathlib
+import argparse
+import tarfile
+import tempfile
+import statistics
+
+FILES_PATH = tempfile.mkdtemp(prefix="gridpack_files_")
+for key, value in {
+    "SERVICE_URL": "http://localhost",
+    "SUBMISSION_HOST": "localhost",
+    "SERVICE_ACCOUNT_USERNAME": "pdmvserv",
+    "SERVICE_ACCOUNT_PASSWORD": "benchmark",
+    "REMOTE_DIRECTORY": "/tmp/gridpacks/jobs",
+    "TICKETS_DIRECTORY": "/tmp/gridpacks/tickets",
+    "AUTHORIZED": "benchmark",
+    "GRIDPACK_DIRECTORY": "/tmp/gridpacks/storage",
+    "GRIDPACK_FILES_PATH": FILES_PATH,
+    "PUBLIC_STREAM_FOLDER": "/tmp/gridpacks/logs",
+    "MONGO_DB_HOST": "localhost",
+    "MONGO_DB_USER": "benchmark",
+    "MONGO_DB_PASSWORD": "benchmark",
+}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from src.generator.madgraph_gridpack import MadgraphGridpack
+
+GENERATOR = "MadGraph5_aMCatNLO"
+CAMPAIGN = "Benchmark2024"
+PROCESS = "DY"
+
+
+def random_card(size_kb):
+    """
+    Text that looks like a card, compressible like the real ones
+    """
+    words = ["".join(random.choices(string.ascii_lowercase, k=6)) for _ in range(64)]
+    lines = []
+    while sum(len(line) for line in lines) < size_kb * 1024:
+        lines.append(f" {random.choice(words)} = {random.random():.6f} ! comment")
+
+    return "\n".join(lines) + "\n"
+
+
+def create_files(files_path, datasets, cards, card_kb):
+    """
+    Create a campaign with templates and the card sets of the datasets
+    """
+    campaign_path = pathlib.Path(files_path, "Campaigns", CAMPAIGN)
+    for folder in ("Templates", "ModelParams"):
+        (campaign_path / GENERATOR / folder).mkdir(parents=True)
+
+    (campaign_path / f"{CAMPAIGN}.json").write_text(
+        json.dumps({"beam": 6800, "template_vars": {"nevents": 5000}})
+    )
+    (campaign_path / GENERATOR / "Templates" / "run_card.dat").write_text(
+        random_card(card_kb) + " $ebeam1 = ebeam1\n $ebeam2 = ebeam2\n"
+    )
+    (campaign_path / GENERATOR / "ModelParams" / "params.dat").write_text(
+        random_card(card_kb)
+    )
+    for dataset in datasets:
+        cards_path = pathlib.Path(files_path, "Cards", GENERATOR, PROCESS, dataset)
+        cards_path.mkdir(parents=True)
+        (cards_path / f"{dataset}.json").write_text(
+            json.dumps(
+                {
+                    "template": "run_card.dat",
+                    "template_vars": {},
+                    "model_params": "params.dat",
+                    "model_params_vars": {},
+                }
+            )
+        )
+        for index in range(cards):
+            (cards_path / f"{dataset}_card_{index}.dat").write_text(
+                random_card(card_kb)
+            )
+
+        (cards_path / f"{dataset}_cuts.f").write_text(random_card(card_kb))
+
+
+def get_local_directory(gridpack):
+    """
+    Folder where the previous archive of the gridpack is built
+    """
+    return os.path.abspath(f"gridpacks/{gridpack.get_id()}")
+
+
+def previous_prepare_job_archive(gridpack):
+    """
+    Archive as it was built before: copy, write and call tar
+    """
+    cards_path = gridpack.get_cards_path()
+    local_dir = get_local_directory(gridpack)
+    job_files_path = os.path.join(local_dir, "input_files")
+    pathlib.Path(job_files_path).mkdir(parents=True, exist_ok=True)
+    os.system(f"cp {cards_path}/*.dat {job_files_path}")
+    os.system(f"cp {cards_path}/*_cuts.f {job_files_path}")
+    dataset_name = gridpack.data["dataset"]
+    for name, content in (
+        (f"{dataset_name}_run_card.dat", gridpack.get_run_card()),
+        (f"{dataset_name}_customizecards.dat", gridpack.get_customize_card()),
+    ):
+        with open(os.path.join(job_files_path, name), "w", encoding="utf-8") as output:
+            output.write(content)
+
+    os.system(
+        f"tar -czvf {local_dir}/input_files.tar.gz -C {local_dir} input_files > /dev/null"
+    )
+
+
+def make_gridpack(index, dataset):
+    """
+    Gridpack for a dataset with its local folder created
+    """
+    gridpack = MadgraphGridpack(
+        {
+            "_id": f"benchmark_{index}",
+            "campaign": CAMPAIGN,
+            "generator": GENERATOR,
+            "process": PROCESS,
+            "dataset": dataset,
+        }
+    )
+    shutil.rmtree(get_local_directory(gridpack), ignore_errors=True)
+    pathlib.Path(get_local_directory(gridpack)).mkdir(parents=True, exist_ok=True)
+    return gridpack
+
+
+def measure(function, gridpacks):
+    """
+    Seconds to build the archive of each gridpack
+    """
+    samples = []
+    for gridpack in gridpacks:
+        start = time.perf_counter()
+        function(gridpack)
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description="Job archive benchmark")
+    parser.add_argument("--gridpacks", type=int, default=20)
+    parser.add_argument("--cards", type=int, default=40)
+    parser.add_argument("--card-kb", type=int, default=16)
+    args = parser.parse_args()
+    datasets = [f"DYJets_{index}_13p6TeV" for index in range(args.gridpacks)]
+    create_files(FILES_PATH, datasets, args.cards, args.card_kb)
+    initial_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_directory:
+        os.chdir(work_directory)
+        gridpacks = [make_gridpack(i, d) for i, d in enumerate(datasets)]
+        previous = measure(previous_prepare_job_archive, gridpacks)
+        previous_size = os.path.getsize(
+            f"{get_local_directory(gridpacks[0])}/input_files.tar.gz"
+        )
+        current = measure(MadgraphGridpack.prepare_job_archive, gridpacks)
+        cached = measure(MadgraphGridpack.prepare_job_archive, gridpacks)
+        content = gridpacks[0].prepare_job_archive()
+        with tarfile.open(fileobj=io.BytesIO(content)) as archive:
+            members = len(archive.getnames())
+
+        print(f"Card set:           {args.cards + 3} files of {args.card_kb} KB")
+        print(
+            f"cp + tar:           {statistics.mean(previous) * 1000:.1f} ms per archive, "
+            f"{previous_size / 1024:.0f} KB"
+        )
+        print(
+            f"JobArchive:         {statistics.mean(current) * 1000:.1f} ms per archive, "
+            f"{len(content) / 1024:.0f} KB, {members} members"
+        )
+        print(
+            f"Artifact cache hit: {statistics.mean(cached) * 1000:.1f} ms per archive"
+        )
+        print(
+            f"Speedup:            {statistics.mean(previous) / statistics.mean(current):.1f}x, "
+            f"{statistics.mean(previous) / statistics.mean(cached):.1f}x cached"
+        )
+        os.chdir(initial_directory)
+
+    shutil.rmtree(FILES_PATH, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
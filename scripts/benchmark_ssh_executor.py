@@ -0,0 +1,235 @@
+"""
+Benchmark for `SSHExecutor` against the in-process stand-in server.
+It measures the command latency, the upload throughput (plain and
+content-addressed), the cost of opening a new session per operation
+compared to reusing one and an output collection done step by step
+compared to a single remote script. It also runs the HTCondor and file
+listing helpers against the stand-in to check they work end to end.
+
+Usage:
+    python3 scripts/benchmark_ssh_executor.py --commands 50 --upload-mb 32 --latency-ms 20
+"""
+
+import os
+import sys
+import time
+import pathlib
+import argparse
+import tempfile
+import statistics
+
+# The stand-in maps every remote folder under /afs
+for key, value in {
+    "SERVICE_URL": "http://localhost",
+    "SUBMISSION_HOST": "localhost",
+    "SERVICE_ACCOUNT_USERNAME": "pdmvserv",
+    "SERVICE_ACCOUNT_PASSWORD": "stand-in",
+    "REMOTE_DIRECTORY": "/afs/gridpacks/jobs",
+    "TICKETS_DIRECTORY": "/afs/gridpacks/tickets",
+    "AUTHORIZED": "stand-in",
+    "GRIDPACK_DIRECTORY": "/afs/gridpacks/storage",
+    "GRIDPACK_FILES_PATH": "/tmp/GridpackFiles",
+    "PUBLIC_STREAM_FOLDER": "/afs/gridpacks/logs",
+    "MONGO_DB_HOST": "localhost",
+    "MONGO_DB_USER": "stand-in",
+    "MONGO_DB_PASSWORD": "stand-in",
+}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+# pylint: disable=wrong-import-position
+from ssh_stand_in import StandInServer
+from src.tools.ssh_executor import SSHExecutor, HTCondorExecutor
+from src.tools.utils import get_jobs_in_condor, retrieve_all_files_available
+from src.tools.remote_script import RemoteScript
+
+
+def summary(samples):
+    """
+    Return mean, median and 95th percentile in milliseconds
+    """
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return (
+        f"mean {statistics.mean(samples) * 1000:.1f} ms, "
+        f"median {statistics.median(samples) * 1000:.1f} ms, "
+        f"p95 {p95 * 1000:.1f} ms"
+    )
+
+
+def benchmark_commands(server, username, count):
+    """
+    Latency of commands in a reused session and in new sessions
+    """
+    reused = []
+    with SSHExecutor(server.address, username, "") as ssh:
+        ssh.execute_command("true")
+        for _ in range(count):
+            start = time.perf_counter()
+            ssh.execute_command("true")
+            reused.append(time.perf_counter() - start)
+
+    fresh = []
+    for _ in range(count):
+        start = time.perf_counter()
+        with SSHExecutor(server.address, username, "") as ssh:
+            ssh.execute_command("true")
+
+        fresh.append(time.perf_counter() - start)
+
+    print(f"Command, reused session:  {summary(reused)}")
+    print(f"Command, new session:     {summary(fresh)}")
+    print(
+        f"Session reuse speedup:    {statistics.mean(fresh) / statistics.mean(reused):.1f}x"
+    )
+
+
+def benchmark_uploads(server, username, size_mb):
+    """
+    Throughput of plain and content-addressed uploads
+    """
+    remote_directory = os.environ["REMOTE_DIRECTORY"]
+    with tempfile.NamedTemporaryFile(suffix=".tar.gz") as local_file:
+        local_file.write(os.urandom(size_mb * 1024 * 1024))
+        local_file.flush()
+        with SSHExecutor(server.address, username, "") as ssh:
+            ssh.execute_command(f"mkdir -p {remote_directory}")
+            start = time.perf_counter()
+            ssh.upload_file(local_file.name, f"{remote_directory}/plain.tar.gz")
+            plain = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ssh.upload_file_cached(local_file.name, f"{remote_directory}/miss.tar.gz")
+            miss = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ssh.upload_file_cached(local_file.name, f"{remote_directory}/hit.tar.gz")
+            hit = time.perf_counter() - start
+
+    print(f"Upload {size_mb} MB, plain:   {size_mb / plain:.1f} MB/s ({plain:.2f}s)")
+    print(f"Upload {size_mb} MB, miss:    {size_mb / miss:.1f} MB/s ({miss:.2f}s)")
+    print(f"Upload {size_mb} MB, hit:     {hit * 1000:.1f} ms")
+    print(f"Upload counters:          {SSHExecutor.get_upload_stats()}")
+
+
+def prepare_job_directory(ssh, job_directory):
+    """
+    Create a job directory with logs and an archive like a finished job
+    """
+    ssh.execute_command(
+        [
+            f"mkdir -p {job_directory}",
+            f"head -c 200000 /dev/urandom | base64 > {job_directory}/output.log",
+            f"echo job > {job_directory}/job.log",
+            f"echo error > {job_directory}/error.log",
+            f"echo archive > {job_directory}/dataset_slc7.tar.xz",
+        ]
+    )
+
+
+def benchmark_collect(username, count, latency):
+    """
+    Output collection (three logs, archive lookup, copy and cleanup)
+    done with one operation per step and with a single remote script
+    """
+    remote_directory = os.environ["REMOTE_DIRECTORY"]
+    job_directory = f"{remote_directory}/collect"
+    storage = os.environ["GRIDPACK_DIRECTORY"]
+    step_by_step = []
+    single_script = []
+    with tempfile.TemporaryDirectory() as local_directory, StandInServer(
+        prefixes=["/afs"], username=username, latency=latency
+    ) as server:
+        with SSHExecutor(server.address, username, "") as ssh:
+            for _ in range(count):
+                prepare_job_directory(ssh, job_directory)
+                start = time.perf_counter()
+                for log_file in ("job.log", "output.log", "error.log"):
+                    ssh.download_file(
+                        f"{job_directory}/{log_file}", f"{local_directory}/{log_file}"
+                    )
+
+                stdout, _, _ = ssh.execute_command(
+                    f"ls -1 {job_directory}/*dataset*.t*z"
+                )
+                ssh.execute_command(f"mkdir -p {storage}; cp {stdout} {storage}")
+                ssh.execute_command(f"rm -rf {job_directory}")
+                step_by_step.append(time.perf_counter() - start)
+
+                prepare_job_directory(ssh, job_directory)
+                start = time.perf_counter()
+                script = RemoteScript()
+                for log_file in ("job.log", "output.log", "error.log"):
+                    script.read(log_file, f"{job_directory}/{log_file}")
+
+                script.glob(
+                    "archive", [f"{job_directory}/*dataset*.t*z"], export="ARCHIVE"
+                )
+                script.run(
+                    "copy",
+                    f'mkdir -p {storage}; cp "$ARCHIVE" {storage}',
+                    when="archive",
+                )
+                script.run("cleanup", f"rm -rf {job_directory}")
+                result = script.execute(ssh)
+                for log_file in ("job.log", "output.log", "error.log"):
+                    with open(f"{local_directory}/{log_file}", "wb") as output_file:
+                        output_file.write(result[log_file]["content"])
+
+                single_script.append(time.perf_counter() - start)
+
+    print(f"Collect, step by step:    {summary(step_by_step)}")
+    print(f"Collect, remote script:   {summary(single_script)}")
+    print(f"Collect, latency:         {latency * 1000:.0f} ms per request")
+
+
+def check_helpers(server, username):
+    """
+    Run the HTCondor and file listing helpers end to end
+    """
+    remote_directory = os.environ["REMOTE_DIRECTORY"]
+    with HTCondorExecutor(server.address, username, "") as ssh:
+        ssh.execute_command(f"mkdir -p {remote_directory}/submit")
+        stdout, _, _ = ssh.execute_command(
+            [f"cd {remote_directory}/submit", "condor_submit GRIDPACK_1.jds"]
+        )
+        print(f"condor_submit:            {stdout.splitlines()[-1]}")
+        start = time.perf_counter()
+        jobs = get_jobs_in_condor(ssh)
+        print(
+            f"condor_q:                 {jobs} ({(time.perf_counter() - start) * 1000:.1f} ms)"
+        )
+
+        storage = pathlib.Path(os.environ["GRIDPACK_DIRECTORY"])
+        ssh.execute_command(
+            [f"mkdir -p {storage}", f"touch {storage}/dataset_slc7.tar.xz"]
+        )
+        files = retrieve_all_files_available([storage / "dataset"], ssh)
+        print(
+            f"Files available:          {[f['file_name'] for f in files[str(storage)]]}"
+        )
+
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description="SSHExecutor benchmark")
+    parser.add_argument("--commands", type=int, default=50)
+    parser.add_argument("--upload-mb", type=int, default=32)
+    parser.add_argument("--latency-ms", type=int, default=20)
+    args = parser.parse_args()
+    username = os.environ["SERVICE_ACCOUNT_USERNAME"]
+    with StandInServer(prefixes=["/afs"], username=username) as server:
+        benchmark_commands(server, username, args.commands)
+        benchmark_uploads(server, username, args.upload_mb)
+        check_helpers(server, username)
+        print(f"Sessions opened:          {server.connections}")
+
+    benchmark_collect(username, max(1, args.commands // 5), args.latency_ms / 1000)
+
+
+if __name__ == "__main__":
+    main()
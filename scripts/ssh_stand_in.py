@@ -0,0 +1,423 @@
+"""
+In-process SSH and SFTP server that stands in for the submission host.
+It allows to exercise `SSHExecutor`, `HTCondorExecutor` and the controller
+operations built on top of them without a real host.
+
+Remote paths under the configured prefixes (e.g. /afs, /eos) are mapped into
+a local temporary folder. Commands are answered by scripted handlers, matched
+by regex, and fake HTCondor (`condor_q`, `condor_submit`, `condor_rm`) and
+`rsync` handlers are included. Any other command, like `ls`, `mkdir` or
+`rm`, is executed locally by bash with the remote paths mapped. Programs
+sent on the standard input, e.g. `python3 -`, get their paths mapped too.
+A latency can be added to every command and SFTP request to model the
+round trip to a real host.
+
+Usage:
+    with StandInServer(prefixes=["/afs"]) as server:
+        with SSHExecutor(server.address, "user", "password") as ssh:
+            ssh.execute_command("condor_q -af:h ClusterId JobStatus Cmd")
+"""
+
+import os
+import re
+import time
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import subprocess
+import paramiko
+from paramiko import SFTPServer, SFTPServerInterface, SFTPAttributes, SFTPHandle
+from paramiko.sftp import SFTP_OK
+
+
+def set_attributes(path, attr):
+    """
+    Apply the permissions and times of SFTP attributes to a local path
+    or file descriptor, like a setstat request to a real server.
+    Missing paths raise OSError.
+    """
+    os.stat(path)
+    if attr.st_mode is not None:
+        os.chmod(path, attr.st_mode & 0o7777)
+
+    if attr.st_atime is not None and attr.st_mtime is not None:
+        os.utime(path, (attr.st_atime, attr.st_mtime))
+
+
+class StandInSFTPHandle(SFTPHandle):
+    """
+    SFTP handle backed by a local file
+    """
+
+    def __init__(self, flags=0):
+        super().__init__(flags)
+        self.filename = None
+        self.readfile = None
+        self.writefile = None
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def chattr(self, attr):
+        try:
+            set_attributes(self.readfile.fileno(), attr)
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+        return SFTP_OK
+
+
+class StandInSFTPServer(SFTPServerInterface):
+    """
+    SFTP server that maps remote paths into the stand-in folder
+    """
+
+    def __init__(self, server, *args, stand_in=None, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.stand_in = stand_in
+
+    def __local(self, path):
+        time.sleep(self.stand_in.latency)
+        return self.stand_in.local_path(self.canonicalize(path))
+
+    def __convert(self, function, *args):
+        try:
+            function(*args)
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+        return SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.normpath(path if os.path.isabs(path) else f"/{path}")
+
+    def list_folder(self, path):
+        local_path = self.__local(path)
+        try:
+            result = []
+            for name in os.listdir(local_path):
+                attributes = SFTPAttributes.from_stat(
+                    os.stat(os.path.join(local_path, name))
+                )
+                attributes.filename = name
+                result.append(attributes)
+
+            return result
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self.__local(path)))
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self.__local(path)))
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def open(self, path, flags, attr):
+        local_path = self.__local(path)
+        try:
+            descriptor = os.open(local_path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+
+        handle = StandInSFTPHandle(flags)
+        local_file = os.fdopen(descriptor, mode)
+        handle.filename = local_path
+        handle.readfile = local_file
+        handle.writefile = local_file
+        return handle
+
+    def remove(self, path):
+        return self.__convert(os.remove, self.__local(path))
+
+    def rename(self, oldpath, newpath):
+        return self.__convert(os.rename, self.__local(oldpath), self.__local(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self.__convert(os.replace, self.__local(oldpath), self.__local(newpath))
+
+    def mkdir(self, path, attr):
+        return self.__convert(os.mkdir, self.__local(path))
+
+    def rmdir(self, path):
+        return self.__convert(os.rmdir, self.__local(path))
+
+    def chattr(self, path, attr):
+        return self.__convert(set_attributes, self.__local(path), attr)
+
+
+class StandInInterface(paramiko.ServerInterface):
+    """
+    Accepts any password for the configured user and runs exec requests
+    """
+
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+
+    def check_auth_password(self, username, password):
+        if username == self.stand_in.username:
+            return paramiko.AUTH_SUCCESSFUL
+
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode("utf-8")
+        # The transport replies to the request after this method returns,
+        # so the answer waits a bit to not close the channel before that
+        thread = threading.Timer(
+            0.01 + self.stand_in.latency,
+            self.stand_in.run_command,
+            args=(channel, command),
+        )
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+class StandInServer:
+    """
+    SSH and SFTP server listening on localhost in a background thread
+    """
+
+    def __init__(self, prefixes=("/afs", "/eos"), username="pdmvserv", latency=0.0):
+        self.logger = logging.getLogger()
+        self.prefixes = tuple(prefixes)
+        self.username = username
+        # Seconds added to every command and SFTP request
+        self.latency = latency
+        self.root = None
+        self.host_key = None
+        self.listener = None
+        self.thread = None
+        self.running = False
+        self.transports = []
+        self.handlers = []
+        self.commands = []
+        self.connections = 0
+        # HTCondor state: cluster id -> job status code
+        self.condor_jobs = {}
+        self.next_cluster_id = 1000
+        self.lock = threading.Lock()
+        self.add_handler(r"\bcondor_q\b", self.fake_condor_q)
+        self.add_handler(r"\bcondor_submit\b", self.fake_condor_submit)
+        self.add_handler(r"\bcondor_rm\b", self.fake_condor_rm)
+        self.add_handler(r"(^|; )rsync\b", self.fake_rsync)
+
+    @property
+    def address(self) -> str:
+        """
+        Host and port to use in `SSHExecutor`
+        """
+        host, port = self.listener.getsockname()
+        return f"{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        """
+        Create the stand-in folder and start listening
+        """
+        self.root = tempfile.mkdtemp(prefix="ssh_stand_in_")
+        for prefix in self.prefixes:
+            os.makedirs(self.local_path(prefix), exist_ok=True)
+
+        logging.getLogger("ssh_stand_in").setLevel(logging.CRITICAL)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.running = True
+        self.thread = threading.Thread(target=self.__accept, daemon=True)
+        self.thread.start()
+        self.logger.info("Stand-in SSH server listening on %s", self.address)
+
+    def stop(self):
+        """
+        Stop listening, close the sessions and remove the stand-in folder
+        """
+        self.running = False
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+        self.thread.join()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __accept(self):
+        while self.running:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                break
+
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(client)
+            # Clients closing their sessions are expected, do not report them
+            transport.set_log_channel("ssh_stand_in")
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                "sftp", SFTPServer, StandInSFTPServer, stand_in=self
+            )
+            transport.start_server(server=StandInInterface(self))
+            with self.lock:
+                self.connections += 1
+                self.transports.append(transport)
+
+    def local_path(self, remote_path) -> str:
+        """
+        Path in the stand-in folder for a remote path
+        """
+        return os.path.join(self.root, remote_path.lstrip("/"))
+
+    def map_paths(self, command) -> str:
+        """
+        Replace the remote paths in a command with stand-in paths
+        """
+        for prefix in self.prefixes:
+            command = re.sub(
+                rf"(?<![\w/.]){re.escape(prefix)}(?=/|\b)",
+                self.local_path(prefix),
+                command,
+            )
+
+        return command
+
+    def add_handler(self, pattern, handler):
+        """
+        Answer commands matching the regex with the given handler.
+        Handlers receive the command and return (stdout, stderr, exit_code).
+        Handlers added later take precedence.
+        """
+        self.handlers.insert(0, (re.compile(pattern), handler))
+
+    def run_command(self, channel, command):
+        """
+        Answer an exec request and close the channel
+        """
+        with self.lock:
+            self.commands.append(command)
+
+        try:
+            if command.endswith(" -"):
+                # Program on the standard input, e.g. a remote script
+                program = channel.makefile("rb").read().decode("utf-8")
+                stdout, stderr, exit_code = self.run_locally(command, program)
+            else:
+                stdout, stderr, exit_code = self.run_handler(command)
+        except Exception as ex:
+            stdout, stderr, exit_code = "", f"stand-in error: {ex}\n", 1
+
+        try:
+            channel.sendall(stdout.encode("utf-8"))
+            channel.sendall_stderr(stderr.encode("utf-8"))
+            channel.send_exit_status(exit_code)
+            channel.close()
+        except (EOFError, OSError):
+            # The client closed the session without waiting for the reply
+            pass
+
+    def run_handler(self, command):
+        """
+        Answer a command with the first matching handler
+        or run it locally if none of them matches
+        """
+        for pattern, handler in self.handlers:
+            if pattern.search(command):
+                return handler(command)
+
+        return self.run_locally(command)
+
+    def run_locally(self, command, stdin=None):
+        """
+        Run a command with bash, mapping the remote paths
+        """
+        command = command.replace("module load lxbatch/tzero", "true")
+        process = subprocess.run(
+            ["bash", "-c", self.map_paths(command)],
+            input=self.map_paths(stdin) if stdin else None,
+            capture_output=True,
+            text=True,
+            check=False,
+            cwd=self.root,
+        )
+        return process.stdout, process.stderr, process.returncode
+
+    def fake_condor_q(self, _):
+        """
+        Answer `condor_q -af:h ClusterId JobStatus Cmd`
+        """
+        lines = ["ClusterId JobStatus Cmd"]
+        with self.lock:
+            for cluster_id, status in sorted(self.condor_jobs.items()):
+                lines.append(f"{cluster_id} {status} GRIDPACK_{cluster_id}.sh")
+
+        return "\n".join(lines) + "\n", "", 0
+
+    def fake_condor_submit(self, command):
+        """
+        Register an idle job and answer like `condor_submit`
+        """
+        _, _, exit_code = self.run_locally(command.split("condor_submit")[0] + "true")
+        if exit_code != 0:
+            return "", "ERROR: could not access the submit folder\n", 1
+
+        with self.lock:
+            cluster_id = self.next_cluster_id
+            self.next_cluster_id += 1
+            self.condor_jobs[cluster_id] = 1
+
+        stdout = "Submitting job(s).\n" f"1 job(s) submitted to cluster {cluster_id}.\n"
+        return stdout, "", 0
+
+    def fake_condor_rm(self, command):
+        """
+        Remove a job from the fake scheduler
+        """
+        cluster_id = int(command.split("condor_rm")[1].split()[0])
+        with self.lock:
+            if self.condor_jobs.pop(cluster_id, None) is None:
+                return "", f"Couldn't find/remove all jobs in cluster {cluster_id}\n", 1
+
+        return f"All jobs in cluster {cluster_id} have been marked for removal\n", "", 0
+
+    def fake_rsync(self, command):
+        """
+        Copy locally as `rsync <source> <host>:<destination>` would
+        """
+        source, destination = command.split()[-2:]
+        destination = destination.split(":", 1)[-1]
+        return self.run_locally(f"mkdir -p {destination} && cp {source} {destination}")
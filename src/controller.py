@@ -4,17 +4,18 @@ GridpackMachine application controller.
 
 import time
 import logging
-import os
 import zipfile
 import pathlib
 import traceback
+from io import BytesIO
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Union
 from environment import (
     GRIDPACK_FILES_PATH,
     GRIDPACK_FILES_REPOSITORY,
     GEN_REPOSITORY,
-    SUBMISSION_HOST,
+    SUBMISSION_HOSTS,
     SERVICE_ACCOUNT_USERNAME,
     SERVICE_ACCOUNT_PASSWORD,
     REMOTE_DIRECTORY,
@@ -22,23 +23,59 @@ from environment import (
     PRODUCTION,
     SERVICE_URL,
     EMAIL_AUTH,
+    JOB_PREPARER_WORKERS,
+    JOB_RUNTIME_MARGIN,
+    REPOSITORY_SNAPSHOT_FILE,
+    RENDER_WORKERS,
+    DUPLICATE_REUSE_MAX_AGE_DAYS,
 )
 from src.database import Database
 from src.gridpack import Gridpack
 from src.tools.email_sender import EmailSender
 from src.tools.utils import (
     clean_split,
-    get_available_campaigns,
-    get_available_cards,
     get_git_branches,
+    get_git_branch_head,
     pull_git_repository,
-    get_available_tunes,
     get_jobs_in_condor,
     get_latest_log_output_in_condor,
     get_module_path,
+    include_gridpack_ids,
     retrieve_all_files_available,
 )
-from src.tools.ssh_executor import SSHExecutor, HTCondorExecutor
+from src.tools.repository_tree import (
+    apply_file_changes,
+    get_repository_tree,
+    load_repository_snapshot,
+    refresh_repository_tree,
+    save_repository_snapshot,
+)
+from src.tools.ssh_executor import (
+    SSHExecutor,
+    HTCondorExecutor,
+    CircuitBreaker,
+    HostPool,
+    HostUnavailableError,
+)
+from src.tools.remote_script import RemoteScript
+from src.tools.genproductions import GENPRODUCTIONS_ARCHIVE, get_stage_command
+from src.tools.job_preparer import JobPreparer
+from src.tools.metadata import get_head_commit, refresh_metadata_cache
+from src.tools.render_cache import (
+    RENDER_CACHE,
+    RenderedArtifact,
+    get_revision,
+    make_rendered_artifact,
+)
+from src.tools.resource_usage import (
+    MINIMUM_SAMPLES,
+    aggregate,
+    exceeded_runtime,
+    get_next_flavour,
+    parse_job_log,
+    predict_flavour,
+    recommend,
+)
 from src.generator.fragment_builder import FragmentBuilder
 
 
@@ -57,8 +94,49 @@ class Controller:
         self.gridpacks_to_create_requests = []
         self.repository_tick_pause = 60
         self.tick_lock = Lock()
+        self.create_lock = Lock()
+        self.last_gridpack_id = 0
         self.job_cores = [1, 2, 4, 8, 16, 32, 64]
         self.job_memory = [cores * 1000 for cores in self.job_cores]
+        self.submission_hosts = HostPool(SUBMISSION_HOSTS)
+        self.last_cache_prune = 0
+        self.cache_prune_interval = 86400
+        self.job_preparer = JobPreparer(JOB_PREPARER_WORKERS)
+        # Serve the last known tree until the first update finishes
+        self.load_repository_snapshot()
+
+    def load_repository_snapshot(self):
+        """
+        Fill the repository tree from the snapshot of the last update
+        """
+        snapshot = load_repository_snapshot(REPOSITORY_SNAPSHOT_FILE)
+        if not snapshot or GEN_REPOSITORY not in snapshot["branches"]:
+            return
+
+        tree = get_repository_tree()
+        self.repository_tree = {
+            "campaigns": tree.campaigns,
+            "cards": tree.cards,
+            "branches": snapshot["branches"][GEN_REPOSITORY][::-1],
+            "tunes": tree.tunes,
+        }
+
+    def apply_file_changes(self, changes):
+        """
+        Update the repository tree after files of the
+        GridpackFiles checkout changed in place
+        """
+        tree = apply_file_changes(changes)
+        # Rendered artifacts and job files are cached by commit,
+        # which did not change
+        RENDER_CACHE.clear()
+        self.job_preparer.clear()
+        self.repository_tree = {
+            **self.repository_tree,
+            "campaigns": tree.campaigns,
+            "cards": tree.cards,
+            "tunes": tree.tunes,
+        }
 
     def update_repository_tree(self):
         now = int(time.time())
@@ -71,13 +149,21 @@ class Controller:
         pull_git_repository(
             path=GRIDPACK_FILES_PATH, expected_remote=GRIDPACK_FILES_REPOSITORY
         )
+        # Campaign and dataset files are parsed again for the new commit
+        refresh_metadata_cache()
+        # Only the folders changed since the last update are checked again
+        tree = refresh_repository_tree()
         self.repository_tree = {
-            "campaigns": get_available_campaigns(cache=False),
-            "cards": get_available_cards(cache=False),
+            "campaigns": tree.campaigns,
+            "cards": tree.cards,
             "branches": branches,
-            "tunes": get_available_tunes(cache=False),
+            "tunes": tree.tunes,
         }
         self.last_repository_tick = int(time.time())
+        try:
+            save_repository_snapshot(REPOSITORY_SNAPSHOT_FILE)
+        except OSError as error:
+            self.logger.warning("Could not save repository snapshot: %s", error)
 
     def tick(self):
         with self.tick_lock:
@@ -90,36 +176,86 @@ class Controller:
             # Three second cooldown
             time.sleep(3)
 
+    def is_submission_host_available(self) -> bool:
+        """
+        Check the circuit breakers of the submission hosts.
+        While all of them are open, operations that require SSH are skipped
+        """
+        available = self.submission_hosts.is_available()
+        if not available:
+            self.logger.warning(
+                "Submission hosts %s are unhealthy, skipping operations that require SSH",
+                ",".join(self.submission_hosts.hosts),
+            )
+
+        return available
+
+    @staticmethod
+    def get_job_host(gridpack: Gridpack) -> str:
+        """
+        Return the host that submitted the job of a Gridpack, its HTCondor
+        scheduler holds the job. Gridpacks submitted before the host was
+        stored were submitted through the first submission host.
+        """
+        return gridpack.get_submission_host() or SUBMISSION_HOSTS[0]
+
+    def ssh_session(self, executor=SSHExecutor, gridpack: Optional[Gridpack] = None):
+        """
+        Open a session to one of the submission hosts.
+        Operations for a submitted Gridpack use the host that submitted its job.
+        Other hosts use a different HTCondor scheduler, so they do not fail over:
+        HostUnavailableError is raised until the host is available again.
+        """
+        if not gridpack:
+            host = self.submission_hosts.choose()
+            return executor(host, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD)
+
+        host = self.get_job_host(gridpack)
+        if not CircuitBreaker.for_host(host).is_available():
+            raise HostUnavailableError(f"Host {host} of {gridpack} is unavailable")
+
+        return executor(host, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD)
+
     def internal_tick(self):
+        ssh_available = self.is_submission_host_available()
         # Delete gridpacks
-        if self.gridpacks_to_delete:
+        if ssh_available and self.gridpacks_to_delete:
             self.logger.info(
                 "Gridpacks to delete: %s", ",".join(self.gridpacks_to_delete)
             )
+            # Gridpacks whose job host is unavailable are deleted later
+            pending = []
             for gridpack_id in self.gridpacks_to_delete:
-                self.delete_gridpack(gridpack_id)
+                try:
+                    self.delete_gridpack(gridpack_id)
+                except HostUnavailableError as ex:
+                    self.logger.warning("Not deleting %s yet: %s", gridpack_id, ex)
+                    pending.append(gridpack_id)
 
-            self.gridpacks_to_delete = []
+            self.gridpacks_to_delete = pending
 
-        if self.gridpacks_to_reset:
+        if ssh_available and self.gridpacks_to_reset:
             # Reset gridpacks
             self.logger.info(
                 "Gridpacks to reset: %s", ",".join(self.gridpacks_to_reset)
             )
+            pending = []
             for gridpack_id in self.gridpacks_to_reset:
-                self.reset_gridpack(gridpack_id)
+                try:
+                    self.reset_gridpack(gridpack_id)
+                except HostUnavailableError as ex:
+                    self.logger.warning("Not resetting %s yet: %s", gridpack_id, ex)
+                    pending.append(gridpack_id)
 
-            self.gridpacks_to_reset = []
+            self.gridpacks_to_reset = pending
 
-        if self.gridpacks_that_reuse_output:
+        if ssh_available and self.gridpacks_that_reuse_output:
             # Check Gridpacks that could reuse output
             self.logger.info(
                 "Gridpacks that could reuse output - Checking them: %s",
                 ",".join(self.gridpacks_that_reuse_output),
             )
-            with SSHExecutor(
-                SUBMISSION_HOST, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-            ) as ssh:
+            with self.ssh_session() as ssh:
                 for gridpack_id in self.gridpacks_that_reuse_output:
                     self.reuse_gridpack(gridpack_id=gridpack_id, ssh_session=ssh)
 
@@ -135,6 +271,12 @@ class Controller:
 
             self.gridpacks_to_approve = []
 
+        # Fail gridpacks whose job files could not be prepared
+        self.process_preparation_errors()
+
+        if not ssh_available:
+            return
+
         # Check gridpacks
         gridpacks_to_check = self.database.get_gridpacks_with_status(
             "submitted,running,finishing"
@@ -142,26 +284,23 @@ class Controller:
         self.logger.info(
             "Gridpacks to check: %s", ",".join(g["_id"] for g in gridpacks_to_check)
         )
-        condor_jobs = {}
-        if gridpacks_to_check:
-            with HTCondorExecutor(
-                SUBMISSION_HOST, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-            ) as ssh:
-                condor_jobs = get_jobs_in_condor(ssh)
-
+        # Jobs are only visible in the scheduler of the host that submitted them
+        gridpacks_by_host = {}
         for gridpack_json in gridpacks_to_check:
             gridpack = Gridpack.make(gridpack_json)
-            self.update_condor_status(gridpack, condor_jobs)
-            condor_status = gridpack.get_condor_status()
-            if condor_status in ("DONE", "REMOVED"):
-                # Refetch after check if running save
-                self.collect_output(gridpack)
-            if condor_status in ("RUN"):
-                # Stream the output to a public area
-                with HTCondorExecutor(
-                    SUBMISSION_HOST, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-                ) as ssh:
-                    get_latest_log_output_in_condor(gridpack=gridpack, ssh=ssh)
+            gridpacks_by_host.setdefault(self.get_job_host(gridpack), []).append(
+                gridpack
+            )
+
+        for host, gridpacks in gridpacks_by_host.items():
+            try:
+                self.check_gridpacks(host, gridpacks)
+            except HostUnavailableError as ex:
+                # Checked once the host is back, other
+                # hosts do not know about their jobs
+                self.logger.warning(
+                    "Not checking %s: %s", ",".join(g.get_id() for g in gridpacks), ex
+                )
 
         if self.gridpacks_to_create_requests:
             # Approve gridpacks
@@ -184,13 +323,40 @@ class Controller:
             status = gridpack.get_status()
             if status == "approved":
                 # Double check and if it is approved, submit it
-                self.submit_to_condor(gridpack)
+                # unless the same gridpack is already running or done
+                if self.attach_to_duplicate(gridpack):
+                    self.job_preparer.discard(gridpack.get_id())
+                else:
+                    self.submit_to_condor(gridpack)
+
+        self.prune_remote_cache()
+
+    def prune_remote_cache(self):
+        """
+        Remove old files from the remote upload cache,
+        at most once per `cache_prune_interval` seconds
+        """
+        now = int(time.time())
+        if now - self.cache_prune_interval < self.last_cache_prune:
+            return
+
+        with self.ssh_session() as ssh:
+            ssh.prune_cache()
+
+        self.last_cache_prune = now
 
     def create(self, gridpack):
         """
         Add gridpack to the database
         """
-        gridpack_id = str(int(time.time() * 1000))
+        # IDs are creation times in milliseconds, gridpacks of
+        # a batch created in the same millisecond get the next ones
+        with self.create_lock:
+            self.last_gridpack_id = max(
+                int(time.time() * 1000), self.last_gridpack_id + 1
+            )
+            gridpack_id = str(self.last_gridpack_id)
+
         gridpack.data["_id"] = gridpack_id
         gridpack.data["store_into_subfolders"] = True
         gridpack.reset()
@@ -224,7 +390,11 @@ class Controller:
             self.gridpacks_that_reuse_output.append(gridpack_id)
         else:
             self.logger.info("Adding %s to approve list", gridpack_id)
+            gridpack = Gridpack.make(self.database.get_gridpack(gridpack_id))
+            self.choose_job_flavour(gridpack)
             self.gridpacks_to_approve.append(gridpack_id)
+            # Job files are prepared in the background until it is submitted
+            self.job_preparer.prepare(gridpack)
 
     def delete(self, gridpack_id):
         self.logger.info("Adding %s to delete list", gridpack_id)
@@ -274,10 +444,117 @@ class Controller:
 
         gridpack = Gridpack.make(gridpack_json)
         self.logger.info("Reseting %s", gridpack)
+        self.job_preparer.discard(gridpack_id)
         self.terminate_gridpack(gridpack)
         gridpack.reset()
         gridpack.add_history_entry("reset")
         self.database.update_gridpack(gridpack)
+        self.release_attached_gridpacks(gridpack)
+
+    def recommend_resources(self, generator, process=None, dataset=None) -> dict:
+        """
+        Recommend job cores and memory from the usage of previous jobs.
+        Jobs of the same dataset are used if there are enough of them,
+        otherwise the ones of the same process or generator.
+
+        Returns:
+            dict: Recommended `job_cores` and `job_memory`, the level
+                used and the aggregated usage. Empty if there are
+                not enough previous jobs.
+        """
+        level, samples = self.get_usage_samples(generator, process, dataset)
+        if not level:
+            return {}
+
+        recommendation = recommend(samples, self.job_cores, self.job_memory)
+        recommendation["level"] = level
+        recommendation["usage"] = aggregate(samples)
+        return recommendation
+
+    def get_usage_samples(self, generator, process=None, dataset=None) -> tuple:
+        """
+        Return the most specific level (dataset, process or generator)
+        with enough finished jobs and the resource usage of those jobs.
+        (None, []) if no level has enough of them.
+        """
+        levels = (
+            ("dataset", {"process": process, "dataset": dataset}),
+            ("process", {"process": process}),
+            ("generator", {}),
+        )
+        for level, query in levels:
+            if not all(query.values()):
+                continue
+
+            samples = self.database.get_resource_usage(generator, **query)
+            if len(samples) >= MINIMUM_SAMPLES[level]:
+                return level, samples
+
+        return None, []
+
+    def choose_job_flavour(self, gridpack: Gridpack):
+        """
+        Choose the shortest job flavour that fits the runtime of previous
+        similar jobs with a safety margin. Gridpacks that already have one,
+        e.g. after running out of time, keep it.
+        """
+        if gridpack.data.get("job_flavour"):
+            return
+
+        level, samples = self.get_usage_samples(
+            gridpack.get("generator"), gridpack.get("process"), gridpack.get("dataset")
+        )
+        flavour = predict_flavour(samples, gridpack.get_cores(), JOB_RUNTIME_MARGIN)
+        if not flavour:
+            return
+
+        self.logger.info("Job flavour of %s is %s by %s", gridpack, flavour, level)
+        gridpack.data["job_flavour"] = flavour
+        self.database.update_gridpack(gridpack)
+
+    def escalate_job_flavour(self, gridpack: Gridpack) -> bool:
+        """
+        Submit the gridpack again with the next longer job flavour,
+        after its job ran out of time. Return whether it was submitted
+        again, not if it already had the longest flavour.
+        """
+        flavour = get_next_flavour(gridpack.get_job_flavour())
+        if not flavour:
+            return False
+
+        self.logger.warning(
+            "%s ran out of time as %s, submitting it again as %s",
+            gridpack,
+            gridpack.get_job_flavour(),
+            flavour,
+        )
+        gridpack.data["job_flavour"] = flavour
+        gridpack.set_status("approved")
+        gridpack.set_condor_status("")
+        gridpack.set_condor_id(0)
+        gridpack.set_submission_host("")
+        gridpack.add_history_entry(f"job flavour {flavour}")
+        self.job_preparer.prepare(gridpack)
+        return True
+
+    def process_preparation_errors(self):
+        """
+        Mark the gridpacks whose job files could not
+        be prepared in the background as failed
+        """
+        for gridpack_id, error in self.job_preparer.pop_errors():
+            gridpack_json = self.database.get_gridpack(gridpack_id)
+            if not gridpack_json:
+                continue
+
+            gridpack = Gridpack.make(gridpack_json)
+            if gridpack.get_status() != "approved":
+                continue
+
+            self.logger.error("Could not prepare job files for %s: %s", gridpack, error)
+            gridpack.set_status("failed")
+            gridpack.add_history_entry("preparation failed")
+            self.database.update_gridpack(gridpack)
 
     def approve_gridpack(self, gridpack_id):
         """
@@ -293,6 +570,9 @@ class Controller:
 
         gridpack = Gridpack.make(gridpack_json)
         self.logger.info("Approving %s", gridpack)
+        # Inputs, like the head of the GEN productions branch, may have
+        # changed since an earlier approval, it is computed at submission
+        gridpack.data["fingerprint"] = ""
         gridpack.set_status("approved")
         gridpack.add_history_entry("approve")
         self.database.update_gridpack(gridpack)
@@ -375,6 +655,101 @@ class Controller:
         except Exception as e:
             self.__process_failed_reuse(gridpack=gridpack, error=e)
 
+    def attach_to_duplicate(self, gridpack: Gridpack) -> bool:
+        """
+        Look for a gridpack with the same input fingerprint that was already
+        submitted. If it is done, and not older than
+        `DUPLICATE_REUSE_MAX_AGE_DAYS`, its output is reused right away.
+        If it is still running, this gridpack is attached to it and takes
+        its output once it finishes. In both cases no new job is submitted.
+        The fingerprint is computed here the first time after the approval.
+
+        Args:
+            gridpack (Gridpack): Approved gridpack about to be submitted.
+
+        Returns:
+            bool: True if the gridpack reused or waits for a duplicate.
+        """
+        fingerprint = gridpack.get_fingerprint()
+        if not fingerprint:
+            return False
+
+        oldest_done = int(time.time()) - DUPLICATE_REUSE_MAX_AGE_DAYS * 86400
+        duplicates = [
+            Gridpack.make(g)
+            for g in self.database.get_gridpacks_by_fingerprint(
+                fingerprint, "submitted,running,finishing,done"
+            )
+            if g["_id"] != gridpack.get_id()
+        ]
+        done = [
+            g
+            for g in duplicates
+            if g.get_status() == "done"
+            and g.get("archive")
+            and g.get_history_time("done") >= oldest_done
+        ]
+        running = [g for g in duplicates if g.get_status() != "done"]
+        if done:
+            original = done[0]
+            self.logger.info("%s is a duplicate of %s, reusing it", gridpack, original)
+            gridpack.add_history_entry(f"duplicate of {original.get_id()}")
+            self.reuse_output_of(gridpack, original)
+            return True
+
+        if running:
+            original = running[0]
+            self.logger.info(
+                "%s is a duplicate of %s, attaching it", gridpack, original
+            )
+            gridpack.data["gridpack_reused"] = original.get_id()
+            gridpack.set_status("attached")
+            gridpack.add_history_entry(f"attached to {original.get_id()}")
+            self.database.update_gridpack(gridpack)
+            return True
+
+        return False
+
+    def reuse_output_of(self, gridpack: Gridpack, original: Gridpack):
+        """
+        Take the output archive of another gridpack with the
+        same inputs and create a McM request for it
+        """
+        gridpack.data["gridpack_reused"] = original.get_id()
+        gridpack.data["archive"] = original.get("archive")
+        gridpack.data["archive_absolute"] = original.get_absolute_path()
+        gridpack.set_status("reused")
+        gridpack.add_history_entry("gridpack reused")
+        gridpack.delete_cores_memory()
+        self.database.update_gridpack(gridpack)
+        self.gridpacks_to_create_requests.append(gridpack.get_id())
+        self.send_reused_notification(gridpack=gridpack)
+
+    def release_attached_gridpacks(self, original: Gridpack):
+        """
+        Update the gridpacks attached to the given one after it finished,
+        was reset or deleted. They reuse its output if it is done, fail if
+        it failed and go back to approved, to be submitted, otherwise.
+        """
+        original_id = original.get_id()
+        status = original.get_status()
+        for gridpack_json in self.database.get_gridpacks_attached_to(original_id):
+            gridpack = Gridpack.make(gridpack_json)
+            if status == "done" and original.get("archive"):
+                self.reuse_output_of(gridpack, original)
+            elif status == "failed":
+                self.logger.info("%s failed as %s failed", gridpack, original)
+                gridpack.set_status("failed")
+                gridpack.add_history_entry(f"{original_id} failed")
+                self.database.update_gridpack(gridpack)
+                self.send_failed_notification(gridpack)
+            else:
+                self.logger.info("Detaching %s from %s", gridpack, original)
+                gridpack.data["gridpack_reused"] = ""
+                gridpack.set_status("approved")
+                gridpack.add_history_entry(f"detached from {original_id}")
+                self.database.update_gridpack(gridpack)
+
     def __process_failed_reuse(self, gridpack: Gridpack, error: Union[str, Exception]):
         """
         In case a Gridpack fails, send an email notification
@@ -492,9 +867,11 @@ class Controller:
             return
 
         gridpack = Gridpack.make(gridpack_json)
+        self.job_preparer.discard(gridpack_id)
         self.terminate_gridpack(gridpack)
         self.database.delete_gridpack(gridpack)
-        gridpack.rmdir()
+        gridpack.set_status("deleted")
+        self.release_attached_gridpacks(gridpack)
 
     def get_fragment(self, gridpack: Gridpack):
         """
@@ -517,6 +894,143 @@ class Controller:
         valid_file = bool(gridpack.get("archive") and gridpack.get_absolute_path())
         return (fragment, valid_file)
 
+    def render_artifact(self, gridpack: Gridpack, original, artifact: str) -> str:
+        """
+        Render the fragment, run card or customize card of a Gridpack.
+        Cards are taken from the original Gridpack for Gridpacks
+        that reused its output, like `get_original_gridpack` does.
+
+        Args:
+            gridpack (Gridpack): Gridpack to render.
+            original (dict | None): Data of the Gridpack that submitted
+                the job, if `gridpack` reused its output.
+            artifact (str): "fragment", "run_card" or "customize_card".
+        Returns:
+            str: Rendered artifact.
+        Raises:
+            AssertionError: If the original Gridpack could not be found.
+        """
+        if artifact == "fragment":
+            return self.get_fragment(gridpack)[0]
+
+        if gridpack.get_gridpack_reused():
+            if not original:
+                raise AssertionError(
+                    "Could not retrieve the data for the original Gridpack "
+                    f"that performed the submission. Gridpack ID: {gridpack.get_id()}"
+                )
+
+            gridpack = Gridpack.make(original)
+
+        if artifact == "customize_card":
+            return gridpack.get_customize_card()
+
+        return gridpack.get_run_card()
+
+    def get_rendered_artifact(
+        self, gridpack_json: dict, original: Optional[dict], artifact: str
+    ) -> RenderedArtifact:
+        """
+        Return the rendered fragment, run card or customize card of a Gridpack,
+        including the IDs of the Gridpacks in the cards, like the single
+        Gridpack APIs do. Artifacts are rendered once per revision of the
+        Gridpacks and GridpackFiles commit, they are not cached if the
+        GridpackFiles checkout is not a git repository.
+
+        Args:
+            gridpack_json (dict): Data of the Gridpack to render.
+            original (dict | None): Data of the Gridpack that submitted
+                the job, if the Gridpack reused its output.
+            artifact (str): "fragment", "run_card" or "customize_card".
+        Returns:
+            RenderedArtifact: Rendered text and its entity tag.
+        Raises:
+            AssertionError: If the original Gridpack could not be found.
+        """
+        commit = get_head_commit(GRIDPACK_FILES_PATH)
+        if artifact == "fragment":
+            original = None
+
+        key = (
+            gridpack_json["_id"],
+            get_revision(gridpack_json),
+            get_revision(original) if original else None,
+            commit,
+            artifact,
+        )
+        rendered = RENDER_CACHE.get(key) if commit else None
+        if rendered:
+            return rendered
+
+        gridpack = Gridpack.make(gridpack_json)
+        content = self.render_artifact(gridpack, original, artifact)
+        if artifact != "fragment":
+            content = include_gridpack_ids(
+                gridpack_id=gridpack.get_id(),
+                effective_gridpack_id=(original or gridpack_json)["_id"],
+                content=content,
+            )
+
+        if not commit:
+            return make_rendered_artifact(content)
+
+        return RENDER_CACHE.put(key, content)
+
+    def render_artifacts(self, gridpack_jsons: list, artifacts: list):
+        """
+        Render the given artifacts of many Gridpacks with a pool of threads.
+        Campaign and dataset files are parsed once and shared by all of them.
+
+        Args:
+            gridpack_jsons (list): Data of the Gridpacks to render.
+            artifacts (list): Names of the artifacts to render for each one.
+        Yields:
+            dict: Gridpack ID, artifact name and its content, or
+                an error message, in the order of the Gridpacks.
+        """
+        reused_ids = {g.get("gridpack_reused") for g in gridpack_jsons} - {None, ""}
+        originals = {}
+        if reused_ids:
+            originals = {
+                g["_id"]: g for g in self.database.get_gridpacks_by_ids(reused_ids)
+            }
+
+        def render(gridpack_json):
+            gridpack_id = gridpack_json["_id"]
+            original = originals.get(gridpack_json.get("gridpack_reused"))
+            results = []
+            for artifact in artifacts:
+                result = {"gridpack_id": gridpack_id, "artifact": artifact}
+                try:
+                    rendered = self.get_rendered_artifact(
+                        gridpack_json, original, artifact
+                    )
+                    result["content"] = rendered.content
+                except AssertionError as error:
+                    result["error"] = str(error)
+                except Exception as error:  # pylint: disable=broad-except
+                    self.logger.error(
+                        "Unable to render %s for Gridpack %s",
+                        artifact,
+                        gridpack_id,
+                        exc_info=True,
+                    )
+                    result["error"] = f"Unable to render the element: {error}"
+
+                results.append(result)
+
+            return results
+
+        executor = ThreadPoolExecutor(
+            max_workers=RENDER_WORKERS, thread_name_prefix="renderer"
+        )
+        try:
+            for results in executor.map(render, gridpack_jsons):
+                yield from results
+        finally:
+            # Stop early if the client went away
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def terminate_gridpack(self, gridpack):
         """
         Terminate gridpack job in HTCondor
@@ -524,9 +1038,7 @@ class Controller:
         self.logger.info("Trying to terminate %s", gridpack)
         condor_id = gridpack.get_condor_id()
         if condor_id > 0:
-            with HTCondorExecutor(
-                SUBMISSION_HOST, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-            ) as ssh:
+            with self.ssh_session(HTCondorExecutor, gridpack) as ssh:
                 ssh.execute_command(f"condor_rm {condor_id}")
         else:
             self.logger.info(
@@ -537,45 +1049,76 @@ class Controller:
 
     def submit_to_condor(self, gridpack):
         self.logger.info("Submitting %s", gridpack)
-        gridpack.rmdir()
-        gridpack.mkdir()
-
         try:
             self.logger.info("Will create files for %s", gridpack)
-            # Prepare files
-            gridpack.prepare_job_archive()
-            gridpack.prepare_script()
-            gridpack.prepare_jds_file()
+            # Files are prepared in memory, usually in the background
+            # since the gridpack was approved
+            gridpack_id = gridpack.get_id()
+            script_name = f"GRIDPACK_{gridpack_id}.sh"
+            prepared = self.job_preparer.take(gridpack)
+            job_files = prepared["files"]
+            archive = prepared["archive"]
+            archive_name = prepared["archive_name"]
             self.logger.info(
-                "Done preparing:\n%s", os.popen(f"ls -l {gridpack.local_dir()}").read()
+                "Done preparing %s, job archive is %s bytes", gridpack, len(archive)
             )
 
             self.logger.info("Will prepare remote directory for %s", gridpack)
             # Prepare remote directory. Delete old one and create a new one
-            gridpack_id = gridpack.get_id()
             remote_directory_base = REMOTE_DIRECTORY
             remote_directory = f"{remote_directory_base}/{gridpack_id}"
-            with HTCondorExecutor(
-                SUBMISSION_HOST, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-            ) as ssh:
-                ssh.execute_command(
-                    [f"rm -rf {remote_directory}", f"mkdir -p {remote_directory}"]
-                )
-
+            with self.ssh_session(HTCondorExecutor) as ssh:
+                submission_host = ssh.remote_host
                 self.logger.info("Will upload files for %s", gridpack)
-                # Upload gridpack input_files.tar.gz, submit file and script to run
-                local_directory = gridpack.local_dir()
-                ssh.upload_file(
-                    f"{local_directory}/GRIDPACK_{gridpack_id}.sh",
-                    f"{remote_directory}/GRIDPACK_{gridpack_id}.sh",
-                )
-                ssh.upload_file(
-                    f"{local_directory}/GRIDPACK_{gridpack_id}.jds",
-                    f"{remote_directory}/GRIDPACK_{gridpack_id}.jds",
+                # Identical archives, e.g. after a reset, are not transferred again
+                cached_archive = ssh.upload_to_cache(archive)
+
+                # Recreate the remote directory, put the script to run, submit
+                # file and the job archive in it and submit, all at once
+                script = RemoteScript()
+                script.run(
+                    "prepare",
+                    f"rm -rf {remote_directory} && mkdir -p {remote_directory}",
                 )
-                ssh.upload_file(
-                    f"{local_directory}/input_files.tar.gz",
-                    f"{remote_directory}/input_files.tar.gz",
+                for file_name, content in job_files.items():
+                    script.write(
+                        file_name.rsplit(".", 1)[-1],
+                        f"{remote_directory}/{file_name}",
+                        content,
+                        when="prepare",
+                    )
+
+                if cached_archive:
+                    script.run(
+                        "archive",
+                        ssh.cache_link_command(
+                            cached_archive, f"{remote_directory}/{archive_name}"
+                        ),
+                        when="prepare",
+                    )
+                else:
+                    self.logger.warning("Remote cache unavailable for %s", gridpack)
+                    script.write(
+                        "archive",
+                        f"{remote_directory}/{archive_name}",
+                        archive,
+                        when="prepare",
+                    )
+
+                # Only the generator folder of genproductions, staged once per
+                # branch head commit and shared by all the jobs that use it
+                script.run(
+                    "genproductions",
+                    get_stage_command(
+                        GEN_REPOSITORY,
+                        get_git_branch_head(
+                            GEN_REPOSITORY, gridpack.get("genproductions")
+                        ),
+                        gridpack.get("generator"),
+                        f"{remote_directory}/{GENPRODUCTIONS_ARCHIVE}",
+                    ),
+                    timeout=600,
+                    when="prepare",
                 )
 
                 self.logger.info("Will try to submit %s", gridpack)
@@ -583,11 +1126,15 @@ class Controller:
                 # Submission happens through lxplus as condor is not available
                 # on website machine
                 # It is easier to ssh to lxplus than set up condor locally.
-                submission_command = [
-                    f"cd {remote_directory}",
+                script.run(
+                    "submit",
                     f"condor_submit GRIDPACK_{gridpack_id}.jds",
-                ]
-                stdout, stderr, _ = ssh.execute_command(submission_command)
+                    cwd=remote_directory,
+                    when=["sh", "jds", "archive", "genproductions"],
+                )
+                result = script.execute(ssh)
+                stdout = result["submit"].get("stdout", "")
+                stderr = "\n".join(r["error"] for r in result.values() if r["error"])
 
             self.logger.debug(stdout)
             self.logger.debug(stderr)
@@ -598,30 +1145,20 @@ class Controller:
                 condor_id = int(float(stdout.split()[-1]))
                 gridpack.set_condor_id(condor_id)
                 gridpack.set_condor_status("IDLE")
+                gridpack.set_submission_host(submission_host)
                 self.logger.info("Submitted %s. Condor job id %s", gridpack, condor_id)
                 gridpack.add_history_entry("submitted")
                 # Send an email about submitted gridpack
-                input_files = []
-                # Attach the script file for debugging
-                if os.path.isfile(f"{local_directory}/GRIDPACK_{gridpack_id}.sh"):
-                    input_files.append(f"{local_directory}/GRIDPACK_{gridpack_id}.sh")
-
-                # Attach the cards archive for debugging
-                if os.path.isfile(f"{local_directory}/input_files.tar.gz"):
-                    input_files.append(f"{local_directory}/input_files.tar.gz")
-
-                attachments = []
-                if input_files:
-                    zip_file_name = (
-                        f"{local_directory}/gridpack_{gridpack_id}_input_files.zip"
+                # Attach the script file and the cards archive for debugging
+                input_files = {
+                    script_name: job_files[script_name],
+                    archive_name: archive,
+                }
+                attachments = [
+                    self.zip_attachment(
+                        f"gridpack_{gridpack_id}_input_files.zip", input_files
                     )
-                    attachments.append(zip_file_name)
-                    with zipfile.ZipFile(
-                        zip_file_name, "w", zipfile.ZIP_DEFLATED
-                    ) as zip_object:
-                        for file_path in input_files:
-                            zip_object.write(file_path, file_path.split("/")[-1])
-
+                ]
                 self.send_submitted_notification(gridpack, attachments)
             else:
                 self.logger.error(
@@ -633,6 +1170,10 @@ class Controller:
                 gridpack.set_status("failed")
                 gridpack.add_history_entry("submission failed")
 
+        except HostUnavailableError:
+            # Keep it approved, it will be submitted once the host recovers
+            self.logger.error("Could not submit %s, host is unavailable", gridpack)
+            raise
         except Exception as ex:
             gridpack.set_status("failed")
             gridpack.add_history_entry("submission failed")
@@ -645,6 +1186,33 @@ class Controller:
 
         self.database.update_gridpack(gridpack)
 
+    def check_gridpacks(self, host: str, gridpacks: list):
+        """
+        Update the HTCondor status of the jobs submitted through a host,
+        stream the output of running ones and collect the finished ones
+
+        Raises:
+            HostUnavailableError: If the host is unavailable.
+        """
+        if not CircuitBreaker.for_host(host).is_available():
+            raise HostUnavailableError(f"Host {host} is unavailable")
+
+        with HTCondorExecutor(
+            host, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
+        ) as ssh:
+            condor_jobs = get_jobs_in_condor(ssh)
+
+        for gridpack in gridpacks:
+            self.update_condor_status(gridpack, condor_jobs)
+            condor_status = gridpack.get_condor_status()
+            if condor_status in ("DONE", "REMOVED"):
+                # Refetch after check if running save
+                self.collect_output(gridpack)
+            if condor_status in ("RUN"):
+                # Stream the output to a public area
+                with self.ssh_session(HTCondorExecutor, gridpack) as ssh:
+                    get_latest_log_output_in_condor(gridpack=gridpack, ssh=ssh)
+
     def update_condor_status(self, gridpack, condor_jobs):
         """
         Update condor status for given gridpack
@@ -675,86 +1243,79 @@ class Controller:
         gridpack_id = gridpack.get_id()
         dataset_name = gridpack.data["dataset"]
         remote_directory = f"{remote_directory_base}/{gridpack_id}"
-        submission_host = SUBMISSION_HOST
-        local_directory = gridpack.local_dir()
 
-        stdout = ""
         gridpack_archive = ""
-        with HTCondorExecutor(
-            submission_host, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-        ) as ssh:
-            ssh.download_file(
-                f"{remote_directory}/job.log", f"{local_directory}/job.log"
+        log_files = ("job.log", "output.log", "error.log")
+        with self.ssh_session(HTCondorExecutor, gridpack) as ssh:
+            # Download the logs, find the gridpack archive, copy it to
+            # the storage and remove the directory, all at once
+            script = RemoteScript()
+            for log_file in log_files:
+                script.read(log_file, f"{remote_directory}/{log_file}")
+
+            script.glob(
+                "archive",
+                [
+                    f"{remote_directory}/*{dataset_name}*{extension}"
+                    for extension in (".tar.xz", ".tar.gz", ".tgz")
+                ],
+                export="GRIDPACK_ARCHIVE",
             )
-            ssh.download_file(
-                f"{remote_directory}/output.log", f"{local_directory}/output.log"
+            gridpack_directory = gridpack.get_remote_storage_path()
+            sync_command: str = (
+                'rsync -e "ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null" '
+                f'"$GRIDPACK_ARCHIVE" {ssh.hostname}:{gridpack_directory}'
             )
-            ssh.download_file(
-                f"{remote_directory}/error.log", f"{local_directory}/error.log"
+            self.logger.info("Sync command: %s", sync_command)
+            script.run("sync", sync_command, timeout=3600, when="archive")
+            # Remove the directory
+            script.run("cleanup", f"rm -rf {remote_directory}")
+            result = script.execute(ssh, timeout=3600 + ssh.timeout)
+
+        downloaded_files = {}
+        for log_file in log_files:
+            if result[log_file]["ok"]:
+                downloaded_files[log_file] = result[log_file]["content"]
+
+        # Keep the usage of the job to recommend resources for future ones
+        if "job.log" in downloaded_files:
+            job_log = downloaded_files["job.log"].decode("utf-8", errors="replace")
+            gridpack.data["resource_usage"] = parse_job_log(job_log)
+            self.logger.info(
+                "Resource usage of %s: %s", gridpack, gridpack.data["resource_usage"]
             )
-            # Get gridpack archive name
-            stdout, stderr, _ = ssh.execute_command(
-                [f"ls -1 {remote_directory}/*{dataset_name}*.t*z"]
+            # Jobs that ran out of time are submitted again with a longer
+            # flavour instead of failing
+            if (
+                not result["archive"]["ok"]
+                and exceeded_runtime(job_log)
+                and self.escalate_job_flavour(gridpack)
+            ):
+                self.database.update_gridpack(gridpack)
+                return
+
+        if result["archive"]["ok"]:
+            gridpack_archive = clean_split(result["archive"]["matches"][0], "/")[-1]
+            self.logger.info(
+                "Copied gridpack %s/%s->%s, exit code %s",
+                remote_directory,
+                gridpack_archive,
+                gridpack_directory,
+                result["sync"].get("exit_code"),
             )
-            self.logger.debug(stdout)
-            self.logger.debug(stderr)
-            stdout = clean_split(stdout, "\n")
-            for line in stdout:
-                filename = clean_split(line, "/")[-1]
-                if dataset_name in filename and filename.endswith(
-                    (".tar.xz", ".tar.gz", ".tgz")
-                ):
-                    gridpack_archive = filename
-                    break
-
-            if gridpack_archive:
-                gridpack_directory = gridpack.get_remote_storage_path()
-                self.logger.info(
-                    "Copying gridpack %s/%s->%s",
-                    remote_directory,
-                    gridpack_archive,
-                    gridpack_directory,
-                )
-                sync_command: str = (
-                    'rsync -e "ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null" '
-                    f"{remote_directory}/{gridpack_archive} "
-                    f"{submission_host}:{gridpack_directory}"
-                )
-                self.logger.info("Sync command: %s", sync_command)
-                stdout, stderr, _ = ssh.execute_command(sync_command)
-                self.logger.debug(stdout)
-                self.logger.debug(stderr)
-
-            # Remove the directory
-            ssh.execute_command([f"rm -rf {remote_directory}"])
-
-        downloaded_files = []
-        if os.path.isfile(f"{local_directory}/job.log"):
-            downloaded_files.append(f"{local_directory}/job.log")
-
-        if os.path.isfile(f"{local_directory}/output.log"):
-            downloaded_files.append(f"{local_directory}/output.log")
-
-        if os.path.isfile(f"{local_directory}/error.log"):
-            downloaded_files.append(f"{local_directory}/error.log")
 
         # Attach the script file for debugging
-        if os.path.isfile(f"{local_directory}/GRIDPACK_{gridpack_id}.sh"):
-            downloaded_files.append(f"{local_directory}/GRIDPACK_{gridpack_id}.sh")
+        script = gridpack.prepare_script()
+        downloaded_files[f"GRIDPACK_{gridpack_id}.sh"] = script.encode("utf-8")
 
         # Attach the cards archive for debugging
-        if os.path.isfile(f"{local_directory}/input_files.tar.gz"):
-            downloaded_files.append(f"{local_directory}/input_files.tar.gz")
-
-        attachments = []
-        if downloaded_files:
-            zip_file_name = f"{local_directory}/gridpack_{gridpack_id}_files.zip"
-            attachments.append(zip_file_name)
-            with zipfile.ZipFile(
-                zip_file_name, "w", zipfile.ZIP_DEFLATED
-            ) as zip_object:
-                for file_path in downloaded_files:
-                    zip_object.write(file_path, file_path.split("/")[-1])
+        archive = gridpack.get_submitted_job_archive()
+        if archive:
+            downloaded_files[gridpack.get_job_archive_name()] = archive
+
+        attachments = [
+            self.zip_attachment(f"gridpack_{gridpack_id}_files.zip", downloaded_files)
+        ]
 
         gridpack.data["archive"] = gridpack_archive
         if gridpack.get_status() != "failed":
@@ -765,9 +1326,9 @@ class Controller:
             gridpack.add_history_entry("failed")
             self.send_failed_notification(gridpack, files=attachments)
 
-        gridpack.rmdir()
         self.database.update_gridpack(gridpack)
         self.gridpacks_to_create_requests.append(gridpack_id)
+        self.release_attached_gridpacks(gridpack)
 
     def create_mcm_request(self, gridpack):
         """
@@ -795,39 +1356,59 @@ class Controller:
             self.send_invalid_mcm_request_notification(gridpack=gridpack)
             return
 
-        with SSHExecutor(
-            SUBMISSION_HOST, SERVICE_ACCOUNT_USERNAME, SERVICE_ACCOUNT_PASSWORD
-        ) as ssh:
-            ssh.execute_command(
-                [f"rm -rf {remote_directory}", f"mkdir -p {remote_directory}"]
-            )
-            ssh.upload_file(str(mcm_module_path), f"{remote_directory}/mcm_gridpack.py")
-            ssh.upload_as_file(fragment, f"{remote_directory}/fragment.py")
-
-            dev = not PRODUCTION
-            command = [
-                f"cd {remote_directory}",
-                f'python3 mcm_gridpack.py {"--dev" if dev else ""} '
-                '--fragment "fragment.py" '
-                f'--chain "{chain}" '
-                f'--dataset "{dataset_name}" '
-                f'--events "{events}" '
-                f'--tag "{process}" '
-                f'--generator "{generator}"',
-            ]
-            stdout, stderr, _ = ssh.execute_command(command)
-            self.logger.debug(stdout)
-            self.logger.debug(stderr)
-            stdout = clean_split(stdout, "\n")
-            prepid = None
-            for line in stdout:
-                if line.startswith("REQUEST PREPID:"):
-                    prepid = line.replace("REQUEST PREPID:", "").strip()
-                    break
-
-            gridpack.set_prepid(prepid)
-            # Remove the directory
-            ssh.execute_command([f"rm -rf {remote_directory}"])
+        dev = not PRODUCTION
+        command = (
+            f'python3 mcm_gridpack.py {"--dev" if dev else ""} '
+            '--fragment "fragment.py" '
+            f'--chain "{chain}" '
+            f'--dataset "{dataset_name}" '
+            f'--events "{events}" '
+            f'--tag "{process}" '
+            f'--generator "{generator}"'
+        )
+        script = RemoteScript()
+        script.run(
+            "prepare", f"rm -rf {remote_directory} && mkdir -p {remote_directory}"
+        )
+        script.write(
+            "module",
+            f"{remote_directory}/mcm_gridpack.py",
+            mcm_module_path.read_bytes(),
+            when="prepare",
+        )
+        script.write(
+            "fragment", f"{remote_directory}/fragment.py", fragment, when="prepare"
+        )
+        script.run(
+            "request", command, cwd=remote_directory, when=["module", "fragment"]
+        )
+        # Remove the directory
+        script.run("cleanup", f"rm -rf {remote_directory}")
+        with self.ssh_session() as ssh:
+            result = script.execute(ssh)
+
+        self.logger.debug(result["request"].get("stdout"))
+        self.logger.debug(result["request"]["error"])
+        prepid = None
+        for line in clean_split(result["request"].get("stdout", ""), "\n"):
+            if line.startswith("REQUEST PREPID:"):
+                prepid = line.replace("REQUEST PREPID:", "").strip()
+                break
+
+        gridpack.set_prepid(prepid)
+
+    @staticmethod
+    def zip_attachment(file_name, files) -> tuple:
+        """
+        Return a (file name, content) email attachment
+        with the given files zipped in memory
+        """
+        output = BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zip_object:
+            for name, content in files.items():
+                zip_object.writestr(name, content)
+
+        return file_name, output.getvalue()
 
     def send_submitted_notification(self, gridpack, files=None):
         """
@@ -9,6 +9,9 @@ from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError
 from src.tools.utils import clean_split
 
+# Most recent finished jobs used to recommend resources
+RESOURCE_SAMPLES = 50
+
 
 class Database:
     """
@@ -42,6 +45,16 @@ class Database:
             ]
 
         self.gridpacks = self.client[self.COLLECTION_NAME]
+        self.gridpacks.create_index("fingerprint")
+        self.gridpacks.create_index(
+            [
+                ("generator", 1),
+                ("process", 1),
+                ("dataset", 1),
+                ("resource_usage.exit_code", 1),
+                ("last_update", -1),
+            ]
+        )
 
     @classmethod
     def set_credentials(cls, username, password):
@@ -126,6 +139,17 @@ class Database:
         total_rows = gridpacks.count()
         return list(gridpacks), total_rows
 
+    def get_gridpacks_by_ids(self, gridpack_ids=None, query_dict=None):
+        """
+        Get list of gridpacks with one of the given IDs that match
+        the query, most recent first. All IDs if `gridpack_ids` is None.
+        """
+        query = dict(query_dict or {})
+        if gridpack_ids is not None:
+            query["_id"] = {"$in": list(gridpack_ids)}
+
+        return list(self.gridpacks.find(query).sort("_id", -1))
+
     def get_gridpacks_with_status(self, status):
         """
         Get list of gridpacks with given status
@@ -142,6 +166,53 @@ class Database:
         gridpacks = self.gridpacks.find({"condor_status": status})
         return list(gridpacks)
 
+    def get_gridpacks_by_fingerprint(self, fingerprint: str, status: str):
+        """
+        Get list of gridpacks with the given input fingerprint
+        and one of the given statuses, most recent first
+
+        Args:
+            fingerprint (str): Checksum of the Gridpack inputs.
+            status (str): Comma separated list of statuses.
+        Returns:
+            list: Gridpacks with the same inputs.
+        """
+        query = {
+            "fingerprint": fingerprint,
+            "$or": [{"status": s} for s in clean_split(status)],
+        }
+        gridpacks, _ = self.get_gridpacks(query_dict=query)
+        return gridpacks
+
+    def get_gridpacks_attached_to(self, gridpack_id: str):
+        """
+        Get list of gridpacks waiting for the output
+        of the given gridpack
+        """
+        query = {"status": "attached", "gridpack_reused": gridpack_id}
+        return list(self.gridpacks.find(query))
+
+    def get_resource_usage(
+        self, generator: str, process=None, dataset=None, limit=RESOURCE_SAMPLES
+    ):
+        """
+        Get the resource usage of the most recent finished jobs of gridpacks
+        with the given generator and, optionally, process and dataset
+        """
+        query = {"generator": generator, "resource_usage.exit_code": 0}
+        if process:
+            query["process"] = process
+
+        if dataset:
+            query["dataset"] = dataset
+
+        gridpacks = (
+            self.gridpacks.find(query, {"resource_usage": 1})
+            .sort("last_update", -1)
+            .limit(limit)
+        )
+        return [g["resource_usage"] for g in gridpacks]
+
     def get_gridpacks_by_archive(
         self, archive: str, campaign: str, generator: str, process: str
     ):
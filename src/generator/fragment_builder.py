@@ -7,11 +7,34 @@ repository.
 
 import os
 from os.path import join as path_join
-import json
 import logging
+from threading import Lock
 from environment import GRIDPACK_FILES_PATH
 from src.gridpack import Gridpack
-from src.tools.utils import get_indentation
+from src.tools.metadata import load_json
+from src.tools.template import Template, get_template
+
+# Fragment files -> (their compiled templates, template of the whole fragment)
+SKELETONS_CACHE = {}
+SKELETONS_CACHE_LOCK = Lock()
+
+
+def get_skeleton(paths: tuple) -> Template:
+    """
+    Return the template of the fragment made of the given files, it
+    is built again only if the template of one of the files changed
+    """
+    templates = tuple(get_template(path) for path in paths)
+    with SKELETONS_CACHE_LOCK:
+        cached = SKELETONS_CACHE.get(paths)
+        if cached and all(a is b for a, b in zip(cached[0], templates)):
+            return cached[1]
+
+    skeleton = Template("".join(f"{t.source.strip()}\n\n" for t in templates))
+    with SKELETONS_CACHE_LOCK:
+        SKELETONS_CACHE[paths] = (templates, skeleton)
+
+    return skeleton
 
 
 class FragmentBuilder:
@@ -29,36 +52,30 @@ class FragmentBuilder:
             file_list = [file_list]
 
         self.logger.info("List of files for fragment builder: %s", ",".join(file_list))
-        fragment = ""
-        for file_name in file_list:
-            with open(
-                path_join(self.fragments_path, file_name), encoding="utf-8"
-            ) as input_file:
-                contents = input_file.read().strip()
-
-            fragment += contents + "\n\n"
-
-        fragment = self.fragment_replace(fragment, gridpack)
-        return fragment
+        fragment_vars = self.get_fragment_vars(gridpack)
+        paths = tuple(path_join(self.fragments_path, f) for f in file_list)
+        return get_skeleton(paths).render(fragment_vars, join_lists=True)
 
     def get_external_lhe_producer(self):
         path = os.path.join("Templates", "ExternalLHEProducer.dat")
         if not os.path.exists(path):
             raise Exception(f"Could not find {path} as external LHE producer")
 
-        self.logger.debug("Reading %s", path)
-        with open(path, encoding="utf-8") as input_file:
-            contents = input_file.read()
-
+        contents = get_template(path).source
         return f"{contents.strip()}\n"  # Add newline to the end of the contents
 
     def fragment_replace(self, fragment, gridpack: Gridpack):
-        with open(self.imports_path, encoding="utf-8") as input_file:
-            import_dict = json.load(input_file)
-
+        template = Template(fragment)
+        return template.render(self.get_fragment_vars(gridpack), join_lists=True)
+
+    def get_fragment_vars(self, gridpack: Gridpack) -> dict:
+        """
+        Return the variables to be replaced in the fragment
+        """
+        import_dict = load_json(self.imports_path)
         dataset_dict = gridpack.get_dataset_dict()
         campaign_dict = gridpack.get_campaign_dict()
-        fragment_vars = dataset_dict.get("fragment_vars", [])
+        fragment_vars = dict(dataset_dict.get("fragment_vars", {}))
         fragment_vars.update(campaign_dict.get("fragment_vars", {}))
         tune = gridpack.get("tune")
         beam = campaign_dict.get("beam", 0)
@@ -77,12 +94,4 @@ class FragmentBuilder:
             "/cvmfs/cms.cern.ch/phys_generator/gridpacks/",
         )
         fragment_vars["pathToProducedGridpack"] = final_archive_path
-        for key, value in fragment_vars.items():
-            if isinstance(value, list):
-                indentation = " " * get_indentation(f"${key}", fragment)
-                value = [f"{indentation}{x}" for x in value]
-                value = ",\n".join(value).strip()
-
-            fragment = fragment.replace(f"${key}", str(value))
-
-        return fragment
+        return fragment_vars
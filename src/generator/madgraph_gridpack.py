@@ -5,22 +5,23 @@ related with Madgraph generator.
 
 import os
 import glob
-import pathlib
 from src.gridpack import Gridpack
+from src.tools.job_archive import JobArchive
 
 
 class MadgraphGridpack(Gridpack):
 
-    def prepare_default_card(self):
+    def prepare_default_card(self, archive: JobArchive):
         """
-        Copy default cards to local directory
+        Add default cards to the job archive
         """
         cards_path = self.get_cards_path()
-        job_files_path = self.get_job_files_path()
-        self.logger.debug("Copying %s/*.dat to %s", cards_path, job_files_path)
-        os.system(f"cp {cards_path}/*.dat {job_files_path}")
-        if glob.glob(f"{cards_path}/*_cuts.f"):
-            os.system(f"cp {cards_path}/*_cuts.f {job_files_path}")
+        self.logger.debug("Adding %s/*.dat and *_cuts.f to the archive", cards_path)
+        for card_path in sorted(glob.glob(f"{cards_path}/*.dat")):
+            archive.add_file(card_path)
+
+        for cuts_path in sorted(glob.glob(f"{cards_path}/*_cuts.f")):
+            archive.add_file(cuts_path)
 
     def get_run_card(self):
         """
@@ -30,7 +31,7 @@ class MadgraphGridpack(Gridpack):
         campaign_dict = self.get_campaign_dict()
         templates_path = self.get_templates_path()
         template_name = dataset_dict["template"]
-        replace_vars = dataset_dict.get("template_vars", [])
+        replace_vars = dict(dataset_dict.get("template_vars", {}))
         replace_vars["ebeam1"] = campaign_dict.get("beam", 0)
         replace_vars["ebeam2"] = replace_vars["ebeam1"]
         replace_vars.update(campaign_dict.get("template_vars", {}))
@@ -40,18 +41,16 @@ class MadgraphGridpack(Gridpack):
         )
         return run_card
 
-    def prepare_run_card(self):
+    def prepare_run_card(self, archive: JobArchive):
         """
-        Get run card and write it to job files dir
+        Get run card and add it to the job archive
         """
-        job_files_path = self.get_job_files_path()
         dataset_name = self.data["dataset"]
-        output_file_name = os.path.join(job_files_path, f"{dataset_name}_run_card.dat")
+        output_file_name = f"{dataset_name}_run_card.dat"
         run_card = self.get_run_card()
-        self.logger.debug("Writing customized run card %s", output_file_name)
+        self.logger.debug("Adding customized run card %s", output_file_name)
         self.logger.debug(run_card)
-        with open(output_file_name, "w", encoding="utf-8") as output_file:
-            output_file.write(run_card)
+        archive.add_bytes(output_file_name, run_card)
 
     def get_customize_card(self):
         """
@@ -61,7 +60,7 @@ class MadgraphGridpack(Gridpack):
         campaign_dict = self.get_campaign_dict()
         model_params_path = self.get_model_params_path()
         model_params_name = dataset_dict["model_params"]
-        replace_vars = dataset_dict.get("model_params_vars", [])
+        replace_vars = dict(dataset_dict.get("model_params_vars", {}))
         replace_vars.update(campaign_dict.get("model_params_vars", {}))
         input_file_name = os.path.join(model_params_path, model_params_name)
         customize_card = self.customize_file(
@@ -69,31 +68,23 @@ class MadgraphGridpack(Gridpack):
         )
         return customize_card
 
-    def prepare_customize_card(self):
+    def prepare_customize_card(self, archive: JobArchive):
         """
-        Get customize card and write it to job files dir
+        Get customize card and add it to the job archive
         """
-        job_files_path = self.get_job_files_path()
         dataset_name = self.data["dataset"]
-        output_file_name = os.path.join(
-            job_files_path, f"{dataset_name}_customizecards.dat"
-        )
+        output_file_name = f"{dataset_name}_customizecards.dat"
         customize_card = self.get_customize_card()
-        self.logger.debug("Writing customized card %s", output_file_name)
+        self.logger.debug("Adding customized card %s", output_file_name)
         self.logger.debug(customize_card)
-        with open(output_file_name, "w", encoding="utf-8") as output_file:
-            output_file.write(customize_card)
+        archive.add_bytes(output_file_name, customize_card)
 
-    def prepare_job_archive(self):
+    def get_job_archive(self) -> JobArchive:
         """
-        Make an archive with all necessary job files
+        Return an archive with all necessary job files
         """
-        job_files_path = self.get_job_files_path()
-        pathlib.Path(job_files_path).mkdir(parents=True, exist_ok=True)
-        self.prepare_default_card()
-        self.prepare_run_card()
-        self.prepare_customize_card()
-        local_dir = self.local_dir()
-        os.system(
-            f"tar -czvf {local_dir}/input_files.tar.gz -C {local_dir} input_files"
-        )
+        archive = self.create_job_archive()
+        self.prepare_default_card(archive)
+        self.prepare_run_card(archive)
+        self.prepare_customize_card(archive)
+        return archive
@@ -6,25 +6,31 @@ to validate and retrieve its data
 
 import os
 import logging
-import shutil
 import pathlib
-import json
 import time
+import hashlib
 from copy import deepcopy
+from typing import Optional
 from environment import (
     GEN_REPOSITORY,
     GRIDPACK_FILES_PATH,
     GRIDPACK_DIRECTORY,
+    JOB_ARCHIVE_CODECS,
     PRODUCTION,
 )
 from src.tools.utils import (
-    get_available_campaigns,
-    get_available_cards,
-    get_git_branches,
     check_append_path,
+    get_git_branch_head,
     wrap_into_singularity,
 )
 from src.tools.user import User
+from src.tools.job_archive import JobArchive
+from src.tools.artifact_cache import ARCHIVE_CACHE
+from src.tools.template import Template, get_template
+from src.tools.metadata import load_json
+from src.tools.validation_index import get_validation_index
+from src.tools.genproductions import GENPRODUCTIONS_ARCHIVE
+from src.tools.resource_usage import JOB_FLAVOURS
 from src.tools.ssh_executor import HTCondorExecutor
 
 
@@ -59,6 +65,18 @@ class Gridpack:
         "store_into_subfolders": False,
         "job_cores": 16,
         "job_memory": 32000,
+        # Host that submitted the job, it holds the job in its scheduler
+        "submission_host": "",
+        # Checksum of the job input archive
+        "input_hash": "",
+        # Checksum of everything that determines the output,
+        # gridpacks with the same one produce the same archive
+        "fingerprint": "",
+        # Usage of the last job, taken from its HTCondor log
+        "resource_usage": {},
+        # HTCondor job flavour, chosen from the runtime of previous jobs
+        # when it is approved. Empty to use the longest one
+        "job_flavour": "",
     }
 
     def __init__(self, data):
@@ -68,8 +86,6 @@ class Gridpack:
             )
 
         self.logger = logging.getLogger()
-        self.dataset_dict = None
-        self.campaign_dict = None
         self.data = data
 
     @staticmethod
@@ -92,55 +108,50 @@ class Gridpack:
 
         raise Exception(f"Could not make gridpack for generator {generator}")
 
-    def validate(self):
+    def validate(self, defaults=None):
+        """
+        Fill missing values, with the given defaults or the ones in the
+        schema, and return a description of the first error found
+        """
+        errors = self.get_validation_errors(defaults=defaults)
+        return errors[0] if errors else None
+
+    def get_validation_errors(self, index=None, defaults=None) -> list:
+        """
+        Fill missing values, with the given defaults or the ones in the
+        schema, and return a description of every error found.
+        Branches, campaigns and cards are checked against the given
+        validation index, or the one of the current repository tree.
+        """
+        defaults = defaults or {}
         for key, value in self.schema.items():
             if key not in self.data:
-                self.data[key] = deepcopy(value)
+                self.data[key] = deepcopy(defaults.get(key, value))
 
-        data_keys = set(self.data.keys())
-        schema_keys = set(self.schema.keys())
-        missing_keys = schema_keys - data_keys
-        if missing_keys:
-            return f'Missing keys {",".join(list(missing_keys))}'
-
-        unknown_keys = data_keys - schema_keys
+        errors = []
+        unknown_keys = set(self.data.keys()) - set(self.schema.keys())
         if unknown_keys:
-            return f'Unknown keys {",".join(list(unknown_keys))}'
-
-        branches = get_git_branches(GEN_REPOSITORY, cache=True)
-        genproductions = self.data["genproductions"]
-        if genproductions not in branches:
-            return f'Bad GEN productions branch "{genproductions}"'
+            errors.append(f'Unknown keys {",".join(list(unknown_keys))}')
 
+        index = index or get_validation_index()
+        errors.extend(index.get_errors(self.data))
         events = self.data["events"]
         if events <= 0:
-            return f'Bad events "{events}"'
-
-        campaigns = get_available_campaigns()
-        campaign = self.data["campaign"]
-        if campaign not in campaigns:
-            return f'Bad campaign "{campaign}"'
-
-        generator = self.data["generator"]
-        if generator not in campaigns[campaign]["generators"]:
-            return f'Bad generator "{generator}"'
-
-        cards = get_available_cards()
-        process = self.data["process"]
-        if process not in cards[generator]:
-            return f'Bad process "{process}"'
-
-        dataset = self.data["dataset"]
-        if dataset not in cards[generator][process]:
-            return f'Bad dataset "{dataset}"'
+            errors.append(f'Bad events "{events}"')
 
         memory = self.data["job_memory"]
         cores = self.data["job_cores"]
         minimum_memory = cores * MEMORY_FACTOR_MB
         if memory < minimum_memory:
-            return f"Memory set for Gridpack should be equal or greater than {minimum_memory} MB"
+            errors.append(
+                f"Memory set for Gridpack should be equal or greater than {minimum_memory} MB"
+            )
+
+        flavour = self.data["job_flavour"]
+        if flavour and flavour not in dict(JOB_FLAVOURS):
+            errors.append(f'Bad job flavour "{flavour}"')
 
-        return None
+        return errors
 
     def reset(self):
         self.set_status("new")
@@ -149,6 +160,10 @@ class Gridpack:
         self.data["dataset_name"] = self.get_dataset_name()
         self.set_condor_status("")
         self.set_condor_id(0)
+        self.set_submission_host("")
+        self.data["input_hash"] = ""
+        # Computed when it is needed to look for duplicates
+        self.data["fingerprint"] = ""
 
     def get_id(self):
         return self.data["_id"]
@@ -174,6 +189,15 @@ class Gridpack:
     def get_condor_id(self):
         return self.data["condor_id"]
 
+    def get_submission_host(self):
+        return self.data.get("submission_host", "")
+
+    def set_submission_host(self, host):
+        """
+        Setter for the host that submitted the job
+        """
+        self.data["submission_host"] = host
+
     def get_cores(self):
         return self.data.get("job_cores", Gridpack.schema["job_cores"])
 
@@ -189,6 +213,38 @@ class Gridpack:
         self.data.pop("job_cores", "")
         self.data.pop("job_memory", "")
 
+    def compute_fingerprint(self) -> str:
+        """
+        Compute the checksum of all the inputs of the job: campaign,
+        generator, process, dataset, tune, GEN productions branch and
+        its head commit and the content of the job input archive.
+        Empty if the head commit of the branch is not known yet, as
+        gridpacks can not be compared without it.
+        """
+        head_commit = get_git_branch_head(GEN_REPOSITORY, self.data["genproductions"])
+        if not head_commit:
+            return ""
+
+        fingerprint = hashlib.sha256()
+        keys = ("campaign", "generator", "process", "dataset", "tune", "genproductions")
+        for key in keys:
+            fingerprint.update(f"{key}={self.data[key]}\0".encode("utf-8"))
+
+        fingerprint.update(f"head_commit={head_commit}\0".encode("utf-8"))
+        archive_checksum = self.get_job_archive().get_checksum(self.data["generator"])
+        fingerprint.update(archive_checksum.encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def get_fingerprint(self) -> str:
+        """
+        Return the fingerprint, it is computed and stored
+        the first time as it renders the job archive
+        """
+        if not self.data.get("fingerprint"):
+            self.data["fingerprint"] = self.compute_fingerprint()
+
+        return self.data["fingerprint"]
+
     def get_gridpack_reused(self):
         """
         If this Gridpack is created based on another
@@ -238,37 +294,21 @@ class Gridpack:
 
     def get_dataset_dict(self):
         """
-        Return a dictionary from Cards directory
+        Return a read-only dictionary from Cards directory,
+        shared by all gridpacks of the dataset
         """
-        if self.dataset_dict:
-            return self.dataset_dict
-
         dataset_name = self.data["dataset"]
         cards_path = self.get_cards_path()
-        dataset_dict_file = os.path.join(cards_path, f"{dataset_name}.json")
-        self.logger.debug("Reading %s", dataset_dict_file)
-        with open(dataset_dict_file, encoding="utf-8") as input_file:
-            dataset_dict = json.load(input_file)
-
-        self.dataset_dict = dataset_dict
-        return dataset_dict
+        return load_json(os.path.join(cards_path, f"{dataset_name}.json"))
 
     def get_campaign_dict(self):
         """
-        Return a dictionary from Campaigns directory
+        Return a read-only dictionary from Campaigns directory,
+        shared by all gridpacks of the campaign
         """
-        if self.campaign_dict:
-            return self.campaign_dict
-
         campaign = self.data["campaign"]
         campaign_path = self.get_campaign_path()
-        campaign_dict_file = os.path.join(campaign_path, f"{campaign}.json")
-        self.logger.debug("Reading %s", campaign_dict_file)
-        with open(campaign_dict_file, encoding="utf-8") as input_file:
-            campaign_dict = json.load(input_file)
-
-        self.campaign_dict = campaign_dict
-        return campaign_dict
+        return load_json(os.path.join(campaign_path, f"{campaign}.json"))
 
     def get_cards_path(self):
         """
@@ -308,14 +348,6 @@ class Gridpack:
         model_params_path = os.path.join(campaign_path, generator, "ModelParams")
         return model_params_path
 
-    def get_job_files_path(self):
-        """
-        Return path of local job files
-        """
-        local_dir = self.local_dir()
-        job_files = os.path.join(local_dir, "input_files")
-        return job_files
-
     def __get_remote_storage_folder(self, include_until: int = 3) -> str:
         """
         Retrieves the remote storage path where Gridpacks are stored.
@@ -394,29 +426,6 @@ class Gridpack:
         except (TypeError, ValueError) as pe:
             raise ValueError(f"Error parsing path: {pe}") from pe
 
-    def mkdir(self):
-        """
-        Make local directory of gridpack
-        """
-        gridpack_id = self.get_id()
-        local_directory = f"gridpacks/{gridpack_id}"
-        pathlib.Path(local_directory).mkdir(parents=True, exist_ok=True)
-
-    def rmdir(self):
-        """
-        Remove local directory of gridpack
-        """
-        gridpack_id = self.get_id()
-        local_directory = f"gridpacks/{gridpack_id}"
-        shutil.rmtree(local_directory, ignore_errors=True)
-
-    def local_dir(self):
-        """
-        Return path to local directory of gridpack files
-        """
-        gridpack_id = self.get_id()
-        return os.path.abspath(f"gridpacks/{gridpack_id}")
-
     def add_history_entry(self, entry):
         """
         Add a simple string history entry
@@ -428,6 +437,16 @@ class Gridpack:
             {"user": user, "time": timestamp, "action": entry}
         )
 
+    def get_history_time(self, action) -> int:
+        """
+        Return the time of the last history entry with the given action,
+        0 if there is none
+        """
+        times = [
+            x["time"] for x in self.data.get("history", []) if x["action"] == action
+        ]
+        return max(times, default=0)
+
     def get_users(self):
         """
         Return a list of unique usernames of users in history
@@ -435,39 +454,93 @@ class Gridpack:
         users = set(x["user"] for x in self.data["history"] if x["user"] != "automatic")
         return sorted(list(users))
 
-    def prepare_job_archive(self):
+    def get_job_archive(self) -> JobArchive:
         """
-        Make an archive with all necessary card files
+        Return an archive with all necessary card files
         """
-        raise NotImplementedError(
-            "prepare_job_archive() must be implemented in subclass"
-        )
+        raise NotImplementedError("get_job_archive() must be implemented in subclass")
+
+    def get_archive_compression(self) -> tuple:
+        """
+        Return the codec and level used to compress the
+        job archive of this gridpack's generator
+        """
+        generator = self.data["generator"]
+        compression = JOB_ARCHIVE_CODECS.get(generator, JOB_ARCHIVE_CODECS["*"])
+        codec, _, level = compression.partition(":")
+        if not JobArchive.is_available(codec):
+            self.logger.warning(
+                "Compression codec %s for %s is not available, using gzip. "
+                "zstd requires the zstandard package",
+                codec,
+                generator,
+            )
+            return "gzip", JobArchive.DEFAULT_LEVELS["gzip"]
+
+        return codec, int(level) if level else JobArchive.DEFAULT_LEVELS[codec]
+
+    def get_job_archive_name(self) -> str:
+        """
+        Return the file name of the job archive
+        """
+        codec, _ = self.get_archive_compression()
+        return JobArchive.get_file_name(codec)
+
+    def create_job_archive(self) -> JobArchive:
+        """
+        Return an empty job archive with the generator's compression
+        """
+        codec, level = self.get_archive_compression()
+        return JobArchive(compresslevel=level, codec=codec)
+
+    def prepare_job_archive(self) -> bytes:
+        """
+        Return the compressed job archive. Archives with the same
+        inputs are taken from the artifact cache instead of being
+        compressed again.
+        """
+        archive = self.get_job_archive()
+        input_hash = archive.get_checksum(self.data["generator"])
+        self.data["input_hash"] = input_hash
+        content = ARCHIVE_CACHE.get(input_hash)
+        if content is not None:
+            self.logger.info("Reusing cached job archive %s for %s", input_hash, self)
+            return content
+
+        content = archive.build()
+        ARCHIVE_CACHE.put(input_hash, content)
+        return content
+
+    def get_submitted_job_archive(self) -> Optional[bytes]:
+        """
+        Return the job archive of the last submission
+        if it is still in the artifact cache
+        """
+        input_hash = self.data.get("input_hash")
+        return ARCHIVE_CACHE.get(input_hash) if input_hash else None
 
     def customize_file(self, input_file_name, user_additions, replacements):
         """
         Return a file customized with additional lines and variable replacements
         """
-        # Initial file
+        # Initial file, compiled once while it does not change
         self.logger.debug("Reading file %s", input_file_name)
-        with open(input_file_name, encoding="utf-8") as input_file:
-            contents = input_file.read()
+        template = get_template(input_file_name)
 
         # Append user settings
         if user_additions:
-            contents = contents.strip() + "\n\n# User settings\n"
+            contents = template.source.strip() + "\n\n# User settings\n"
             for user_line in user_additions:
                 self.logger.debug("Appeding %s", user_line)
                 contents += f"{user_line}\n"
 
-        # Variable replacement
-        if replacements:
-            for variable, value in replacements.items():
-                self.logger.debug('Replacing $%s with "%s"', variable, value)
-                contents = contents.replace(f"${variable}", str(value))
+            template = Template(contents)
 
-        return contents.strip() + "\n"
+        # Variable replacement
+        self.logger.debug("Replacing variables %s", replacements)
+        return template.render(replacements or {}).strip() + "\n"
 
-    def prepare_script(self):
+    def prepare_script(self) -> str:
         """
         Make a bash script that will run in condor
         """
@@ -475,24 +548,34 @@ class Gridpack:
         generator = self.data["generator"]
         dataset_name = self.data["dataset"]
         genproductions = self.data["genproductions"]
-        script_name = f"GRIDPACK_{self.get_id()}.sh"
-        command = [
+        codec, _ = self.get_archive_compression()
+        outside_singularity = [
             "#!/bin/sh",
             "export HOME=$(pwd)",
             "export ORG_PWD=$(pwd)",
             f"export NB_CORE={self.get_cores()}",
+            # The generator folder is pre-staged at submission, download
+            # the whole repository only if that was not possible
+            f"if [ -s {GENPRODUCTIONS_ARCHIVE} ]; then",
+            f"  tar -xzf {GENPRODUCTIONS_ARCHIVE}",
+            "else",
             # pylint: disable=line-too-long
-            f"wget https://github.com/{repository}/tarball/{genproductions} -O genproductions.tar.gz",
-            "tar -xzf genproductions.tar.gz",
-            f'GEN_FOLDER=$(ls -1 | grep {repository.replace("/", "-")}- | head -n 1)',
-            "echo $GEN_FOLDER",
-            "mv $GEN_FOLDER genproductions",
+            f"  wget https://github.com/{repository}/tarball/{genproductions} -O {GENPRODUCTIONS_ARCHIVE}",
+            f"  tar -xzf {GENPRODUCTIONS_ARCHIVE}",
+            f'  GEN_FOLDER=$(ls -1 | grep {repository.replace("/", "-")}- | head -n 1)',
+            "  echo $GEN_FOLDER",
+            "  mv $GEN_FOLDER genproductions",
+            "fi",
+            # Unpacked outside of the container, which may not have zstd
+            JobArchive.get_unpack_command(
+                codec, self.get_job_archive_name(), f"genproductions/bin/{generator}"
+            ),
+        ]
+        inside_singularity = [
             "cd genproductions",
             "git init",
             "cd ..",
-            f"mv input_files.tar.gz genproductions/bin/{generator}/",
             f"cd genproductions/bin/{generator}",
-            "tar -xzf input_files.tar.gz",
             'echo "Input files:"',
             "ls -lha input_files/",
             'echo "Running gridpack_generation.sh"',
@@ -504,9 +587,6 @@ class Gridpack:
         ]
 
         # Prepare to run via singularity
-        outside_index = 5
-        outside_singularity = command[:outside_index]
-        inside_singularity = command[outside_index:]
         wrapped = wrap_into_singularity(
             script_name=f"GRIDPACK_SINGULARITY_{self.get_id()}.sh",
             content=inside_singularity,
@@ -516,25 +596,27 @@ class Gridpack:
         execution_script = []
         execution_script += outside_singularity
         execution_script += wrapped
+        return "\n".join(execution_script)
 
-        script_path = os.path.join(self.local_dir(), script_name)
-        self.logger.debug("Writing sh script to %s", script_path)
-        with open(script_path, "w", encoding="utf-8") as script_file:
-            script_file.write("\n".join(execution_script))
-
-        os.system(f"chmod a+x {script_path}")
+    def get_job_flavour(self) -> str:
+        """
+        Get the HTCondor job flavour, the longest one if none was chosen
+        """
+        return self.data.get("job_flavour") or JOB_FLAVOURS[-1][0]
 
     def get_job_priority(self):
         """
-        Get the job's priority based on the
-        CPU cores requested.
+        Get the job's priority based on the CPU cores requested
+        and the job flavour, shorter jobs of the service run first.
         """
+        flavours = [name for name, _ in JOB_FLAVOURS]
+        shorter = len(flavours) - 1 - flavours.index(self.get_job_flavour())
         cores = self.get_cores()
         if 1 <= cores <= 16:
-            return 3
-        return 0
+            return 3 + shorter
+        return shorter
 
-    def prepare_jds_file(self):
+    def prepare_jds_file(self) -> str:
         """
         Make condor job description file
         """
@@ -543,10 +625,10 @@ class Gridpack:
         script_name = f"GRIDPACK_{gridpack_id}.sh"
         jds = [
             f"executable              = {script_name}",
-            "transfer_input_files    = input_files.tar.gz",
+            f"transfer_input_files    = {self.get_job_archive_name()}, {GENPRODUCTIONS_ARCHIVE}",
             "when_to_transfer_output = ON_EXIT_OR_EVICT",
             "should_transfer_files   = yes",
-            '+JobFlavour             = "nextweek"',
+            f'+JobFlavour             = "{self.get_job_flavour()}"',
             "output                  = output.log",
             "error                   = error.log",
             "log                     = job.log",
@@ -558,14 +640,13 @@ class Gridpack:
             f"+JobPrio               = {self.get_job_priority()}",
             # pylint: disable=line-too-long
             "leave_in_queue          = JobStatus == 4 && (CompletionDate =?= UNDEFINED || ((CurrentTime - CompletionDate) < 7200))",
+            # Jobs held for running longer than their flavour allows leave
+            # the queue, so they are collected and submitted with a longer one
+            "periodic_remove         = JobStatus == 5 && (HoldReasonCode == 46 || HoldReasonCode == 47)",
             "queue",
         ]
 
-        jds_name = f"GRIDPACK_{gridpack_id}.jds"
-        jds_path = os.path.join(self.local_dir(), jds_name)
-        self.logger.debug("Writing JDS to %s", jds_path)
-        with open(jds_path, "w", encoding="utf-8") as jds_file:
-            jds_file.write("\n".join(jds))
+        return "\n".join(jds)
 
     def get_dataset_name(self):
         """
@@ -0,0 +1,95 @@
+"""
+Module that keeps a size-bounded cache of built artifacts,
+like job input archives, in a local folder.
+Artifacts are stored by a key that identifies their inputs
+so they can be reused instead of being built again.
+"""
+
+import os
+import logging
+from typing import Optional
+from threading import Lock
+from environment import ARTIFACT_CACHE_DIRECTORY, ARTIFACT_CACHE_SIZE_MB
+
+
+class ArtifactCache:
+    """
+    Local folder with files named by their key.
+    When the total size goes over `max_size` bytes, the least
+    recently used files are removed. Using a file updates its
+    modification time, which is used for the ordering.
+    """
+
+    def __init__(self, directory, max_size):
+        self.logger = logging.getLogger()
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __path(self, key) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key) -> Optional[bytes]:
+        """
+        Return the content of the artifact for the key,
+        None if it is not in the cache
+        """
+        with self.lock:
+            cached_path = self.__path(key)
+            try:
+                os.utime(cached_path)
+                with open(cached_path, "rb") as cached_file:
+                    content = cached_file.read()
+            except FileNotFoundError:
+                self.stats["misses"] += 1
+                return None
+
+            self.stats["hits"] += 1
+            self.logger.debug("Artifact %s found in the cache", key)
+            return content
+
+    def put(self, key, content: bytes) -> None:
+        """
+        Store the artifact for the key and evict the least
+        recently used ones if the cache is too big
+        """
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            cached_path = self.__path(key)
+            partial_path = f"{cached_path}.part"
+            with open(partial_path, "wb") as partial_file:
+                partial_file.write(content)
+
+            os.replace(partial_path, cached_path)
+            self.__evict()
+
+    def __evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            self.logger.debug("Evicting %s from the artifact cache", path)
+            os.remove(path)
+            total_size -= size
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        """
+        Return the cache counters, for monitoring
+        """
+        with self.lock:
+            return dict(self.stats)
+
+
+# Built job input archives, keyed by the checksum of their content
+ARCHIVE_CACHE = ArtifactCache(
+    ARTIFACT_CACHE_DIRECTORY, ARTIFACT_CACHE_SIZE_MB * 1024**2
+)
@@ -0,0 +1,82 @@
+"""
+Module that streams the fragments and cards rendered for many
+gridpacks at once, as newline delimited JSON or as a zip archive.
+Results are written out as soon as they are rendered, so the whole
+response is never held in memory.
+"""
+
+import json
+import time
+import zipfile
+
+# Artifacts that can be rendered and their file names in the zip archive
+ARTIFACT_FILES = {
+    "fragment": "fragment.py",
+    "run_card": "run_card.dat",
+    "customize_card": "customize_card.dat",
+}
+
+
+class ChunkWriter:
+    """
+    Write-only file that keeps what is written until it is taken.
+    It can not seek, so zip archives written to it are streamed.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        """
+        Keep the data until it is taken
+        """
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        """
+        Nothing to flush, data is kept until it is taken
+        """
+
+    def take(self) -> bytes:
+        """
+        Return the data written since the last call
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def ndjson_chunks(results):
+    """
+    Yield one JSON line per rendered artifact
+    """
+    for result in results:
+        yield (json.dumps(result, sort_keys=True) + "\n").encode("utf-8")
+
+
+def zip_chunks(results):
+    """
+    Yield a zip archive with a <gridpack ID>/<artifact file> entry per
+    rendered artifact. Artifacts that could not be rendered are listed
+    with their errors in errors.json.
+    """
+    writer = ChunkWriter()
+    errors = []
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            if "error" in result:
+                errors.append(result)
+                continue
+
+            name = f"{result['gridpack_id']}/{ARTIFACT_FILES[result['artifact']]}"
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, result["content"])
+            yield writer.take()
+
+        if errors:
+            archive.writestr("errors.json", json.dumps(errors, indent=1))
+
+    yield writer.take()
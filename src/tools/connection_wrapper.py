@@ -74,6 +74,24 @@ class ConnectionWrapper:
         """
         Make a HTTP request to given url
         """
+        response = self.request(method, url, data, headers)
+        if response is None:
+            return None
+
+        status, _, body = response
+        if status != 200:
+            self.logger.error(
+                "Error %d while doing %s to %s: %s", status, method, url, body
+            )
+
+        return body
+
+    def request(self, method, url, data=None, headers=None):
+        """
+        Make a HTTP request to given url and return the status code,
+        the response headers (with lowercase names) and the body.
+        None if the request failed after all the attempts.
+        """
         if not self.connection:
             self.init_connection()
 
@@ -95,25 +113,17 @@ class ConnectionWrapper:
                 self.connection.request(method, url, body=data, headers=all_headers)
                 response = self.connection.getresponse()
                 response_to_return = response.read()
-                if response.status != 200:
-                    self.logger.error(
-                        "Error %d while doing %s to %s: %s",
-                        response.status,
-                        method,
-                        url,
-                        response_to_return,
-                    )
-                    return response_to_return
-
                 end_time = time.time()
                 self.logger.debug(
-                    "%s request to %s%s took %.2f",
+                    "%s request to %s%s returned %d, took %.2f",
                     method,
                     self.host_url,
                     url,
+                    response.status,
                     end_time - start_time,
                 )
-                return response_to_return
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+                return response.status, response_headers, response_to_return
             except Exception as ex:
                 self.logger.error(
                     "Exception while doing a %s to %s: %s", method, url, str(ex)
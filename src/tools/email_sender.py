@@ -43,7 +43,8 @@ class EmailSender:
 
     def send(self, subject, body, recipients, files=None):
         """
-        Send email
+        Send email, files are paths to local files
+        or (file name, content) pairs built in memory
         """
         body = body.strip()
         body += "\n\nSincerely,\nGridpack Extravaganza Machine"
@@ -66,10 +67,15 @@ class EmailSender:
         if files:
             for path in files:
                 attachment = MIMEBase("application", "octet-stream")
-                with open(path, "rb") as attachment_file:
-                    attachment.set_payload(attachment_file.read())
+                if isinstance(path, tuple):
+                    file_name, content = path
+                    attachment.set_payload(content)
+                else:
+                    with open(path, "rb") as attachment_file:
+                        attachment.set_payload(attachment_file.read())
+
+                    file_name = path.split("/")[-1]
 
-                file_name = path.split("/")[-1]
                 encoders.encode_base64(attachment)
                 attachment.add_header(
                     "Content-Disposition", f'attachment; filename="{file_name}"'
@@ -0,0 +1,217 @@
+"""
+Module that watches a folder tree with Linux inotify and reports the
+paths that changed, so caches built from the files can be updated
+within seconds instead of waiting for the next repository update.
+inotify is used through the C library, it is only available on Linux.
+"""
+
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+from threading import Thread
+from typing import Callable, Optional
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+# Watch descriptor, mask, cookie and length of the name that follows
+EVENT_HEADER = struct.Struct("iIII")
+# Folders that are never watched
+IGNORED_FOLDERS = {".git"}
+
+
+def get_libc():
+    """
+    Return the C library if it has inotify, None otherwise
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _ = libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+class FilesWatcher:
+    """
+    Thread that watches every folder under `path`. Changed paths, relative
+    to `path`, are collected until there are no changes for `debounce`
+    seconds and then passed to `callback` at once. Folders end with "/".
+    If the kernel drops events, `callback` gets None: anything may have changed.
+    """
+
+    def __init__(
+        self, path: str, callback: Callable[[Optional[set]], None], debounce=2.0
+    ):
+        self.logger = logging.getLogger()
+        self.path = os.path.normpath(path)
+        self.callback = callback
+        self.debounce = debounce
+        self.libc = None
+        self.fd = -1
+        # Watch descriptor -> folder path
+        self.folders = {}
+        self.running = False
+        self.thread = None
+
+    @staticmethod
+    def is_available() -> bool:
+        """
+        Return whether inotify can be used
+        """
+        return get_libc() is not None
+
+    def start(self) -> None:
+        """
+        Watch the folder tree and start reporting changes
+        """
+        self.libc = get_libc()
+        if not self.libc:
+            raise OSError("inotify is not available")
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not initialize inotify")
+
+        self.__watch_tree(self.path)
+        self.logger.info("Watching %s folders in %s", len(self.folders), self.path)
+        self.running = True
+        self.thread = Thread(target=self.__run, name="files-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop reporting changes
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+        self.folders = {}
+
+    def __watch(self, folder: str) -> None:
+        descriptor = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(folder), WATCH_MASK
+        )
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            self.logger.warning(
+                "Could not watch %s: %s", folder, os.strerror(error or errno.EINVAL)
+            )
+            return
+
+        self.folders[descriptor] = folder
+
+    def __watch_tree(self, root: str) -> list:
+        """
+        Watch a folder and its subfolders, return the
+        files found in them, relative to `path`
+        """
+        files = []
+        for folder, subfolders, file_names in os.walk(root):
+            subfolders[:] = [s for s in subfolders if s not in IGNORED_FOLDERS]
+            self.__watch(folder)
+            files.extend(
+                os.path.relpath(os.path.join(folder, f), self.path) for f in file_names
+            )
+
+        return files
+
+    def __read_events(self) -> Optional[set]:
+        """
+        Return the changed paths of the pending events,
+        None if the kernel dropped some of them
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        overflow = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+
+            folder = self.folders.get(descriptor)
+            if mask & IN_IGNORED:
+                self.folders.pop(descriptor, None)
+                continue
+
+            if not folder or not name or name in IGNORED_FOLDERS:
+                continue
+
+            path = os.path.join(folder, name)
+            relative_path = os.path.relpath(path, self.path)
+            if not mask & IN_ISDIR:
+                changes.add(relative_path)
+                continue
+
+            changes.add(f"{relative_path}/")
+            if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                # Files of folders made or moved in before they were watched
+                changes.update(self.__watch_tree(path))
+
+        return None if overflow else changes
+
+    def __notify(self, changes: Optional[set]) -> None:
+        try:
+            self.callback(changes)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.error("Error handling file changes: %s", ex, exc_info=True)
+
+    def __run(self) -> None:
+        pending = set()
+        overflow = False
+        last_event = 0
+        while self.running:
+            # Wake up at least every second to check if it should stop
+            timeout = min(self.debounce, 1) if pending or overflow else 1
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if readable:
+                changes = self.__read_events()
+                if changes is None:
+                    overflow = True
+                else:
+                    pending.update(changes)
+
+                last_event = time.monotonic()
+                continue
+
+            if (pending or overflow) and time.monotonic() - last_event >= self.debounce:
+                self.__notify(None if overflow else pending)
+                pending = set()
+                overflow = False
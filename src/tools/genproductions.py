@@ -0,0 +1,58 @@
+"""
+Module that pre-stages genproductions archives in the remote cache.
+Jobs only need the `bin/<generator>` folder of the repository, so an
+archive with that folder is made once per commit and generator and
+linked into the job directory, instead of every job downloading
+the full repository from GitHub.
+"""
+
+from environment import REMOTE_CACHE_DIRECTORY
+
+# Name of the archive in the job directory
+GENPRODUCTIONS_ARCHIVE = "genproductions.tar.gz"
+
+
+def get_staged_archive_path(commit: str, generator: str) -> str:
+    """
+    Return the path of the staged archive in the remote cache
+    """
+    return f"{REMOTE_CACHE_DIRECTORY}/genproductions/{commit}/{generator}.tar.gz"
+
+
+def get_stage_command(repository: str, commit: str, generator: str, copy_to: str):
+    """
+    Return a command that puts the `bin/<generator>` archive of the commit in
+    `copy_to`, staging it first if this commit was not used before.
+    The archive is extracted as `genproductions/bin/<generator>`.
+    If the commit is unknown or staging fails, an empty file is left in place
+    and the job downloads the repository by itself.
+    """
+    if not commit:
+        return f": > {copy_to}"
+
+    staged = get_staged_archive_path(commit, generator)
+    staged_folder = staged.rsplit("/", 1)[0]
+    # Archives are made in a temporary folder and moved in place,
+    # so concurrent submissions never see a partial archive
+    return "\n".join(
+        [
+            f'STAGED="{staged}"',
+            'if [ ! -s "$STAGED" ]; then',
+            f'  mkdir -p "{staged_folder}"',
+            f'  STAGE_DIR=$(mktemp -d -p "{staged_folder}")',
+            '  mkdir "$STAGE_DIR/genproductions" && \\',
+            # pylint: disable=line-too-long
+            f'  wget -q https://github.com/{repository}/tarball/{commit} -O "$STAGE_DIR/full.tar.gz" && \\',
+            f'  tar -xzf "$STAGE_DIR/full.tar.gz" -C "$STAGE_DIR/genproductions" --strip-components=1 --wildcards "*/bin/{generator}/*" && \\',
+            f'  tar -czf "$STAGE_DIR/{generator}.tar.gz" -C "$STAGE_DIR" genproductions && \\',
+            f'  mv -f "$STAGE_DIR/{generator}.tar.gz" "$STAGED"',
+            '  rm -rf "$STAGE_DIR"',
+            "fi",
+            'if [ -s "$STAGED" ]; then',
+            '  touch "$STAGED"',
+            f'  ln -f "$STAGED" {copy_to} 2>/dev/null || cp -f "$STAGED" {copy_to}',
+            "else",
+            f"  : > {copy_to}",
+            "fi",
+        ]
+    )
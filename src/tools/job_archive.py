@@ -0,0 +1,181 @@
+"""
+Module that builds the compressed archive with the input files
+of a gridpack job in-process, without copying the files to a
+temporary folder or calling tar.
+Archives are compressed with gzip or, if the zstandard package
+is installed, with zstd.
+"""
+
+import os
+import gzip
+import hashlib
+import tarfile
+import logging
+from io import BytesIO
+from typing import Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class JobArchive:
+    """
+    Archive of job input files under a single root folder.
+    Files are added from memory or from disk and written as a
+    compressed stream when the archive is built. The output only
+    depends on the added files: names are kept in the order they
+    were added and timestamps and owners are fixed, so identical
+    inputs produce identical archives.
+    """
+
+    # Codec -> extension of the archive file
+    EXTENSIONS = {"gzip": ".tar.gz", "zstd": ".tar.zst"}
+    # Codec -> compression level used when none is given
+    DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+    def __init__(self, root="input_files", compresslevel=6, codec="gzip"):
+        if not self.is_available(codec):
+            raise ValueError(f"Compression codec {codec} is not available")
+
+        self.logger = logging.getLogger()
+        self.root = root
+        self.compresslevel = compresslevel
+        self.codec = codec
+        # Archive name -> bytes or path to a local file
+        self.members = {}
+
+    def __member_info(self, name, size, directory=False) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(f"{self.root}/{name}" if name else self.root)
+        info.size = size
+        info.mtime = 0
+        info.mode = 0o755 if directory else 0o644
+        info.type = tarfile.DIRTYPE if directory else tarfile.REGTYPE
+        return info
+
+    @classmethod
+    def is_available(cls, codec) -> bool:
+        """
+        Return whether archives can be compressed with the codec
+        """
+        if codec == "zstd":
+            return zstandard is not None
+
+        return codec in cls.EXTENSIONS
+
+    @classmethod
+    def get_file_name(cls, codec, root="input_files") -> str:
+        """
+        Return the file name of an archive compressed with the codec
+        """
+        return f"{root}{cls.EXTENSIONS[codec]}"
+
+    @staticmethod
+    def get_unpack_command(codec, file_name, directory) -> str:
+        """
+        Return a shell command that extracts the archive into the directory
+        """
+        if codec == "zstd":
+            return f"zstd -dc {file_name} | tar -xf - -C {directory}"
+
+        return f"tar -xzf {file_name} -C {directory}"
+
+    def add_bytes(self, name: str, content: Union[str, bytes]) -> None:
+        """
+        Add a file with the given content
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        self.members[name] = content
+
+    def add_file(self, path: str, name=None) -> None:
+        """
+        Add a local file, it is read when the archive is written
+        """
+        self.members[name or os.path.basename(path)] = path
+
+    def get_checksum(self, *extra) -> str:
+        """
+        Return the SHA-256 checksum of the archive inputs: names and
+        contents of the files, compression settings and the given extra
+        values, e.g. the generator. Archives with the same checksum
+        have the same content.
+        """
+        checksum = hashlib.sha256()
+        # gzip archives keep the checksum they had before codecs were added
+        codec = () if self.codec == "gzip" else (self.codec,)
+        for value in (self.root, self.compresslevel, *codec, *extra):
+            checksum.update(f"{value}\0".encode("utf-8"))
+
+        for name, content in self.members.items():
+            checksum.update(f"{name}\0".encode("utf-8"))
+            if isinstance(content, bytes):
+                checksum.update(hashlib.sha256(content).digest())
+            else:
+                with open(content, "rb") as input_file:
+                    checksum.update(hashlib.sha256(input_file.read()).digest())
+
+        return checksum.hexdigest()
+
+    def get_names(self) -> list:
+        """
+        Return the names of the files in the archive
+        """
+        return list(self.members)
+
+    def __write_members(self, archive: tarfile.TarFile) -> None:
+        archive.addfile(self.__member_info("", 0, directory=True))
+        for name, content in self.members.items():
+            if isinstance(content, bytes):
+                info = self.__member_info(name, len(content))
+                archive.addfile(info, BytesIO(content))
+            else:
+                info = self.__member_info(name, os.path.getsize(content))
+                with open(content, "rb") as input_file:
+                    archive.addfile(info, input_file)
+
+    def write(self, output_file) -> None:
+        """
+        Write the compressed archive to a binary file object
+        """
+        if self.codec == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self.compresslevel)
+            with compressor.stream_writer(output_file, closefd=False) as compressed:
+                # The zstd writer is not seekable, so tar is written as a stream
+                with tarfile.open(fileobj=compressed, mode="w|") as archive:
+                    self.__write_members(archive)
+
+            return
+
+        with gzip.GzipFile(
+            fileobj=output_file,
+            mode="wb",
+            mtime=0,
+            compresslevel=self.compresslevel,
+        ) as compressed:
+            with tarfile.open(fileobj=compressed, mode="w") as archive:
+                self.__write_members(archive)
+
+    def save(self, path: str) -> None:
+        """
+        Write the compressed archive to a local file
+        """
+        with open(path, "wb") as output_file:
+            self.write(output_file)
+
+        self.logger.debug(
+            "Wrote %s files (%s bytes) to %s",
+            len(self.members),
+            os.path.getsize(path),
+            path,
+        )
+
+    def build(self) -> bytes:
+        """
+        Return the compressed archive
+        """
+        output = BytesIO()
+        self.write(output)
+        return output.getvalue()
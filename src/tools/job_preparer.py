@@ -0,0 +1,170 @@
+"""
+Module that prepares the files of gridpack jobs in the background.
+Cards are rendered and the job archive is built as soon as a gridpack
+is approved, so submitting it only requires uploading the files.
+"""
+
+import logging
+from threading import Lock
+from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from environment import GRIDPACK_FILES_PATH
+from src.tools.metadata import get_head_commit
+
+# Gridpack values the job files are rendered from
+INPUT_KEYS = (
+    "campaign",
+    "generator",
+    "process",
+    "dataset",
+    "tune",
+    "events",
+    "genproductions",
+)
+
+
+def prepare_job(gridpack) -> dict:
+    """
+    Render the job script, the job description and the job archive.
+
+    Returns:
+        dict: Job files by name, the compressed job archive,
+            its file name and the checksum of its inputs.
+    """
+    gridpack_id = gridpack.get_id()
+    archive = gridpack.prepare_job_archive()
+    return {
+        "files": {
+            f"GRIDPACK_{gridpack_id}.sh": gridpack.prepare_script().encode("utf-8"),
+            f"GRIDPACK_{gridpack_id}.jds": gridpack.prepare_jds_file().encode("utf-8"),
+        },
+        "archive": archive,
+        "archive_name": gridpack.get_job_archive_name(),
+        "input_hash": gridpack.data["input_hash"],
+    }
+
+
+class JobPreparer:
+    """
+    Pool of threads that run `prepare_job` for approved gridpacks.
+    Prepared jobs are kept until they are taken for submission or until
+    their preparation fails, then the error is reported once.
+    """
+
+    def __init__(self, workers):
+        self.logger = logging.getLogger()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job-preparer"
+        )
+        self.lock = Lock()
+        # Gridpack ID -> (key, future)
+        self.jobs = {}
+
+    @staticmethod
+    def get_key(gridpack) -> tuple:
+        """
+        Return the values the prepared files depend on, they are prepared
+        again if any of them changes. Only cheap values are used, cards are
+        rendered and hashed in the background by `prepare_job`.
+        """
+        return (
+            get_head_commit(GRIDPACK_FILES_PATH),
+            *(gridpack.data.get(key) for key in INPUT_KEYS),
+            gridpack.get_cores(),
+            gridpack.get_memory(),
+            gridpack.get_job_flavour(),
+        )
+
+    def __prepare(self, gridpack) -> dict:
+        self.logger.info("Preparing job files for %s", gridpack)
+        return prepare_job(gridpack)
+
+    def prepare(self, gridpack) -> None:
+        """
+        Start preparing the job files of the gridpack. Errors are
+        not raised, they are reported by `pop_errors`.
+        """
+        gridpack_id = gridpack.get_id()
+        try:
+            key = self.get_key(gridpack)
+        except Exception as error:  # pylint: disable=broad-except
+            future = Future()
+            future.set_exception(error)
+            with self.lock:
+                self.jobs[gridpack_id] = (None, future)
+
+            return
+
+        with self.lock:
+            job = self.jobs.get(gridpack_id)
+            if job and job[0] == key:
+                return
+
+            future = self.executor.submit(self.__prepare, gridpack)
+            self.jobs[gridpack_id] = (key, future)
+
+    def discard(self, gridpack_id) -> None:
+        """
+        Forget the job files of the gridpack, e.g. after a reset
+        """
+        with self.lock:
+            job = self.jobs.pop(gridpack_id, None)
+
+        if job:
+            job[1].cancel()
+
+    def clear(self) -> None:
+        """
+        Forget the job files of all gridpacks, e.g. after files of the
+        GridpackFiles checkout changed in place, they are prepared again
+        when the gridpacks are submitted
+        """
+        with self.lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+
+        for _, future in jobs:
+            future.cancel()
+
+    def pop_errors(self) -> list:
+        """
+        Return (gridpack ID, exception) for the preparations
+        that failed since the last call
+        """
+        errors = []
+        with self.lock:
+            for gridpack_id, (_, future) in list(self.jobs.items()):
+                if future.done() and not future.cancelled() and future.exception():
+                    errors.append((gridpack_id, future.exception()))
+                    del self.jobs[gridpack_id]
+
+        return errors
+
+    def take(self, gridpack) -> dict:
+        """
+        Return the prepared job files of the gridpack, waiting for them
+        if they are being prepared. They are prepared right away if they
+        were not requested before or the gridpack changed since then.
+        """
+        with self.lock:
+            job: Optional[tuple] = self.jobs.pop(gridpack.get_id(), None)
+
+        if job and job[0] == self.get_key(gridpack):
+            prepared = job[1].result()
+            gridpack.data["input_hash"] = prepared["input_hash"]
+            return prepared
+
+        if job:
+            job[1].cancel()
+
+        return prepare_job(gridpack)
+
+    def get_stats(self) -> dict:
+        """
+        Return the number of jobs being prepared and prepared, for monitoring
+        """
+        with self.lock:
+            futures = [future for _, future in self.jobs.values()]
+
+        done = sum(1 for future in futures if future.done())
+        return {"pending": len(futures) - done, "prepared": done}
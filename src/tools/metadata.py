@@ -0,0 +1,138 @@
+"""
+Module that caches the campaign and dataset JSON files of the
+GridpackFiles repository for the whole process. Files are parsed once
+per repository commit and shared as read-only objects, so gridpacks
+made from the same files do not read and parse them again.
+"""
+
+import os
+import json
+import logging
+import subprocess
+from threading import Lock
+from environment import GRIDPACK_FILES_PATH
+
+# (commit, path) -> parsed file
+METADATA_CACHE = {}
+METADATA_CACHE_LOCK = Lock()
+# Repository path -> HEAD commit
+HEAD_COMMITS = {}
+
+
+class FrozenDict(dict):
+    """
+    Dictionary that can not be modified. Copies made with `dict()`
+    or `.copy()` are regular dictionaries that can be modified.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} can not be modified")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        # Copies and pickles are regular dictionaries
+        return (dict, (dict(self),))
+
+
+class FrozenList(list):
+    """
+    List that can not be modified. Copies made with `list()`
+    or `.copy()` are regular lists that can be modified.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} can not be modified")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze(value):
+    """
+    Return a read-only version of a parsed JSON value
+    """
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+
+    return value
+
+
+def get_head_commit(repository_path: str) -> str:
+    """
+    Return the HEAD commit of a repository, read once until the
+    cache is refreshed. Empty if the path is not a git repository.
+    """
+    commit = HEAD_COMMITS.get(repository_path)
+    if commit is not None:
+        return commit
+
+    command = ["git", "-C", repository_path, "rev-parse", "--show-toplevel", "HEAD"]
+    commit = ""
+    try:
+        result = subprocess.run(command, capture_output=True, check=False)
+        output = result.stdout.decode("utf-8").split()
+        # Folders inside another repository do not count
+        if not result.returncode and len(output) == 2:
+            if os.path.realpath(output[0]) == os.path.realpath(repository_path):
+                commit = output[1]
+    except OSError:
+        pass
+
+    HEAD_COMMITS[repository_path] = commit
+    return commit
+
+
+def load_json(path: str):
+    """
+    Return the read-only parsed content of a JSON file of the GridpackFiles
+    repository. Files are parsed once per commit, or once per modification
+    if the repository is not a git checkout.
+    """
+    commit = get_head_commit(GRIDPACK_FILES_PATH)
+    if commit:
+        key = (commit, path)
+    else:
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size, path)
+
+    with METADATA_CACHE_LOCK:
+        if key in METADATA_CACHE:
+            return METADATA_CACHE[key]
+
+    logging.getLogger().debug("Reading %s", path)
+    with open(path, encoding="utf-8") as input_file:
+        content = freeze(json.load(input_file))
+
+    with METADATA_CACHE_LOCK:
+        METADATA_CACHE[key] = content
+
+    return content
+
+
+def forget_metadata(paths) -> None:
+    """
+    Forget the parsed content of the given files,
+    they are parsed again the next time they are used
+    """
+    paths = {os.path.normpath(p) for p in paths}
+    with METADATA_CACHE_LOCK:
+        for key in [k for k in METADATA_CACHE if os.path.normpath(k[-1]) in paths]:
+            del METADATA_CACHE[key]
+
+
+def refresh_metadata_cache() -> None:
+    """
+    Forget the parsed files and the HEAD commit,
+    e.g. after pulling the repository
+    """
+    with METADATA_CACHE_LOCK:
+        METADATA_CACHE.clear()
+        HEAD_COMMITS.clear()
@@ -0,0 +1,129 @@
+"""
+This module is executed in the remote host by `RemoteScript`.
+It runs a list of steps in a single SSH execution and prints
+a structured JSON result for all of them.
+Its source is sent with `python3 -S -` followed by a call to `main`
+with the steps, so it must only use the standard library. The
+interpreter start is most of its run time, so it skips the site
+packages and imports as few modules as possible.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import zlib
+import base64
+
+RESULT_START = "--- REMOTE SCRIPT RESULT START ---"
+RESULT_END = "--- REMOTE SCRIPT RESULT END ---"
+# Characters per line of the result, `SSHExecutor`
+# keeps the first 256 characters of each line
+LINE_LENGTH = 240
+
+
+def read_output(path):
+    """
+    Return the text of a command output file and remove it
+    """
+    try:
+        with open(path, "rb") as output_file:
+            return output_file.read().decode("utf-8", errors="replace")
+    finally:
+        os.remove(path)
+
+
+def run_command(step):
+    """
+    Run a bash command with the variables in the environment.
+    It uses os.system, importing subprocess takes longer than
+    most of the commands take to run.
+    """
+    output = f"{os.environ.get('TMPDIR', '/tmp')}/remote_runner_{os.getpid()}"
+    os.environ["RUNNER_COMMAND"] = step["command"]
+    os.environ["RUNNER_CWD"] = step.get("cwd") or "."
+    timeout = f"timeout {int(step['timeout'])} " if step.get("timeout") else ""
+    status = os.system(
+        f'{{ cd "$RUNNER_CWD" && {timeout}bash -c "$RUNNER_COMMAND"; }} '
+        f'> "{output}.out" 2> "{output}.err" < /dev/null'
+    )
+    exit_code = os.waitstatus_to_exitcode(status)
+    stdout = read_output(f"{output}.out")
+    stderr = read_output(f"{output}.err")
+    if timeout and exit_code == 124:
+        return {"ok": False, "error": f"Timeout after {step['timeout']}s"}
+
+    error = ""
+    if exit_code != 0:
+        error = stderr.strip() or f"Exit code {exit_code}"
+
+    return {
+        "ok": exit_code == 0,
+        "exit_code": exit_code,
+        "stdout": stdout,
+        "stderr": stderr,
+        "error": error,
+    }
+
+
+def run_step(step):
+    """
+    Run a single step and return its result
+    """
+    kind = step["type"]
+    if kind == "run":
+        return run_command(step)
+
+    if kind == "write":
+        path = step["path"]
+        with open(path, "wb") as output_file:
+            output_file.write(base64.b64decode(step["content"]))
+
+        return {"ok": True}
+
+    if kind == "read":
+        with open(step["path"], "rb") as input_file:
+            content = input_file.read()
+
+        # Logs are mostly text, the fastest level already makes them
+        # several times smaller and costs a fraction of the default one
+        content = base64.b64encode(zlib.compress(content, 1)).decode("ascii")
+        return {"ok": True, "content": content}
+
+    if kind == "glob":
+        matches = sorted(set(m for p in step["patterns"] for m in glob.glob(p)))
+        if matches and step.get("export"):
+            os.environ[step["export"]] = matches[0]
+
+        return {"ok": bool(matches), "matches": matches}
+
+    raise ValueError(f"Unknown step type {kind}")
+
+
+def main(steps):
+    """
+    Run the steps in order and print the result of each of them.
+    A step with `when` only runs if all the steps named there succeeded.
+    """
+    start_time = time.time()
+    results = {}
+    for step in steps:
+        when = step.get("when", [])
+        if not all(results.get(name, {}).get("ok") for name in when):
+            results[step["name"]] = {"ok": False, "skipped": True}
+            continue
+
+        try:
+            results[step["name"]] = run_step(step)
+        except Exception as ex:  # pylint: disable=broad-except
+            results[step["name"]] = {"ok": False, "error": str(ex)}
+
+    output = {"steps": results, "elapsed": time.time() - start_time}
+    # Lines of the output are truncated, so the result is split in short
+    # lines. JSON escapes new lines, the reader joins them back.
+    result = json.dumps(output)
+    lines = "\n".join(
+        result[i : i + LINE_LENGTH] for i in range(0, len(result), LINE_LENGTH)
+    )
+    sys.stdout.write(f"\n{RESULT_START}\n{lines}\n{RESULT_END}\n")
@@ -0,0 +1,150 @@
+"""
+Module that compiles multi-step remote operations, like preparing
+a folder, writing files, running commands and reading their output,
+into a single script that is executed with one SSH command.
+"""
+
+import json
+import zlib
+import base64
+import logging
+from typing import Optional, Union
+from src.tools.ssh_executor import SSHExecutor
+from src.tools.remote_runner import RESULT_START, RESULT_END
+from src.tools.utils import get_module_path
+
+# Source of the module that runs the steps in the remote host
+RUNNER_CACHE = {}
+
+
+def get_runner_source() -> str:
+    """
+    Return the source of the remote runner module
+    """
+    if "source" not in RUNNER_CACHE:
+        runner_path = get_module_path("src.tools.remote_runner")
+        if not runner_path:
+            raise FileNotFoundError("Remote runner module couldn't be found")
+
+        RUNNER_CACHE["source"] = runner_path.read_text(encoding="utf-8")
+
+    return RUNNER_CACHE["source"]
+
+
+class RemoteScript:
+    """
+    Sequence of named steps executed in the remote host in a single round trip.
+    Every step can depend on other steps with `when`, it is skipped unless
+    all of them succeeded. The result of each step is returned by its name:
+      - run: exit_code, stdout, stderr
+      - write: nothing else
+      - read: content (bytes)
+      - glob: matches (sorted remote paths)
+    All results contain "ok" and failed ones contain "error" or "skipped".
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger()
+        self.steps = []
+
+    def __add(self, step_type: str, name: str, when, **kwargs) -> "RemoteScript":
+        if any(step["name"] == name for step in self.steps):
+            raise ValueError(f"Step {name} already exists")
+
+        if isinstance(when, str):
+            when = [when]
+
+        self.steps.append(
+            {"type": step_type, "name": name, "when": when or [], **kwargs}
+        )
+        return self
+
+    def run(
+        self,
+        name: str,
+        command: str,
+        cwd: Optional[str] = None,
+        timeout: Optional[int] = None,
+        when=None,
+    ) -> "RemoteScript":
+        """
+        Run a bash command. Variables exported by
+        previous glob steps are available in its environment.
+        """
+        return self.__add("run", name, when, command=command, cwd=cwd, timeout=timeout)
+
+    def write(
+        self, name: str, path: str, content: Union[str, bytes], when=None
+    ) -> "RemoteScript":
+        """
+        Write the given content to a remote file
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        content = base64.b64encode(content).decode("ascii")
+        return self.__add("write", name, when, path=path, content=content)
+
+    def read(self, name: str, path: str, when=None) -> "RemoteScript":
+        """
+        Read the content of a remote file
+        """
+        return self.__add("read", name, when, path=path)
+
+    def glob(self, name: str, patterns: list, export=None, when=None) -> "RemoteScript":
+        """
+        List remote paths that match any of the patterns.
+        The step fails if there are no matches. The first match
+        is exported as the `export` variable for later run steps.
+        """
+        return self.__add("glob", name, when, patterns=list(patterns), export=export)
+
+    def compile(self) -> str:
+        """
+        Return the Python program that runs all the steps
+        """
+        steps = json.dumps(self.steps)
+        return f"{get_runner_source()}\n\nmain(json.loads({steps!r}))\n"
+
+    def execute(self, ssh: SSHExecutor, timeout: Optional[int] = None) -> dict:
+        """
+        Run all the steps with a single command in the remote host.
+
+        Args:
+            ssh (SSHExecutor): Session to the remote host.
+            timeout (int | None): Timeout in seconds for the whole script.
+
+        Returns:
+            dict: Result of each step by its name.
+
+        Raises:
+            RuntimeError: If the script did not produce a result,
+                e.g. Python is not available in the remote host.
+        """
+        stdout, stderr, exit_code = ssh.execute_command(
+            "python3 -S -", timeout=timeout, stdin=self.compile()
+        )
+        start = stdout.find(RESULT_START)
+        end = stdout.find(RESULT_END)
+        if start < 0 or end < start:
+            raise RuntimeError(
+                f"Remote script did not return a result, exit code {exit_code}: {stderr}"
+            )
+
+        lines = stdout[start:end].split("\n")[1:]
+        output = json.loads("".join(lines))
+        results = output["steps"]
+        for name, result in results.items():
+            if "content" in result:
+                result["content"] = zlib.decompress(base64.b64decode(result["content"]))
+
+            result.setdefault("error", "")
+            if not result["ok"] and not result.get("skipped"):
+                self.logger.warning("Remote step %s failed: %s", name, result["error"])
+
+        self.logger.info(
+            "Remote script with %s steps executed in %.2fs",
+            len(self.steps),
+            output["elapsed"],
+        )
+        return results
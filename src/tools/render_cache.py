@@ -0,0 +1,112 @@
+"""
+Module that keeps a size-bounded, in-memory cache of rendered
+fragments and cards. They only change when the gridpack is updated
+or the GridpackFiles repository changes, so they are keyed by both
+and rendered once until one of them changes.
+"""
+
+import json
+import hashlib
+import logging
+from threading import Lock
+from typing import NamedTuple, Optional
+from collections import OrderedDict
+from environment import RENDER_CACHE_SIZE_MB
+
+
+class RenderedArtifact(NamedTuple):
+    """
+    Rendered text and its entity tag
+    """
+
+    content: str
+    etag: str
+
+
+def get_revision(document: Optional[dict]) -> str:
+    """
+    Return a checksum of a database document. Unlike its last update
+    time, which has a resolution of a second, it changes on every update.
+    """
+    serialized = json.dumps(document, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def make_rendered_artifact(content: str) -> RenderedArtifact:
+    """
+    Return the rendered text with its entity tag
+    """
+    etag = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+    return RenderedArtifact(content, etag)
+
+
+class RenderCache:
+    """
+    Rendered artifacts by key. When the total length of their text goes
+    over `max_size` characters, the least recently used ones are removed.
+    """
+
+    def __init__(self, max_size):
+        self.logger = logging.getLogger()
+        self.max_size = max_size
+        self.lock = Lock()
+        # Key -> rendered artifact, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key) -> Optional[RenderedArtifact]:
+        """
+        Return the rendered artifact for the key,
+        None if it is not in the cache
+        """
+        with self.lock:
+            rendered = self.entries.get(key)
+            if rendered is None:
+                self.stats["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return rendered
+
+    def put(self, key, content: str) -> RenderedArtifact:
+        """
+        Store the rendered text for the key, evict the least recently
+        used artifacts if the cache is too big and return it
+        """
+        rendered = make_rendered_artifact(content)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.size -= len(previous.content)
+
+            self.entries[key] = rendered
+            self.size += len(content)
+            while self.size > self.max_size and self.entries:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.logger.debug("Evicting %s from the render cache", evicted_key)
+                self.size -= len(evicted.content)
+                self.stats["evictions"] += 1
+
+        return rendered
+
+    def clear(self) -> None:
+        """
+        Forget all rendered artifacts, e.g. after
+        repository files changed in place
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict:
+        """
+        Return the cache counters and size, for monitoring
+        """
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "size": self.size}
+
+
+# Rendered fragments and cards of gridpacks
+RENDER_CACHE = RenderCache(RENDER_CACHE_SIZE_MB * 1024**2)
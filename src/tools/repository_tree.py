@@ -0,0 +1,406 @@
+"""
+Module that keeps the campaigns, cards and tunes available in the
+GridpackFiles checkout. They are held by one immutable `RepositoryTree`.
+Changes build a new tree off to the side, sharing the parts that did
+not change, and swap it in with a single assignment, so readers never
+need a lock and never see a half-built tree.
+"""
+
+import os
+import json
+import time
+import logging
+from os import listdir
+from os.path import isdir
+from os.path import join as path_join
+from threading import RLock
+from typing import NamedTuple, Optional
+from environment import GRIDPACK_FILES_PATH
+from src.tools.metadata import (
+    FrozenDict,
+    FrozenList,
+    forget_metadata,
+    freeze,
+    get_head_commit,
+    load_json,
+    refresh_metadata_cache,
+)
+from src.tools.template import forget_templates
+from src.tools.utils import BRANCHES_CACHE, BRANCH_HEADS_CACHE, run_command
+
+IMPORTS_FILE = "Fragments/imports.json"
+
+
+class RepositoryTree(NamedTuple):
+    """
+    Campaigns (name -> generators and tune), cards (generator -> process
+    -> datasets) and tunes of a GridpackFiles commit, all read-only
+    """
+
+    commit: str
+    campaigns: dict
+    cards: dict
+    tunes: list
+
+
+REPOSITORY_TREE = RepositoryTree("", FrozenDict(), FrozenDict(), FrozenList())
+# Held while a new tree is built, readers do not need it
+REPOSITORY_TREE_LOCK = RLock()
+
+
+def get_repository_tree() -> RepositoryTree:
+    """
+    Return the current repository tree, it never changes
+    """
+    return REPOSITORY_TREE
+
+
+def swap_repository_tree(tree: RepositoryTree) -> None:
+    """
+    Make the given tree the current one
+    """
+    global REPOSITORY_TREE  # pylint: disable=global-statement
+    REPOSITORY_TREE = tree
+
+
+def list_directories(path: str) -> list:
+    """
+    Return the names of the folders in a folder
+    """
+    return [d for d in listdir(path) if isdir(path_join(path, d))]
+
+
+def scan_campaign(campaigns_dir: str, name: str) -> dict:
+    """
+    Return the generators and the tune of a campaign
+    """
+    campaign_path = os.path.join(campaigns_dir, name)
+    campaign_dict = load_json(path_join(campaign_path, f"{name}.json"))
+    return freeze(
+        {
+            "generators": list_directories(campaign_path),
+            "tune": campaign_dict.get("tune", ""),
+        }
+    )
+
+
+def scan_campaigns() -> FrozenDict:
+    """
+    Return the generators and the tune of every campaign
+    """
+    campaigns_dir = os.path.join(GRIDPACK_FILES_PATH, "Campaigns")
+    return FrozenDict(
+        (name, scan_campaign(campaigns_dir, name))
+        for name in list_directories(campaigns_dir)
+    )
+
+
+def scan_cards() -> FrozenDict:
+    """
+    Return the processes of every generator and the datasets of every process
+    """
+    cards = {}
+    cards_dir = os.path.join(GRIDPACK_FILES_PATH, "Cards")
+    for generator in list_directories(cards_dir):
+        generator_path = os.path.join(cards_dir, generator)
+        for process in list_directories(generator_path):
+            process_path = os.path.join(generator_path, process)
+            datasets = list_directories(process_path)
+            cards.setdefault(generator, {})[process] = datasets
+
+    return freeze(cards)
+
+
+def scan_tunes() -> FrozenList:
+    """
+    Return the tunes in the fragment imports
+    """
+    imports_path = os.path.join(GRIDPACK_FILES_PATH, IMPORTS_FILE)
+    if not os.path.isfile(imports_path):
+        return FrozenList()
+
+    with open(imports_path, encoding="utf-8") as imports_file:
+        imports = json.load(imports_file)
+
+    return FrozenList(sorted(list(set(imports.get("tune", [])))))
+
+
+def scan_repository_tree(commit: str) -> RepositoryTree:
+    """
+    Return a new tree with everything in the checkout
+    """
+    return RepositoryTree(commit, scan_campaigns(), scan_cards(), scan_tunes())
+
+
+def update_campaigns(campaigns: FrozenDict, changes) -> FrozenDict:
+    """
+    Return the campaigns with the ones that have changed files
+    scanned again. Unchanged campaigns are shared.
+    """
+    campaigns_dir = os.path.join(GRIDPACK_FILES_PATH, "Campaigns")
+    names = {
+        p.split("/")[1]
+        for p in changes
+        if p.count("/") >= 2 and p.startswith("Campaigns/")
+    }
+    if not names:
+        return campaigns
+
+    updated = dict(campaigns)
+    for name in names:
+        if isdir(path_join(campaigns_dir, name)):
+            updated[name] = scan_campaign(campaigns_dir, name)
+        else:
+            updated.pop(name, None)
+
+    return FrozenDict(updated)
+
+
+def update_cards(cards: FrozenDict, changes) -> FrozenDict:
+    """
+    Return the cards with the generators, processes and datasets whose
+    folders have changed files added or removed. Unchanged generators
+    are shared.
+    """
+    cards_dir = os.path.join(GRIDPACK_FILES_PATH, "Cards")
+    # Folders of the changed files: (generator, process, dataset), shortest first
+    folders = set()
+    for path in changes:
+        parts = path.split("/")
+        if parts[0] != "Cards":
+            continue
+
+        for depth in range(1, min(len(parts) - 1, 4)):
+            folders.add(tuple(parts[1 : depth + 1]))
+
+    if not folders:
+        return cards
+
+    updated = dict(cards)
+    copied = set()
+    for folder in sorted(folders, key=len):
+        generator = folder[0]
+        exists = isdir(path_join(cards_dir, *folder))
+        if len(folder) == 1:
+            if not exists:
+                updated.pop(generator, None)
+            continue
+
+        if generator not in updated:
+            # Folders of removed generators are not checked again
+            if not exists:
+                continue
+
+            updated[generator] = {}
+
+        if generator not in copied:
+            updated[generator] = dict(updated[generator])
+            copied.add(generator)
+
+        processes = updated[generator]
+        process = folder[1]
+        if len(folder) == 2:
+            if not exists:
+                processes.pop(process, None)
+            elif process not in processes:
+                processes[process] = []
+            continue
+
+        if process not in processes:
+            continue
+
+        dataset = folder[2]
+        datasets = processes[process]
+        if exists and dataset not in datasets:
+            processes[process] = datasets + [dataset]
+        elif not exists and dataset in datasets:
+            processes[process] = [d for d in datasets if d != dataset]
+
+    # Like in a full scan, generators without processes are not listed
+    for generator in copied:
+        if updated[generator]:
+            updated[generator] = freeze(updated[generator])
+        else:
+            del updated[generator]
+
+    return FrozenDict(updated)
+
+
+def update_repository_tree(tree: RepositoryTree, commit: str, changes):
+    """
+    Return a new tree with the changed paths, relative
+    to the checkout, applied to the given one
+    """
+    return RepositoryTree(
+        commit,
+        update_campaigns(tree.campaigns, changes),
+        update_cards(tree.cards, changes),
+        scan_tunes() if IMPORTS_FILE in changes else tree.tunes,
+    )
+
+
+def get_changed_paths(path: str, old_commit: str, new_commit: str) -> Optional[list]:
+    """
+    Return the files added, modified or removed in a repository between
+    two commits. None if the new commit does not descend from the old one,
+    e.g. after a force push, or the difference can not be computed.
+    """
+    stdout, _, code = run_command(
+        [
+            f"cd {path}",
+            f"git merge-base --is-ancestor {old_commit} {new_commit} && "
+            f"git diff -z --name-status --no-renames {old_commit} {new_commit}",
+        ]
+    )
+    if code != 0:
+        return None
+
+    # Status and path separated by NUL
+    fields = stdout.split("\0")
+    return [p for p in fields[1::2] if p]
+
+
+def refresh_repository_tree() -> RepositoryTree:
+    """
+    Bring the repository tree up to date with the GridpackFiles checkout
+    and return it. Only the folders touched by the commits since the last
+    refresh are checked again, the whole tree is scanned the first time,
+    after a force push or if the checkout is not a git repository.
+    """
+    logger = logging.getLogger()
+    with REPOSITORY_TREE_LOCK:
+        tree = REPOSITORY_TREE
+        commit = get_head_commit(GRIDPACK_FILES_PATH)
+        changes = None
+        if commit and tree.commit and tree.campaigns and tree.cards:
+            if commit == tree.commit:
+                return tree
+
+            changes = get_changed_paths(GRIDPACK_FILES_PATH, tree.commit, commit)
+
+        if changes is None:
+            logger.info("Scanning the whole repository tree at %s", commit)
+            tree = scan_repository_tree(commit)
+        else:
+            logger.info(
+                "Updating repository tree %s..%s, %s changes",
+                tree.commit,
+                commit,
+                len(changes),
+            )
+            tree = update_repository_tree(tree, commit, changes)
+
+        swap_repository_tree(tree)
+        return tree
+
+
+def apply_file_changes(changes: Optional[set]) -> RepositoryTree:
+    """
+    Update the repository tree and the parsed files after files of the
+    checkout changed, e.g. edited in place, and return the tree. Paths are
+    relative to the checkout and folders end with "/". None means any file
+    may have changed.
+    """
+    logger = logging.getLogger()
+    with REPOSITORY_TREE_LOCK:
+        tree = REPOSITORY_TREE
+        if changes is None:
+            logger.info("Files changed in %s, scanning everything", GRIDPACK_FILES_PATH)
+            refresh_metadata_cache()
+            forget_templates()
+            tree = scan_repository_tree(tree.commit)
+        else:
+            logger.info("Files changed in %s: %s", GRIDPACK_FILES_PATH, len(changes))
+            paths = [path_join(GRIDPACK_FILES_PATH, p) for p in changes]
+            forget_metadata(paths)
+            forget_templates(paths)
+            tree = update_repository_tree(tree, tree.commit, changes)
+
+        swap_repository_tree(tree)
+        return tree
+
+
+def get_available_campaigns():
+    """
+    Get campaigns and campaign templates
+    """
+    tree = REPOSITORY_TREE
+    if not tree.campaigns:
+        tree = refresh_repository_tree()
+
+    return tree.campaigns
+
+
+def get_available_cards():
+    """
+    Get generators, processes and datasets
+    """
+    tree = REPOSITORY_TREE
+    if not tree.cards:
+        tree = refresh_repository_tree()
+
+    return tree.cards
+
+
+def get_available_tunes():
+    """
+    Get list of available tunes
+    """
+    return REPOSITORY_TREE.tunes
+
+
+def save_repository_snapshot(path: str) -> None:
+    """
+    Write the repository tree and the branches caches to a file,
+    with the GridpackFiles commit they were built from
+    """
+    tree = REPOSITORY_TREE
+    snapshot = {
+        "commit": tree.commit,
+        "created": int(time.time()),
+        "campaigns": tree.campaigns,
+        "cards": tree.cards,
+        "tunes": tree.tunes,
+        "branches": BRANCHES_CACHE,
+        "branch_heads": BRANCH_HEADS_CACHE,
+    }
+    # Written next to the file and renamed, readers never see a partial file
+    partial_path = f"{path}.part"
+    with open(partial_path, "w", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+
+    os.replace(partial_path, path)
+
+
+def load_repository_snapshot(path: str) -> Optional[dict]:
+    """
+    Make the repository tree and fill the branches caches from a
+    file written by `save_repository_snapshot`.
+    Return the snapshot, None if it does not exist or can not be read.
+    """
+    logger = logging.getLogger()
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+
+        tree = RepositoryTree(
+            snapshot.get("commit", ""),
+            freeze(snapshot["campaigns"]),
+            freeze(snapshot["cards"]),
+            freeze(snapshot["tunes"]),
+        )
+        branches = snapshot["branches"]
+        branch_heads = snapshot["branch_heads"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        logger.warning("Could not read repository snapshot %s: %s", path, error)
+        return None
+
+    with REPOSITORY_TREE_LOCK:
+        swap_repository_tree(tree)
+
+    BRANCHES_CACHE.update(branches)
+    BRANCH_HEADS_CACHE.update(branch_heads)
+    logger.info("Loaded repository snapshot of %s from %s", tree.commit, path)
+    return snapshot
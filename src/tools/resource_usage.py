@@ -0,0 +1,188 @@
+"""
+Module that reads the resource usage of gridpack jobs from the
+HTCondor user log (job.log) and recommends the cores, memory and
+job flavour to request for new jobs based on previous ones.
+"""
+
+import re
+import math
+import datetime
+from typing import Optional
+
+EVENT = re.compile(r"^(\d{3}) \(\d+\.\d+\.\d+\) (\S+) (\S+) ")
+RETURN_VALUE = re.compile(r"\(return value (\d+)\)")
+TOTAL_REMOTE_USAGE = re.compile(
+    r"Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+Total Remote Usage"
+)
+PARTITIONABLE_RESOURCE = re.compile(
+    r"^\s*(Cpus|Disk \(KB\)|Memory \(MB\))\s*:\s*([\d.]*)\s+(\d+)\s+(\d+)"
+)
+IMAGE_SIZE_MEMORY = re.compile(r"^\s*(\d+)\s+-\s+MemoryUsage of job \(MB\)")
+# Hold and removal reasons of jobs that ran longer than their flavour allows
+RUNTIME_EXCEEDED = re.compile(
+    r"exceeded (allowed|maximum) (execute|job|run) ?(duration|time)|MaxRuntime|MaxWallTime",
+    re.IGNORECASE,
+)
+RESOURCE_KEYS = {"Cpus": "cpus", "Disk (KB)": "disk_kb", "Memory (MB)": "memory_mb"}
+# Extra memory on top of the highest usage seen
+MEMORY_HEADROOM = 1.25
+# Samples needed to use each level of the recommendation
+MINIMUM_SAMPLES = {"dataset": 1, "process": 3, "generator": 5}
+# HTCondor job flavours at CERN and their maximum runtime (s), shortest first.
+# Jobs with shorter flavours are matched to slots sooner.
+JOB_FLAVOURS = (
+    ("espresso", 20 * 60),
+    ("microcentury", 60 * 60),
+    ("longlunch", 2 * 60 * 60),
+    ("workday", 8 * 60 * 60),
+    ("tomorrow", 24 * 60 * 60),
+    ("testmatch", 3 * 24 * 60 * 60),
+    ("nextweek", 7 * 24 * 60 * 60),
+)
+
+
+def parse_event_time(date, time) -> Optional[datetime.datetime]:
+    """
+    Return the time of a log event, newer logs have
+    ISO dates and older ones only month and day
+    """
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%m/%d %H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(f"{date} {time}", date_format)
+        except ValueError:
+            pass
+
+    return None
+
+
+def parse_job_log(content: str) -> dict:
+    """
+    Return the resource usage of the job in a HTCondor user log.
+
+    Returns:
+        dict: Usage and request of cpus, memory (MB) and disk (KB),
+            CPU and wall time (s), number of executions and exit code.
+            Empty if the job did not terminate.
+    """
+    usage = {"executions": 0}
+    execute_time = None
+    peak_memory = 0
+    terminated = False
+    for line in content.splitlines():
+        event = EVENT.match(line)
+        if event:
+            code, event_time = event.group(1), parse_event_time(*event.group(2, 3))
+            if code == "001":
+                usage["executions"] += 1
+                execute_time = event_time
+            elif code == "005":
+                terminated = True
+                if execute_time and event_time:
+                    wall_time = (event_time - execute_time).total_seconds()
+                    usage["wall_time"] = max(0, int(wall_time))
+
+            continue
+
+        memory = IMAGE_SIZE_MEMORY.match(line)
+        if memory:
+            peak_memory = max(peak_memory, int(memory.group(1)))
+            continue
+
+        if not terminated:
+            continue
+
+        return_value = RETURN_VALUE.search(line)
+        if return_value:
+            usage["exit_code"] = int(return_value.group(1))
+            continue
+
+        cpu_time = TOTAL_REMOTE_USAGE.search(line)
+        if cpu_time:
+            values = [int(value) for value in cpu_time.groups()]
+            user = values[0] * 86400 + values[1] * 3600 + values[2] * 60 + values[3]
+            system = values[4] * 86400 + values[5] * 3600 + values[6] * 60 + values[7]
+            usage["cpu_time"] = user + system
+            continue
+
+        resource = PARTITIONABLE_RESOURCE.match(line)
+        if resource:
+            key = RESOURCE_KEYS[resource.group(1)]
+            used = float(resource.group(2) or 0)
+            usage[key] = used if key == "cpus" else int(used)
+            usage[f"{key}_request"] = int(resource.group(3))
+
+    if not terminated:
+        return {}
+
+    usage["exit_code"] = usage.get("exit_code")
+    usage["memory_mb"] = max(usage.get("memory_mb", 0), peak_memory)
+    return usage
+
+
+def aggregate(samples: list) -> dict:
+    """
+    Return the number of samples and the mean and maximum
+    of each usage value over the samples
+    """
+    result = {"samples": len(samples)}
+    for key in ("cpus", "memory_mb", "disk_kb", "cpu_time", "wall_time"):
+        values = [s[key] for s in samples if s.get(key) is not None]
+        if values:
+            result[key] = {"mean": sum(values) / len(values), "max": max(values)}
+
+    return result
+
+
+def recommend(samples: list, cores_options: list, memory_options: list) -> dict:
+    """
+    Return the smallest cores and memory options that fit the
+    highest usage of the samples, with headroom for memory
+    """
+    cpus = max((s.get("cpus", 0) for s in samples), default=0)
+    memory = max((s.get("memory_mb", 0) for s in samples), default=0)
+    cores = next((c for c in cores_options if c >= math.ceil(cpus)), cores_options[-1])
+    # Jobs are validated to have at least 1 GB per core
+    memory = max(memory * MEMORY_HEADROOM, cores * 1000)
+    memory = next((m for m in memory_options if m >= memory), memory_options[-1])
+    return {"job_cores": cores, "job_memory": memory}
+
+
+def exceeded_runtime(content: str) -> bool:
+    """
+    Return whether the job in a HTCondor user log was held or
+    removed because it ran longer than its flavour allows
+    """
+    return bool(RUNTIME_EXCEEDED.search(content))
+
+
+def get_next_flavour(flavour: str) -> Optional[str]:
+    """
+    Return the flavour that follows the given one,
+    None if it is the longest one or unknown
+    """
+    names = [name for name, _ in JOB_FLAVOURS]
+    if flavour not in names or flavour == names[-1]:
+        return None
+
+    return names[names.index(flavour) + 1]
+
+
+def predict_flavour(samples: list, cores: int, margin: float) -> Optional[str]:
+    """
+    Return the shortest flavour whose maximum runtime fits the longest
+    wall time of the samples times the margin. Wall times of jobs that
+    requested more cores are scaled up as if they ran with `cores`.
+    None if no sample has a wall time.
+    """
+    runtimes = [
+        s["wall_time"] * max(1, s.get("cpus_request", cores) / max(cores, 1))
+        for s in samples
+        if s.get("wall_time") is not None
+    ]
+    if not runtimes:
+        return None
+
+    runtime = max(runtimes) * margin
+    return next(
+        (n for n, limit in JOB_FLAVOURS if limit >= runtime), JOB_FLAVOURS[-1][0]
+    )
@@ -4,12 +4,247 @@ and operations related to HTCondor involving the execution of remote
 commands over SSH.
 """
 
+import os
 import time
+import errno
+import uuid
+import socket
+import random
+import hashlib
 import logging
 from io import BytesIO
+from threading import Lock
+from typing import Optional
 import paramiko
 import paramiko.ssh_gss
-from environment import USE_HTCONDOR_CMS_CAF
+from environment import (
+    USE_HTCONDOR_CMS_CAF,
+    REMOTE_CACHE_DIRECTORY,
+    SSH_CONNECT_TIMEOUT,
+    SSH_COMMAND_TIMEOUT,
+)
+
+# Errors that signal a problem with the connection to the host
+# instead of an error in the command executed remotely.
+CONNECTION_ERRORS = (paramiko.SSHException, socket.timeout, OSError, EOFError)
+# Errors during a file transfer that are not related to the file itself
+TRANSFER_ERRORS = (paramiko.SSHException, socket.timeout, EOFError)
+
+
+class HostUnavailableError(Exception):
+    """
+    Raised when an operation is not attempted because
+    the circuit breaker for the remote host is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a remote host.
+    After `failure_threshold` consecutive connection failures the circuit opens
+    and every operation fails fast for `reset_timeout` seconds. Afterwards, a
+    single trial operation is allowed (half-open): if it succeeds the circuit
+    closes, otherwise it opens again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    # Circuit breaker for each host, shared by all the executors
+    BREAKERS = {}
+    BREAKERS_LOCK = Lock()
+
+    def __init__(self, host, failure_threshold=3, reset_timeout=300):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.last_error = ""
+        self.lock = Lock()
+
+    @classmethod
+    def for_host(cls, host) -> "CircuitBreaker":
+        """
+        Return the circuit breaker for the given host
+        """
+        with cls.BREAKERS_LOCK:
+            if host not in cls.BREAKERS:
+                cls.BREAKERS[host] = cls(host)
+
+            return cls.BREAKERS[host]
+
+    @classmethod
+    def get_states(cls) -> dict:
+        """
+        Return the state of all circuit breakers, for monitoring
+        """
+        with cls.BREAKERS_LOCK:
+            breakers = list(cls.BREAKERS.values())
+
+        return {breaker.host: breaker.get_state() for breaker in breakers}
+
+    def __retry_time_reached(self) -> bool:
+        return time.time() - self.opened_at >= self.reset_timeout
+
+    def is_available(self) -> bool:
+        """
+        Check, without changing the state, if an operation
+        would be allowed for this host
+        """
+        with self.lock:
+            return self.state != self.OPEN or self.__retry_time_reached()
+
+    def allow_request(self) -> bool:
+        """
+        Check if an operation can be attempted.
+        An open circuit becomes half-open once `reset_timeout` passed
+        and only lets a single trial operation through.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and self.__retry_time_reached():
+                self.state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def record_success(self) -> None:
+        """
+        Close the circuit after a successful operation
+        """
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self, error) -> None:
+        """
+        Count a failed operation and open the circuit if
+        the threshold is reached or if the trial operation failed
+        """
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                logging.getLogger().error(
+                    "Circuit for %s is open after %s failures: %s",
+                    self.host,
+                    self.failures,
+                    error,
+                )
+
+    def get_state(self) -> dict:
+        """
+        Return the current state of the circuit
+        """
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened_at": int(self.opened_at),
+                "last_error": self.last_error,
+            }
+
+
+class HostPool:
+    """
+    Group of equivalent remote hosts.
+    Operations are sent to the available host with the lowest recent
+    latency. Operations that must run in the same host, e.g. the ones
+    that talk to the HTCondor scheduler that holds a job, can request
+    a preferred host and only fail over if it becomes unavailable.
+    """
+
+    # Exponentially weighted moving average of the latency (in seconds)
+    # for opening a session in each host
+    LATENCY = {}
+    LATENCY_LOCK = Lock()
+    LATENCY_WEIGHT = 0.3
+
+    def __init__(self, hosts):
+        if not hosts:
+            raise ValueError("Please provide at least one host")
+
+        self.logger = logging.getLogger()
+        self.hosts = list(hosts)
+
+    @classmethod
+    def record_latency(cls, host, seconds) -> None:
+        """
+        Update the latency average for a host
+        """
+        with cls.LATENCY_LOCK:
+            previous = cls.LATENCY.get(host)
+            if previous is None:
+                cls.LATENCY[host] = seconds
+            else:
+                weight = cls.LATENCY_WEIGHT
+                cls.LATENCY[host] = weight * seconds + (1 - weight) * previous
+
+    @classmethod
+    def get_latency(cls, host) -> float:
+        """
+        Return the latency average for a host, hosts
+        without measurements are considered the fastest
+        """
+        with cls.LATENCY_LOCK:
+            return cls.LATENCY.get(host, 0.0)
+
+    def is_available(self) -> bool:
+        """
+        Check if there is at least one available host
+        """
+        return any(CircuitBreaker.for_host(h).is_available() for h in self.hosts)
+
+    def choose(self, preferred=None) -> str:
+        """
+        Pick a host for an operation.
+
+        Args:
+            preferred (str | None): Host to use if it is available,
+                for example, the host that submitted a job.
+
+        Returns:
+            str: Chosen host.
+
+        Raises:
+            HostUnavailableError: If none of the hosts is available.
+        """
+        if preferred and CircuitBreaker.for_host(preferred).is_available():
+            return preferred
+
+        available = [h for h in self.hosts if CircuitBreaker.for_host(h).is_available()]
+        if not available:
+            raise HostUnavailableError(f"None of the hosts is available: {self.hosts}")
+
+        # Random tie-breaker spreads the load among hosts with similar latency
+        host = min(
+            available, key=lambda h: (round(self.get_latency(h), 1), random.random())
+        )
+        if preferred:
+            self.logger.warning(
+                "Host %s is unavailable, failing over to %s", preferred, host
+            )
+
+        return host
+
+    def get_states(self) -> dict:
+        """
+        Return the circuit breaker state and latency of each host, for monitoring
+        """
+        states = {}
+        for host in self.hosts:
+            state = CircuitBreaker.for_host(host).get_state()
+            state["latency"] = round(self.get_latency(host), 3)
+            states[host] = state
+
+        return states
 
 
 class SSHExecutor:
@@ -17,15 +252,33 @@ class SSHExecutor:
     SSH executor allows to perform remote commands and upload/download files
     """
 
+    # Counters for the content-addressed uploads.
+    # They are shared by all the executors in this process.
+    UPLOAD_STATS = {
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "uploaded_bytes": 0,
+        "saved_bytes": 0,
+    }
+    UPLOAD_STATS_LOCK = Lock()
+
     def __init__(self, host, username, password):
         self.ssh_client = None
         self.ftp_client = None
         self.logger = logging.getLogger()
         self.remote_host = host
+        # Hosts can include the port as <host>:<port>
+        self.hostname, _, port = host.partition(":")
+        self.port = int(port or 22)
         self.username = username
         self.password = password
-        self.timeout = 3600
+        self.connect_timeout = SSH_CONNECT_TIMEOUT
+        self.timeout = SSH_COMMAND_TIMEOUT
         self.max_retries = 3
+        self.backoff_base = 2
+        self.backoff_cap = 60
+        self.breaker = CircuitBreaker.for_host(host)
+        self.cache_directory = REMOTE_CACHE_DIRECTORY
 
     def __enter__(self):
         return self
@@ -56,26 +309,58 @@ class SSHExecutor:
         if self.ssh_client:
             self.close_connections()
 
+        if not self.breaker.allow_request():
+            raise HostUnavailableError(
+                f"Host {self.remote_host} is unavailable: {self.breaker.last_error}"
+            )
+
         self.ssh_client = paramiko.SSHClient()
         self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        timeouts = {
+            "timeout": self.connect_timeout,
+            "banner_timeout": self.connect_timeout,
+            "auth_timeout": self.connect_timeout,
+        }
 
         use_gss_api = self.__use_gss_api()
-        if use_gss_api:
-            self.logger.info("Using Kerberos ticket for authentication")
-            self.ssh_client.connect(
-                self.remote_host,
-                username=self.username,
-                timeout=30,
-                gss_auth=use_gss_api,
-            )
-        else:
-            self.ssh_client.connect(
-                self.remote_host,
-                username=self.username,
-                password=self.password,
-                timeout=30,
+        start_time = time.time()
+        # The result is always recorded, so a failed trial
+        # never leaves the circuit half-open
+        error = None
+        try:
+            if use_gss_api:
+                self.logger.info("Using Kerberos ticket for authentication")
+                self.ssh_client.connect(
+                    self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    gss_auth=use_gss_api,
+                    **timeouts,
+                )
+            else:
+                self.ssh_client.connect(
+                    self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    **timeouts,
+                )
+
+            # Commands and their replies are small packets, do not delay them
+            self.ssh_client.get_transport().sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
             )
+        except BaseException as ex:
+            error = ex
+            self.ssh_client = None
+            raise
+        finally:
+            if error is None:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure(error)
 
+        HostPool.record_latency(self.remote_host, time.time() - start_time)
         self.logger.debug("Done setting up ssh")
 
     def setup_ftp(self):
@@ -91,35 +376,103 @@ class SSHExecutor:
             self.setup_ssh()
 
         self.ftp_client = self.ssh_client.open_sftp()
+        self.ftp_client.get_channel().settimeout(self.timeout)
         self.logger.debug("Done setting up ftp")
 
-    def execute_command(self, command):
+    def __record_transfer_error(self, error) -> None:
+        """
+        Count failed transfers caused by the connection
+        in the circuit breaker for the host
+        """
+        if isinstance(error, TRANSFER_ERRORS):
+            self.breaker.record_failure(error)
+
+    def backoff(self, attempt):
+        """
+        Sleep before the given retry attempt using exponential
+        backoff with full jitter
+        """
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base**attempt))
+        self.logger.debug("Will sleep %.2fs before retry number %s", delay, attempt)
+        time.sleep(delay)
+
+    def open_session(self, timeout):
+        """
+        Open a channel to execute a command, connecting first if needed.
+        Nothing is executed yet, so failures can be retried.
+        """
+        if not self.ssh_client:
+            self.setup_ssh()
+
+        try:
+            channel = self.ssh_client.get_transport().open_session(
+                timeout=self.connect_timeout
+            )
+        except CONNECTION_ERRORS as ex:
+            # Failures to connect are already counted by setup_ssh
+            self.breaker.record_failure(ex)
+            raise
+
+        channel.settimeout(timeout)
+        return channel
+
+    def execute_command(self, command, timeout=None, stdin=None):
         """
         Execute command over SSH
+        `timeout` overrides the default timeout in seconds for this command
+        `stdin` is sent as the standard input of the command
+        Only connecting and opening the channel are retried. Errors after the
+        command was sent are raised, as the command may have run already.
         """
         start_time = time.time()
         if isinstance(command, list):
             command = "; ".join(command)
 
+        timeout = timeout or self.timeout
         self.logger.debug("Executing %s", command)
         retries = 0
         while retries <= self.max_retries:
-            if not self.ssh_client:
-                self.setup_ssh()
-
-            (_, stdout, stderr) = self.ssh_client.exec_command(
-                command, timeout=self.timeout
-            )
-            self.logger.debug("Executed %s. Reading response", command)
-            stdout_list = []
-            stderr_list = []
-            for line in stdout.readlines():
-                stdout_list.append(line[0:256])
+            try:
+                channel = self.open_session(timeout)
+            except CONNECTION_ERRORS as ex:
+                self.close_connections()
+                retries += 1
+                if retries > self.max_retries:
+                    raise
 
-            for line in stderr.readlines():
-                stderr_list.append(line[0:256])
+                self.logger.warning(
+                    "SSH connection failed (%s), will do a retry number %s",
+                    ex,
+                    retries,
+                )
+                self.backoff(retries)
+                continue
+
+            try:
+                channel.exec_command(command)
+                if stdin is not None:
+                    stdin_stream = channel.makefile_stdin("wb")
+                    stdin_stream.write(stdin)
+                    channel.shutdown_write()
+
+                self.logger.debug("Executed %s. Reading response", command)
+                stdout = channel.makefile("r")
+                stderr = channel.makefile_stderr("r")
+                stdout_list = []
+                stderr_list = []
+                for line in stdout.readlines():
+                    stdout_list.append(line[0:256])
+
+                for line in stderr.readlines():
+                    stderr_list.append(line[0:256])
+
+                exit_code = channel.recv_exit_status()
+            except CONNECTION_ERRORS as ex:
+                self.breaker.record_failure(ex)
+                self.close_connections()
+                raise
 
-            exit_code = stdout.channel.recv_exit_status()
+            self.breaker.record_success()
             stdout = "".join(stdout_list).strip()
             stderr = "".join(stderr_list).strip()
             # Retry if AFS error occured
@@ -129,7 +482,7 @@ class SSHExecutor:
                     "SSH execution failed, will do a retry number %s", retries
                 )
                 self.close_connections()
-                time.sleep(3)
+                self.backoff(retries)
             else:
                 break
 
@@ -163,6 +516,7 @@ class SSHExecutor:
             self.logger.debug("Uploaded string to %s", copy_to)
         except Exception as ex:
             self.logger.error("Error uploading file to %s. %s", copy_to, ex)
+            self.__record_transfer_error(ex)
             return False
 
         return True
@@ -182,10 +536,155 @@ class SSHExecutor:
             self.logger.error(
                 "Error uploading file from %s to %s. %s", copy_from, copy_to, ex
             )
+            self.__record_transfer_error(ex)
             return False
 
         return True
 
+    @staticmethod
+    def file_checksum(path) -> str:
+        """
+        Compute the SHA-256 checksum for a local file.
+
+        Args:
+            path (str): Path to the local file.
+
+        Returns:
+            str: Hexadecimal digest of the file content.
+        """
+        checksum = hashlib.sha256()
+        with open(path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
+                checksum.update(chunk)
+
+        return checksum.hexdigest()
+
+    @classmethod
+    def get_upload_stats(cls) -> dict:
+        """
+        Return a copy of the content-addressed upload counters
+        """
+        with cls.UPLOAD_STATS_LOCK:
+            return dict(cls.UPLOAD_STATS)
+
+    @classmethod
+    def __record_upload(cls, hit: bool, size: int) -> None:
+        """
+        Update the content-addressed upload counters
+        """
+        with cls.UPLOAD_STATS_LOCK:
+            if hit:
+                cls.UPLOAD_STATS["cache_hits"] += 1
+                cls.UPLOAD_STATS["saved_bytes"] += size
+            else:
+                cls.UPLOAD_STATS["cache_misses"] += 1
+                cls.UPLOAD_STATS["uploaded_bytes"] += size
+
+    def upload_to_cache(self, copy_from) -> Optional[str]:
+        """
+        Upload a file into the remote content-addressed cache.
+        Bytes are only transferred if there is no file in the cache
+        with the same checksum.
+
+        Args:
+            copy_from (str | bytes): Path to the local file or
+                the content to upload, which is sent from memory.
+
+        Returns:
+            str | None: Remote path of the cached file or None
+                if it was not possible to upload it.
+        """
+        if isinstance(copy_from, bytes):
+            checksum = hashlib.sha256(copy_from).hexdigest()
+            size = len(copy_from)
+        else:
+            checksum = self.file_checksum(copy_from)
+            size = os.path.getsize(copy_from)
+
+        cache_folder = f"{self.cache_directory}/{checksum[:2]}"
+        cached_path = f"{cache_folder}/{checksum}"
+        if not self.ftp_client:
+            self.setup_ftp()
+
+        try:
+            self.ftp_client.stat(cached_path)
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        else:
+            # Refresh the access time, so it is not pruned while it is used
+            self.ftp_client.utime(cached_path, None)
+            self.logger.debug("Found %s in the remote cache", cached_path)
+            self.__record_upload(hit=True, size=size)
+            return cached_path
+
+        self.logger.debug("Will upload %s bytes to %s", size, cached_path)
+        _, _, exit_code = self.execute_command(f"mkdir -p {cache_folder}")
+        if exit_code != 0:
+            return None
+
+        # Upload to a temporary name, so other processes never
+        # see a partial file under the checksum name
+        partial_path = f"{cached_path}.{uuid.uuid4().hex}.part"
+        try:
+            if isinstance(copy_from, bytes):
+                self.ftp_client.putfo(BytesIO(copy_from), partial_path)
+            else:
+                self.ftp_client.put(copy_from, partial_path)
+
+            self.ftp_client.posix_rename(partial_path, cached_path)
+        except Exception as ex:
+            self.logger.error(
+                "Error uploading %s bytes to the remote cache. %s", size, ex
+            )
+            self.__record_transfer_error(ex)
+            return None
+
+        self.__record_upload(hit=False, size=size)
+        return cached_path
+
+    def upload_file_cached(self, copy_from, copy_to):
+        """
+        Upload a file using the remote content-addressed cache.
+        If the file is already cached, it is linked or copied into
+        place remotely without transferring its content again.
+        """
+        self.logger.debug(
+            "Will upload file %s to %s using the cache", copy_from, copy_to
+        )
+        cached_path = self.upload_to_cache(copy_from)
+        if not cached_path:
+            self.logger.warning("Remote cache unavailable, uploading %s", copy_from)
+            return self.upload_file(copy_from, copy_to)
+
+        _, _, exit_code = self.execute_command(
+            self.cache_link_command(cached_path, copy_to)
+        )
+        return exit_code == 0
+
+    @staticmethod
+    def cache_link_command(cached_path, copy_to) -> str:
+        """
+        Command that puts a file from the remote cache in place,
+        hard links are used when the filesystem allows it
+        """
+        return f"ln -f {cached_path} {copy_to} 2>/dev/null || cp -f {cached_path} {copy_to}"
+
+    def prune_cache(self, max_age_days=30):
+        """
+        Remove files from the remote content-addressed cache
+        that were not used in the last `max_age_days` days.
+        Files are touched every time they are used.
+        """
+        self.logger.info(
+            "Pruning remote cache %s, max age %s days",
+            self.cache_directory,
+            max_age_days,
+        )
+        return self.execute_command(
+            f"find {self.cache_directory} -type f -atime +{max_age_days} -delete"
+        )
+
     def download_as_string(self, copy_from):
         """
         Download remote file contents as string
@@ -202,6 +701,7 @@ class SSHExecutor:
             return contents.decode("utf-8")
         except Exception as ex:
             self.logger.error("Error downloading file from %s. %s", copy_from, ex)
+            self.__record_transfer_error(ex)
         finally:
             if remote_file:
                 remote_file.close()
@@ -223,6 +723,7 @@ class SSHExecutor:
             self.logger.error(
                 "Error downloading file from %s to %s. %s", copy_from, copy_to, ex
             )
+            self.__record_transfer_error(ex)
             return False
 
         return True
@@ -282,12 +783,14 @@ class HTCondorExecutor(SSHExecutor):
 
         return HTCondorExecutor.LXBATCH_PRIORITY_GROUP
 
-    def execute_command(self, command):
+    def execute_command(self, command, timeout=None, stdin=None):
         """
         Execute command over SSH related to HTCondor operations
 
         Args:
             command (str | list[str]): Command(s) to execute
+            timeout (int | None): Timeout in seconds for this command
+            stdin (str | None): Standard input for the command
         """
         enable_env: str = self.__set_env()
         command_and_env = ""
@@ -300,13 +803,19 @@ class HTCondorExecutor(SSHExecutor):
             raise ValueError(msg)
 
         if not enable_env:
-            return super().execute_command(command=command)
+            return super().execute_command(
+                command=command, timeout=timeout, stdin=stdin
+            )
 
         if isinstance(command, list):
             command_and_env = command.copy()
             command_and_env.insert(0, enable_env)
-            return super().execute_command(command=command_and_env)
+            return super().execute_command(
+                command=command_and_env, timeout=timeout, stdin=stdin
+            )
 
         # Complete the string command
         command_and_env = "; ".join([enable_env, command])
-        return super().execute_command(command=command_and_env)
+        return super().execute_command(
+            command=command_and_env, timeout=timeout, stdin=stdin
+        )
@@ -0,0 +1,102 @@
+"""
+Module that renders `$variable` placeholders in cards and fragments.
+Templates are tokenized once and rendered in a single pass,
+compiled templates are cached by path and modification time.
+"""
+
+import os
+import re
+from threading import Lock
+
+PLACEHOLDER = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)")
+# Path -> (modification time, size, compiled template)
+TEMPLATES_CACHE = {}
+TEMPLATES_CACHE_LOCK = Lock()
+
+
+class Template:
+    """
+    Text split into literal parts and `$name` placeholders.
+    A placeholder is replaced by the variable with the same name,
+    placeholders without a variable are left as they are.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.literals = []
+        # (name, indentation of the line) for each placeholder
+        self.placeholders = []
+        position = 0
+        for match in PLACEHOLDER.finditer(source):
+            self.literals.append(source[position : match.start()])
+            line_start = source.rfind("\n", 0, match.start()) + 1
+            line = source[line_start : match.start()]
+            self.placeholders.append((match.group(1), len(line) - len(line.lstrip())))
+            position = match.end()
+
+        self.literals.append(source[position:])
+
+    @staticmethod
+    def __format(value, indentation, join_lists) -> str:
+        if join_lists and isinstance(value, list):
+            # One item per line, aligned with the placeholder
+            return ",\n".join(f"{' ' * indentation}{item}" for item in value).strip()
+
+        return str(value)
+
+    def render(self, variables: dict, join_lists=False) -> str:
+        """
+        Replace the placeholders with the given variables.
+
+        Args:
+            variables (dict): Values by variable name.
+            join_lists (bool): Render list values one item per line,
+                indented like the line of the placeholder.
+
+        Returns:
+            str: Rendered text.
+        """
+        parts = [self.literals[0]]
+        for (name, indentation), literal in zip(self.placeholders, self.literals[1:]):
+            if name in variables:
+                parts.append(self.__format(variables[name], indentation, join_lists))
+            else:
+                parts.append(f"${name}")
+
+            parts.append(literal)
+
+        return "".join(parts)
+
+
+def forget_templates(paths=None) -> None:
+    """
+    Forget the compiled templates of the given files, or all of them
+    """
+    with TEMPLATES_CACHE_LOCK:
+        if paths is None:
+            TEMPLATES_CACHE.clear()
+            return
+
+        paths = {os.path.normpath(p) for p in paths}
+        for path in [p for p in TEMPLATES_CACHE if os.path.normpath(p) in paths]:
+            del TEMPLATES_CACHE[path]
+
+
+def get_template(path: str) -> Template:
+    """
+    Return the compiled template for a file, it is
+    compiled again only if the file changed
+    """
+    stat = os.stat(path)
+    with TEMPLATES_CACHE_LOCK:
+        cached = TEMPLATES_CACHE.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+    with open(path, encoding="utf-8") as input_file:
+        template = Template(input_file.read())
+
+    with TEMPLATES_CACHE_LOCK:
+        TEMPLATES_CACHE[path] = (stat.st_mtime_ns, stat.st_size, template)
+
+    return template
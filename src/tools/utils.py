@@ -4,22 +4,18 @@ to check job statuses in HTCondor, query GitHub,
 handle strings, pulling repositories, among others.
 """
 
-import os
 import json
 import logging
 import subprocess
 import pathlib
 import re
 import datetime
+import time
 import importlib.util
 from typing import Optional
-from os import listdir
-from os.path import isdir
-from os.path import join as path_join
 from src.tools.connection_wrapper import ConnectionWrapper
 from src.tools.ssh_executor import SSHExecutor
-from environment import PUBLIC_STREAM_FOLDER, GRIDPACK_FILES_PATH
-
+from environment import PUBLIC_STREAM_FOLDER
 
 CONDOR_STATUS = {
     "0": "UNEXPLAINED",
@@ -33,9 +29,13 @@ CONDOR_STATUS = {
 
 
 BRANCHES_CACHE = {}
-CAMPAIGNS_CACHE = {}
-CARDS_CACHE = {}
-TUNES_CACHE = []
+# Repository -> {branch: head commit SHA}
+BRANCH_HEADS_CACHE = {}
+# Repository -> {page: (ETag, [(branch, head commit SHA)])}
+BRANCH_PAGES_CACHE = {}
+GITHUB_PAGE_SIZE = 100
+# Longest rate limit wait (s), longer ones use git instead of the API
+GITHUB_MAX_WAIT = 60
 UNABLE_CHECK_FILES = re.compile(r"ls: cannot")
 EMPTY_SPACE = " "
 
@@ -132,24 +132,147 @@ def get_latest_log_output_in_condor(gridpack, ssh=None):
         raise Exception(f"HTCondor status check returned {exit_code}")
 
 
+def get_rate_limit_wait(status: int, headers: dict) -> Optional[float]:
+    """
+    Return the seconds to wait before retrying a GitHub API request
+    that was rate limited, None if it was not
+    """
+    if status not in (403, 429):
+        return None
+
+    if headers.get("retry-after", "").isdigit():
+        return float(headers["retry-after"])
+
+    if headers.get("x-ratelimit-remaining") == "0":
+        reset = headers.get("x-ratelimit-reset", "")
+        if reset.isdigit():
+            return max(0.0, int(reset) - time.time()) + 1
+
+    # Secondary rate limits do not always say how long to wait
+    return 60.0 if status == 429 else None
+
+
+def fetch_github_branches(repository: str) -> Optional[list]:
+    """
+    Return (name, head commit SHA) of the branches of a GitHub repository
+    using the REST API. All pages are fetched, pages that did not change
+    since the last call only cost a "304 Not Modified" response.
+    None if the API is not available.
+    """
+    logger = logging.getLogger()
+    pages = BRANCH_PAGES_CACHE.setdefault(repository, {})
+    branches = []
+    page = 1
+    retries = 0
+    with ConnectionWrapper("https://api.github.com") as conn:
+        while True:
+            url = (
+                f"/repos/{repository}/branches?per_page={GITHUB_PAGE_SIZE}&page={page}"
+            )
+            headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
+            cached = pages.get(page)
+            if cached and cached[0]:
+                headers["If-None-Match"] = cached[0]
+
+            response = conn.request("GET", url, headers=headers)
+            if response is None:
+                return None
+
+            status, response_headers, body = response
+            wait = get_rate_limit_wait(status, response_headers)
+            if wait is not None:
+                if wait > GITHUB_MAX_WAIT or retries >= 3:
+                    logger.warning("GitHub API rate limited for %ss", int(wait))
+                    return None
+
+                logger.info("GitHub API rate limited, retrying in %ss", int(wait))
+                time.sleep(wait)
+                retries += 1
+                continue
+
+            if status == 304 and cached:
+                items = cached[1]
+            elif status == 200:
+                items = [
+                    (b["name"], b.get("commit", {}).get("sha"))
+                    for b in json.loads(body.decode("utf-8"))
+                    if b.get("name")
+                ]
+                pages[page] = (response_headers.get("etag"), items)
+            else:
+                logger.error("Error %s getting branches of %s", status, repository)
+                return None
+
+            branches.extend(items)
+            # Only full pages can have a next one
+            if len(items) < GITHUB_PAGE_SIZE:
+                break
+
+            page += 1
+            retries = 0
+
+    # Forget the pages after the last one, if there were more before
+    for old_page in [p for p in pages if p > page]:
+        del pages[old_page]
+
+    return branches
+
+
+def fetch_remote_branches(repository: str) -> Optional[list]:
+    """
+    Return (name, head commit SHA) of the branches of a GitHub repository
+    using git, without the REST API. None if it fails.
+    """
+    stdout, _, code = run_command(
+        f"git ls-remote --heads https://github.com/{repository}.git"
+    )
+    if code != 0 or stdout is None:
+        return None
+
+    branches = []
+    for line in stdout.splitlines():
+        sha, _, ref = line.partition("\t")
+        if ref.startswith("refs/heads/"):
+            branches.append((ref[len("refs/heads/") :], sha))
+
+    return branches
+
+
 def get_git_branches(repository, cache=True):
     """
     Return list of branches in the repostory
     """
     if not cache or repository not in BRANCHES_CACHE:
-        headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"}
-        with ConnectionWrapper("https://api.github.com") as conn:
-            response = conn.api("GET", f"/repos/{repository}/branches", headers=headers)
-
-        response = json.loads(response.decode("utf-8"))
         logger = logging.getLogger()
-        branches = [b["name"] for b in response if b.get("name")]
+        branches = fetch_github_branches(repository)
+        if branches is None:
+            logger.warning("Getting branches of %s with git ls-remote", repository)
+            branches = fetch_remote_branches(repository)
+
+        if branches is None:
+            if repository in BRANCHES_CACHE:
+                logger.error(
+                    "Could not get branches of %s, keeping old ones", repository
+                )
+                return BRANCHES_CACHE[repository]
+
+            raise RuntimeError(f"Could not get branches of {repository}")
+
         logger.debug("Found %s branches in %s", len(branches), repository)
-        BRANCHES_CACHE[repository] = branches
+        BRANCHES_CACHE[repository] = [name for name, _ in branches]
+        BRANCH_HEADS_CACHE[repository] = dict(branches)
 
     return BRANCHES_CACHE[repository]
 
 
+def get_git_branch_head(repository, branch) -> Optional[str]:
+    """
+    Return the head commit SHA of a branch as seen in the last
+    branches refresh, None if it is not known
+    """
+    return BRANCH_HEADS_CACHE.get(repository, {}).get(branch)
+
+
 def pull_git_repository(path: str, expected_remote: str) -> None:
     """
     Updates the content related to the GridpackFiles
@@ -208,95 +331,6 @@ def pull_git_repository(path: str, expected_remote: str) -> None:
         )
 
 
-def get_available_campaigns(cache=True):
-    """
-    Get campaigns and campaign templates
-    """
-    global CAMPAIGNS_CACHE  # pylint: disable=global-statement
-    if not cache or not CAMPAIGNS_CACHE:
-        CAMPAIGNS_CACHE = {}
-        campaigns_dir = os.path.join(GRIDPACK_FILES_PATH, "Campaigns")
-        campaigns = [
-            c for c in listdir(campaigns_dir) if isdir(path_join(campaigns_dir, c))
-        ]
-        for name in campaigns:
-            campaign_path = os.path.join(campaigns_dir, name)
-            generators = [
-                g for g in listdir(campaign_path) if isdir(path_join(campaign_path, g))
-            ]
-            with open(
-                path_join(campaign_path, f"{name}.json"), encoding="utf-8"
-            ) as campaign_json:
-                campaign_dict = json.load(campaign_json)
-
-            CAMPAIGNS_CACHE[name] = {
-                "generators": generators,
-                "tune": campaign_dict.get("tune", ""),
-            }
-
-    return CAMPAIGNS_CACHE
-
-
-def get_available_cards(cache=True):
-    """
-    Get generators, processes and datasets
-    """
-    global CARDS_CACHE  # pylint: disable=global-statement
-    if not cache or not CARDS_CACHE:
-        CARDS_CACHE = {}
-        cards_dir = os.path.join(GRIDPACK_FILES_PATH, "Cards")
-        generators = [c for c in listdir(cards_dir) if isdir(path_join(cards_dir, c))]
-        for generator in generators:
-            generator_path = os.path.join(cards_dir, generator)
-            processes = [
-                p
-                for p in listdir(generator_path)
-                if isdir(path_join(generator_path, p))
-            ]
-            for process in processes:
-                process_path = os.path.join(generator_path, process)
-                datasets = [
-                    d
-                    for d in listdir(process_path)
-                    if isdir(path_join(process_path, d))
-                ]
-                CARDS_CACHE.setdefault(generator, {})[process] = datasets
-
-    return CARDS_CACHE
-
-
-def get_available_tunes(cache=True):
-    """
-    Get list of available tunes
-    """
-    global TUNES_CACHE  # pylint: disable=global-statement
-    if not cache or not TUNES_CACHE:
-        imports_path = os.path.join(GRIDPACK_FILES_PATH, "Fragments", "imports.json")
-        if not os.path.isfile(imports_path):
-            TUNES_CACHE = []
-            return TUNES_CACHE
-
-        with open(imports_path, encoding="utf-8") as imports_file:
-            imports = json.load(imports_file)
-
-        TUNES_CACHE = sorted(list(set(imports.get("tune", []))))
-
-    return TUNES_CACHE
-
-
-def get_indentation(phrase, text):
-    """
-    Return indentation (number of spaces in the beginning of the line) for the
-    first line in text that has a "phrase"
-    """
-    lines = [l for l in text.split("\n") if phrase in l]
-    if not lines:
-        return 0
-
-    line = lines[0]
-    return len(line) - len(line.lstrip())
-
-
 def include_gridpack_ids(gridpack_id: str, effective_gridpack_id: str, content: str):
     """
     For content like text files, include the Gridpack ID
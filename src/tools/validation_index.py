@@ -0,0 +1,86 @@
+"""
+Module that keeps an immutable index of the values a gridpack can use:
+GEN productions branches, campaigns with their generators and the
+generator, process and dataset cards. It is built once from the
+repository tree and shared until the tree is replaced, so validating
+many gridpacks does not look them up once per gridpack.
+"""
+
+from types import MappingProxyType
+from threading import Lock
+from environment import GEN_REPOSITORY
+from src.tools.repository_tree import get_available_campaigns, get_available_cards
+from src.tools.utils import get_git_branches
+
+# Index and the cache objects it was built from
+VALIDATION_INDEX = {"sources": None, "index": None}
+VALIDATION_INDEX_LOCK = Lock()
+
+
+class ValidationIndex:
+    """
+    Read-only sets of branches, campaign generators
+    and cards, by campaign, generator and process
+    """
+
+    def __init__(self, branches, campaigns, cards):
+        self.branches = frozenset(branches)
+        self.campaigns = MappingProxyType(
+            {name: frozenset(c["generators"]) for name, c in campaigns.items()}
+        )
+        self.cards = MappingProxyType(
+            {
+                generator: MappingProxyType(
+                    {process: frozenset(d) for process, d in processes.items()}
+                )
+                for generator, processes in cards.items()
+            }
+        )
+
+    def get_errors(self, data: dict) -> list:
+        """
+        Return a description of every error in the branch,
+        campaign, generator, process and dataset of a gridpack
+        """
+        errors = []
+        genproductions = data["genproductions"]
+        if genproductions not in self.branches:
+            errors.append(f'Bad GEN productions branch "{genproductions}"')
+
+        campaign = data["campaign"]
+        generator = data["generator"]
+        if campaign not in self.campaigns:
+            errors.append(f'Bad campaign "{campaign}"')
+        elif generator not in self.campaigns[campaign]:
+            errors.append(f'Bad generator "{generator}"')
+
+        process = data["process"]
+        dataset = data["dataset"]
+        processes = self.cards.get(generator, {})
+        if process not in processes:
+            errors.append(f'Bad process "{process}"')
+        elif dataset not in processes[process]:
+            errors.append(f'Bad dataset "{dataset}"')
+
+        return errors
+
+
+def get_validation_index() -> ValidationIndex:
+    """
+    Return the index of the current repository tree, it is
+    built again only after the tree or the branches are replaced
+    """
+    sources = (
+        get_git_branches(GEN_REPOSITORY, cache=True),
+        get_available_campaigns(),
+        get_available_cards(),
+    )
+    with VALIDATION_INDEX_LOCK:
+        cached = VALIDATION_INDEX["sources"]
+        if cached and all(a is b for a, b in zip(cached, sources)):
+            return VALIDATION_INDEX["index"]
+
+        index = ValidationIndex(*sources)
+        VALIDATION_INDEX["sources"] = sources
+        VALIDATION_INDEX["index"] = index
+        return index